@@ -1,12 +1,14 @@
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes, CallbackQueryHandler, CommandHandler
-from database import Database
+from database import get_db, DB_PATH, DB_ARCHIVE_PATH
+from money import format_money
+from backup import get_backup_status
 from config import Config
 from datetime import datetime
 import logging
 
 logger = logging.getLogger(__name__)
-db = Database()
+db = get_db()
 
 def is_admin(user_id):
     """Проверяет, является ли пользователь администратором"""
@@ -25,8 +27,10 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
          InlineKeyboardButton("📈 Детальная статистика", callback_data="admin_detailed_stats")],
         [InlineKeyboardButton("🎮 Управление скинами", callback_data="admin_skins"),
          InlineKeyboardButton("👥 Управление пользователями", callback_data="admin_users")],
-        [InlineKeyboardButton("➕ Добавить скин", callback_data="admin_add_skin")],
-        [InlineKeyboardButton("💰 Изменить баланс", callback_data="admin_change_balance")]
+        [InlineKeyboardButton("➕ Добавить скин", callback_data="admin_add_skin"),
+         InlineKeyboardButton("📥 Импорт скинов", callback_data="admin_import_skins")],
+        [InlineKeyboardButton("💰 Изменить баланс", callback_data="admin_change_balance"),
+         InlineKeyboardButton("📑 Пополнения из файла", callback_data="admin_bulk_balance")]
     ]
 
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -43,8 +47,10 @@ async def admin_panel_main(query):
          InlineKeyboardButton("📈 Детальная статистика", callback_data="admin_detailed_stats")],
         [InlineKeyboardButton("🎮 Управление скинами", callback_data="admin_skins"),
          InlineKeyboardButton("👥 Управление пользователями", callback_data="admin_users")],
-        [InlineKeyboardButton("➕ Добавить скин", callback_data="admin_add_skin")],
-        [InlineKeyboardButton("💰 Изменить баланс", callback_data="admin_change_balance")]
+        [InlineKeyboardButton("➕ Добавить скин", callback_data="admin_add_skin"),
+         InlineKeyboardButton("📥 Импорт скинов", callback_data="admin_import_skins")],
+        [InlineKeyboardButton("💰 Изменить баланс", callback_data="admin_change_balance"),
+         InlineKeyboardButton("📑 Пополнения из файла", callback_data="admin_bulk_balance")]
     ]
 
     await query.edit_message_text(
@@ -73,10 +79,16 @@ async def admin_button_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         await show_skin_management(query)
     elif callback_data == "admin_users":
         await show_user_management(query)
+    elif callback_data.startswith("admin_users_page_"):
+        await show_user_management(query, int(callback_data.split("_")[-1]))
     elif callback_data == "admin_add_skin":
         await start_add_skin(query, context)
+    elif callback_data == "admin_import_skins":
+        await start_import_skins(query, context)
     elif callback_data == "admin_change_balance":
         await start_change_balance(query, context)
+    elif callback_data == "admin_bulk_balance":
+        await start_bulk_balance(query, context)
     elif callback_data == "admin_main":
         await admin_panel_main(query)
     elif callback_data == "catalog":
@@ -87,7 +99,8 @@ async def admin_button_handler(update: Update, context: ContextTypes.DEFAULT_TYP
 
 async def show_admin_stats(query):
     """Показывает статистику бота"""
-    stats = db.get_bot_stats()
+    stats = await db.get_bot_stats()
+    writer_stats = await db.get_writer_stats()
 
     # Добавляем время обновления чтобы сообщение всегда было разным
     import time
@@ -99,6 +112,8 @@ async def show_admin_stats(query):
         f"🎮 Всего скинов: {stats['total_skins']}\n"
         f"🛒 Всего покупок: {stats['total_purchases']}\n"
         f"💰 Общий оборот: {stats['total_revenue']} ₽\n"
+        f"📝 Очередь записи: {writer_stats.get('queue_depth', 0)} "
+        f"(макс. {writer_stats.get('max_queue_depth', 0)}, ошибок: {writer_stats.get('failed', 0)})\n"
         f"\n🕐 Обновлено: {datetime.now().strftime('%H:%M:%S')}"  # Добавляем время
     )
 
@@ -127,13 +142,39 @@ async def start_add_skin(query, context):
 
     context.user_data['waiting_for_skin'] = True
 
+async def start_import_skins(query, context):
+    """Начинает массовый импорт скинов из файла"""
+    await query.edit_message_text(
+        "📥 Импорт скинов из файла\n\n"
+        "Отправьте файл .csv или .json со столбцами:\n"
+        "`name, description, price, rarity, quantity, roblox_id, image_url`\n\n"
+        "Пример CSV:\n"
+        "`name,description,price,rarity,quantity,roblox_id,image_url`\n"
+        "`Огненный меч,Мощное оружие,1500,Godly,5,fire_sword_001,https://example.com/fire.jpg`\n\n"
+        "Скины с уже существующим `roblox_id` обновляются, количество заменяется новым.\n"
+        "Строки с ошибками пропускаются, остальные импортируются.",
+        parse_mode='Markdown'
+    )
+
+    context.user_data['waiting_for_skin_import'] = True
+
 async def show_detailed_stats(query):
     """Показывает детальную статистику"""
-    stats = db.get_detailed_stats()
+    stats = await db.get_detailed_stats()
 
     import time
     timestamp = int(time.time())
 
+    if not stats:
+        await query.edit_message_text(
+            "❌ Не удалось построить статистику, попробуйте позже",
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("🔄 Повторить", callback_data=f"admin_detailed_stats_{timestamp}")],
+                [InlineKeyboardButton("🔙 Назад", callback_data="admin_main")]
+            ])
+        )
+        return
+
     stats_text = f"📊 Детальная статистика\n\n"
 
     # Основная статистика
@@ -150,7 +191,7 @@ async def show_detailed_stats(query):
     stats_text += "\n🏆 Топ пользователей:\n"
     for i, user in enumerate(stats['top_users'][:5], 1):
         username = f"@{user['username']}" if user['username'] else user['first_name']
-        stats_text += f"{i}. {username}: {user['balance']} ₽\n"
+        stats_text += f"{i}. {username}: {format_money(user['balance_kop'])} ₽\n"
 
     stats_text += "\n🔥 Популярные скины:\n"
     for i, skin in enumerate(stats['popular_skins'][:5], 1):
@@ -169,23 +210,34 @@ async def show_detailed_stats(query):
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
 
-async def show_user_management(query):
-    """Показывает управление пользователями с действиями"""
-    users = db.get_all_users()
+USERS_PER_PAGE = 5
+
+async def show_user_management(query, page=0):
+    """Показывает управление пользователями с действиями (постранично)"""
+    users, total = await db.get_users_page(page, USERS_PER_PAGE)
+    total_pages = max((total + USERS_PER_PAGE - 1) // USERS_PER_PAGE, 1)
 
-    user_text = "👥 Управление пользователями\n\n"
+    user_text = f"👥 Управление пользователями (страница {page + 1}/{total_pages}, всего {total})\n\n"
 
-    for user in users[:5]:
+    for user in users:
         user_text += f"🆔 {user['user_id']} | {user['first_name']}"
         if user['username']:
             user_text += f" (@{user['username']})"
-        user_text += f"\n💰 Баланс: {user['balance']} ₽\n\n"
+        user_text += f"\n💰 Баланс: {format_money(user['balance_kop'])} ₽\n\n"
 
-    if len(users) > 5:
-        user_text += f"... и еще {len(users) - 5} пользователей\n"
+    keyboard = []
 
-    keyboard = [
-        [InlineKeyboardButton("💰 Изменить баланс", callback_data="admin_change_balance")],
+    pagination_buttons = []
+    if page > 0:
+        pagination_buttons.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"admin_users_page_{page - 1}"))
+    if page + 1 < total_pages:
+        pagination_buttons.append(InlineKeyboardButton("Вперед ➡️", callback_data=f"admin_users_page_{page + 1}"))
+    if pagination_buttons:
+        keyboard.append(pagination_buttons)
+
+    keyboard += [
+        [InlineKeyboardButton("💰 Изменить баланс", callback_data="admin_change_balance"),
+         InlineKeyboardButton("📑 Пополнения из файла", callback_data="admin_bulk_balance")],
         [InlineKeyboardButton("📊 Детальная статистика", callback_data="admin_detailed_stats")],
         [InlineKeyboardButton("🔙 Назад", callback_data="admin_main")]
     ]
@@ -209,23 +261,39 @@ async def start_change_balance(query, context):
     # Устанавливаем состояние для ожидания ввода баланса
     context.user_data['waiting_for_balance'] = True
 
+async def start_bulk_balance(query, context):
+    """Начинает пакетное изменение балансов из файла"""
+    await query.edit_message_text(
+        "📑 Пополнения из файла\n\n"
+        "Отправьте файл .csv, каждая строка:\n"
+        "user_id, сумма, примечание\n\n"
+        "Пример:\n"
+        "123456789, 500, Оплата картой №42\n"
+        "987654321, -150.50, Возврат\n\n"
+        "Суммы прибавляются к текущему балансу (отрицательные - списываются).\n"
+        "Все строки применяются одной операцией, строки с ошибками вернутся отдельным файлом."
+    )
+
+    context.user_data['waiting_for_balance_file'] = True
+
 async def show_skin_management(query):
     """Показывает управление скинами с действиями"""
-    skins = db.get_all_skins()
+    skins = await db.get_all_skins()
 
     skin_text = "🎮 Управление скинами\n\n"
 
     for skin in skins[:5]:  # Показываем первые 5
         skin_text += f"🆔 {skin['skin_id']} | {skin['name']}\n"
         skin_text += f"💰 {skin['price']} ₽ | 🎲 {skin['rarity']}\n"
-        skin_text += f"📦 В наличии: {skin['quantity']}\n"
+        skin_text += f"📦 В наличии: {skin['quantity']} (в корзинах: {skin['reserved']})\n"
         skin_text += f"❌ /delete_skin_{skin['skin_id']}\n\n"
 
     if len(skins) > 5:
         skin_text += f"... и еще {len(skins) - 5} скинов\n"
 
     keyboard = [
-        [InlineKeyboardButton("➕ Добавить скин", callback_data="admin_add_skin")],
+        [InlineKeyboardButton("➕ Добавить скин", callback_data="admin_add_skin"),
+         InlineKeyboardButton("📥 Импорт скинов", callback_data="admin_import_skins")],
         [InlineKeyboardButton("🗑️ Удалить скин", callback_data="admin_delete_skin")],
         [InlineKeyboardButton("📊 Статистика скинов", callback_data="admin_detailed_stats")],
         [InlineKeyboardButton("🔙 Назад", callback_data="admin_main")]
@@ -236,6 +304,75 @@ async def show_skin_management(query):
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
 
+def format_size(size):
+    """Размер файла для сообщений: 1536 -> '1.5 КБ'"""
+    for unit in ('байт', 'КБ', 'МБ'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'байт' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ГБ"
+
+def format_age(seconds):
+    """Возраст копии для сообщений: 5400 -> '1 ч 30 мин'"""
+    minutes = int(seconds // 60)
+    if minutes < 60:
+        return f"{minutes} мин"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 48:
+        return f"{hours} ч {minutes} мин"
+    return f"{hours // 24} дн"
+
+async def backup_status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показывает состояние резервных копий (/backup_status)"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ Нет доступа")
+        return
+
+    text = "💾 Резервные копии\n"
+    for title, path in (("Основная база", DB_PATH), ("Архив транзакций", DB_ARCHIVE_PATH)):
+        status = get_backup_status(path)
+        text += f"\n{title}:\n"
+        if status['latest']:
+            latest = status['latest']
+            text += (
+                f"🕐 Последняя копия: {format_age(latest['age'])} назад\n"
+                f"📦 Размер: {format_size(latest['size'])}\n"
+            )
+        else:
+            text += "⚠️ Копий еще нет\n"
+        text += f"🗂 Всего копий: {status['count']} ({format_size(status['total_size'])})\n"
+        if status['last_error']:
+            text += f"❌ Ошибка последнего запуска: {status['last_error']}\n"
+
+    await update.message.reply_text(text)
+
+async def db_profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показывает самые затратные методы базы данных (/db_profile)"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ Нет доступа")
+        return
+
+    stats = await db.get_profile_stats()
+    if not stats or not stats['methods']:
+        await update.message.reply_text("📊 Статистика запросов пуста (профилирование выключено или запросов еще не было)")
+        return
+
+    text = "📊 Методы базы данных (по суммарному времени)\n\n"
+    for name, method in list(stats['methods'].items())[:10]:
+        text += (
+            f"{name}: {method['calls']} вызовов, ср. {method['avg_ms']} мс, "
+            f"p95 ≤{method['p95_ms']} мс, макс. {method['max_ms']} мс"
+        )
+        if method['errors']:
+            text += f", ошибок: {method['errors']}"
+        text += "\n"
+
+    text += f"\n🐢 Медленных запросов: {stats['slow_statements']}"
+    if stats['plan_violations']:
+        text += f"\n❌ Полный просмотр таблицы: {', '.join(stats['plan_violations'])}"
+
+    await update.message.reply_text(text)
+
 async def start_delete_skin(query, context):
     """Начинает процесс удаления скина"""
     await query.edit_message_text(
@@ -0,0 +1,186 @@
+"""Резервные копии базы бота без остановки бота.
+
+Копия снимается через online backup API SQLite за один шаг: это одна
+транзакция чтения, и в режиме WAL запись бота она не блокирует. Копия
+порциями с паузами не подходит - SQLite начинает такую копию заново
+после каждой записи из другого соединения, а фоновая запись бота
+фиксирует изменения каждые ~200 мс, и копия могла бы не закончиться
+никогда. Готовая копия проверяется (PRAGMA quick_check),
+по желанию сжимается в .gz, старые копии удаляются (хранятся BACKUP_KEEP
+последних).
+
+Файлы копий: <каталог>/<имя базы>-ГГГГММДД-ЧЧММСС.db[.gz]
+"""
+import os
+import glob
+import gzip
+import time
+import shutil
+import sqlite3
+import logging
+import tempfile
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', '7'))
+BACKUP_COMPRESS = os.getenv('BACKUP_COMPRESS', '1') == '1'
+
+# Одновременно снимается только одна копия (задача по расписанию и manage.py в одном процессе)
+_backup_lock = threading.Lock()
+
+# Результат последнего запуска в этом процессе: {путь к базе: результат}
+last_results = {}
+
+
+def backup_name(db_path):
+    """Префикс файлов копий: skins_bot.db -> skins_bot"""
+    return os.path.splitext(os.path.basename(db_path))[0]
+
+
+def list_backups(db_path, backup_dir=BACKUP_DIR):
+    """Возвращает копии базы от новых к старым"""
+    pattern = os.path.join(backup_dir, f"{backup_name(db_path)}-*.db*")
+    files = [path for path in glob.glob(pattern) if path.endswith('.db') or path.endswith('.db.gz')]
+    return sorted(files, key=os.path.getmtime, reverse=True)
+
+
+def _copy_online(source_path, target_path):
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        with target:
+            # Один шаг (pages=-1): копия не перезапускается из-за записи других соединений
+            source.backup(target)
+        check = target.execute('PRAGMA quick_check').fetchone()[0]
+        if check != 'ok':
+            raise RuntimeError(f"копия повреждена: {check}")
+    finally:
+        target.close()
+        source.close()
+
+
+def _compress(path):
+    with open(path, 'rb') as source, gzip.open(f"{path}.gz", 'wb', compresslevel=6) as target:
+        shutil.copyfileobj(source, target, 1024 * 1024)
+    os.remove(path)
+    return f"{path}.gz"
+
+
+def rotate_backups(db_path, backup_dir=BACKUP_DIR, keep=BACKUP_KEEP):
+    """Удаляет копии сверх keep последних; возвращает удаленные файлы"""
+    removed = list_backups(db_path, backup_dir)[keep:] if keep > 0 else []
+    for path in removed:
+        os.remove(path)
+        logger.info(f"Удалена старая резервная копия {path}")
+    return removed
+
+
+def backup_database(db_path, backup_dir=BACKUP_DIR, compress=BACKUP_COMPRESS, keep=BACKUP_KEEP):
+    """Снимает резервную копию базы db_path.
+
+    Возвращает словарь {'path', 'size', 'duration', 'removed'}. При ошибке
+    бросает исключение; недописанный файл удаляется.
+    """
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(f"база {db_path} не найдена")
+
+    with _backup_lock:
+        os.makedirs(backup_dir, exist_ok=True)
+        started = time.monotonic()
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        path = os.path.join(backup_dir, f"{backup_name(db_path)}-{stamp}.db")
+        partial = f"{path}.partial"
+
+        try:
+            _copy_online(db_path, partial)
+            os.replace(partial, path)
+            if compress:
+                path = _compress(path)
+        except Exception:
+            for leftover in (partial, path):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+            raise
+
+        result = {
+            'path': path,
+            'size': os.path.getsize(path),
+            'duration': round(time.monotonic() - started, 2),
+            'removed': rotate_backups(db_path, backup_dir, keep),
+        }
+        logger.info(f"Резервная копия {path} готова: {result['size']} байт за {result['duration']} с")
+        return result
+
+
+def run_backup(db_path, backup_dir=BACKUP_DIR, **options):
+    """Снимает копию и запоминает результат для статуса; не бросает исключений"""
+    try:
+        result = backup_database(db_path, backup_dir, **options)
+        last_results[db_path] = {**result, 'finished_at': datetime.now(), 'error': None}
+        return result
+    except Exception as e:
+        logger.error(f"Ошибка резервного копирования {db_path}: {e}")
+        last_results[db_path] = {'finished_at': datetime.now(), 'error': str(e)}
+        return None
+
+
+def get_backup_status(db_path, backup_dir=BACKUP_DIR):
+    """Возраст и размер последней копии, количество копий и ошибка последнего запуска для этой базы"""
+    backups = list_backups(db_path, backup_dir)
+    status = {
+        'count': len(backups),
+        'total_size': sum(os.path.getsize(path) for path in backups),
+        'last_error': last_results.get(db_path, {}).get('error'),
+        'latest': None,
+    }
+    if backups:
+        latest = backups[0]
+        status['latest'] = {
+            'path': latest,
+            'size': os.path.getsize(latest),
+            'age': time.time() - os.path.getmtime(latest),
+        }
+    return status
+
+
+def restore_backup(backup_path, db_path):
+    """Восстанавливает базу db_path из копии (.db или .db.gz).
+
+    Бот должен быть остановлен. Перед восстановлением текущая база
+    сохраняется рядом как <база>.before-restore. Восстановление идет
+    через backup API, поэтому файлы WAL текущей базы обновляются корректно.
+    """
+    if not os.path.exists(backup_path):
+        raise FileNotFoundError(f"копия {backup_path} не найдена")
+
+    with _backup_lock, tempfile.TemporaryDirectory() as tmp:
+        source_path = backup_path
+        if backup_path.endswith('.gz'):
+            source_path = os.path.join(tmp, 'restore.db')
+            with gzip.open(backup_path, 'rb') as source, open(source_path, 'wb') as target:
+                shutil.copyfileobj(source, target, 1024 * 1024)
+
+        source = sqlite3.connect(source_path)
+        try:
+            check = source.execute('PRAGMA integrity_check').fetchone()[0]
+            if check != 'ok':
+                raise RuntimeError(f"копия повреждена: {check}")
+
+            if os.path.exists(db_path):
+                safety_path = f"{db_path}.before-restore"
+                _copy_online(db_path, safety_path)
+                logger.info(f"Текущая база сохранена в {safety_path}")
+
+            target = sqlite3.connect(db_path)
+            try:
+                with target:
+                    source.backup(target)
+            finally:
+                target.close()
+        finally:
+            source.close()
+
+    logger.info(f"База {db_path} восстановлена из {backup_path}")
@@ -0,0 +1,252 @@
+import time
+import queue
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Маркер остановки потока записи
+_STOP = object()
+
+
+class _FlushRequest:
+    """Маркер в очереди: записать все, что было поставлено до него"""
+
+    def __init__(self):
+        self.done = threading.Event()
+
+
+class WriterStats:
+    """Счетчики фоновой записи"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queued = 0          # записей поставлено в очередь
+        self.written = 0         # записей сохранено в базе
+        self.batches = 0         # транзакций (commit) фоновой записи
+        self.failed = 0          # записей, которые не удалось сохранить
+        self.dropped = 0         # записей, отброшенных из-за переполнения очереди
+        self.max_queue_depth = 0
+        self.last_batch_size = 0
+        self.last_flush_time = 0.0
+
+    def increment(self, name, value=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def observe_depth(self, depth):
+        with self._lock:
+            if depth > self.max_queue_depth:
+                self.max_queue_depth = depth
+
+    def record_batch(self, size, duration):
+        with self._lock:
+            self.written += size
+            self.batches += 1
+            self.last_batch_size = size
+            self.last_flush_time = duration
+
+    def unfinished(self):
+        with self._lock:
+            return self.queued - self.written - self.failed
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'queued': self.queued,
+                'written': self.written,
+                'batches': self.batches,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'max_queue_depth': self.max_queue_depth,
+                'last_batch_size': self.last_batch_size,
+                'last_flush_time': round(self.last_flush_time, 4),
+            }
+
+
+class BatchWriter:
+    """Отложенная запись некритичных данных пачками.
+
+    Записи (SQL и параметры) ставятся в очередь и сохраняются фоновым
+    потоком одной транзакцией - раз в flush_interval_ms миллисекунд или
+    как только накопится max_batch записей. Вместо commit (и fsync) на
+    каждую запись получается один commit на пачку, а обработчики не ждут
+    диска. close() записывает все, что осталось в очереди.
+
+    Подходит только для записей, потеря которых при падении процесса
+    допустима: журнал транзакций, регистрация пользователя и т.п.
+    Деньги и остатки так писать нельзя.
+    """
+
+    def __init__(self, pool, flush_interval_ms=200, max_batch=500, max_queue=100000):
+        self.pool = pool
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+        self.stats = WriterStats()
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending_keys = Counter()  # ключ -> несохраненных записей с этим ключом
+        self._keys_lock = threading.Lock()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, sql, params=(), key=None):
+        """Ставит запись в очередь. Возвращает False, если очередь переполнена.
+
+        key - необязательный ключ записи (например, ('user', user_id)), по
+        которому pending(key) узнает, ждет ли эта запись сохранения.
+        """
+        self._ensure_started()
+        if key is not None:
+            # Считаем до постановки в очередь: поток записи может успеть ее сохранить раньше
+            with self._keys_lock:
+                self._pending_keys[key] += 1
+        try:
+            self._queue.put_nowait((sql, params, key))
+        except queue.Full:
+            if key is not None:
+                self._release_keys([(sql, params, key)])
+            self.stats.increment('dropped')
+            logger.error(f"Очередь фоновой записи переполнена, запись отброшена: {' '.join(sql.split()[:3])}")
+            return False
+
+        self.stats.increment('queued')
+        self.stats.observe_depth(self._queue.qsize())
+        return True
+
+    def pending(self, key=None):
+        """Количество записей, еще не сохраненных в базе (в очереди и в текущей пачке).
+
+        С key - только записей, поставленных с этим ключом.
+        """
+        if key is None:
+            return self.stats.unfinished()
+        with self._keys_lock:
+            return self._pending_keys.get(key, 0)
+
+    def _release_keys(self, batch):
+        with self._keys_lock:
+            for _, _, key in batch:
+                if key is not None:
+                    self._pending_keys[key] -= 1
+                    if self._pending_keys[key] <= 0:
+                        del self._pending_keys[key]
+
+    def flush(self, timeout=5.0):
+        """Дожидается сохранения всех записей, поставленных до вызова"""
+        if self._thread is None or not self._thread.is_alive():
+            return self.pending() == 0
+
+        request = _FlushRequest()
+        self._queue.put(request)
+        return request.done.wait(timeout)
+
+    def close(self, timeout=10.0):
+        """Сохраняет оставшиеся записи и останавливает поток"""
+        with self._thread_lock:
+            thread, self._thread = self._thread, None
+
+        if thread is None or not thread.is_alive():
+            return
+
+        self._queue.put(_STOP)
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.error(f"Фоновая запись не завершилась за {timeout} с, в очереди: {self.pending()}")
+        else:
+            logger.info("Фоновая запись остановлена, очередь сохранена")
+
+    def get_stats(self):
+        """Возвращает счетчики и текущую глубину очереди"""
+        stats = self.stats.as_dict()
+        stats['queue_depth'] = self._queue.qsize()
+        return stats
+
+    def _run(self):
+        batch = []
+        waiters = []
+        stop = False
+
+        while not stop:
+            # Ждем первую запись пачки, затем добираем остальные до дедлайна
+            deadline = None
+            while len(batch) < self.max_batch:
+                timeout = self.flush_interval if deadline is None else deadline - time.monotonic()
+                if deadline is not None and timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+
+                if item is _STOP:
+                    stop = True
+                    break
+                if isinstance(item, _FlushRequest):
+                    waiters.append(item)
+                    break
+
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if batch:
+                self._write_batch(batch)
+                self._release_keys(batch)
+                batch = []
+
+            for waiter in waiters:
+                waiter.done.set()
+            waiters = []
+
+        # Забираем то, что успели поставить после маркера остановки
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(item, _FlushRequest):
+                waiters.append(item)
+            elif item is not _STOP:
+                batch.append(item)
+
+        if batch:
+            self._write_batch(batch)
+            self._release_keys(batch)
+        for waiter in waiters:
+            waiter.done.set()
+
+    def _write_batch(self, batch):
+        conn = self.pool.get_connection()
+        started = time.perf_counter()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for sql, params, _ in batch:
+                conn.execute(sql, params)
+            conn.commit()
+            self.stats.record_batch(len(batch), time.perf_counter() - started)
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Ошибка фоновой записи пачки из {len(batch)} записей: {e}")
+            self._write_one_by_one(conn, batch)
+
+    def _write_one_by_one(self, conn, batch):
+        # Одна ошибочная запись не должна терять всю пачку
+        written = 0
+        for sql, params, _ in batch:
+            try:
+                conn.execute(sql, params)
+                conn.commit()
+                written += 1
+            except Exception as e:
+                conn.rollback()
+                self.stats.increment('failed')
+                logger.error(f"Ошибка фоновой записи: {e}")
+        if written:
+            self.stats.record_batch(written, 0.0)
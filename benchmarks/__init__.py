@@ -0,0 +1,9 @@
+"""Нагрузочные замеры базы данных и обработчиков бота.
+
+Запускаются из корня репозитория как модули:
+
+    python -m benchmarks.generate_dataset --db bench.db
+    python -m benchmarks.bench_database --db bench.db --output results.json
+    python -m benchmarks.load_test --db bench.db --users 2000 --duration 60
+    python -m benchmarks.fake_bot_api --port 8081 --updates 20000 --rate 200
+"""
@@ -0,0 +1,328 @@
+"""Замер времени методов Database на синтетической базе.
+
+    python -m benchmarks.bench_database --db bench.db --iterations 200 --output results.json
+    python -m benchmarks.bench_database --db bench.db --baseline results.json
+
+База (и ее архив) сначала копируется во временный каталог: замеры корзины
+и покупки меняют данные, а исходная база должна оставаться одинаковой
+для сравнения прогонов. Для покупок заводятся отдельные пользователи
+с балансом, чтобы каждая покупка проходила по полному пути.
+
+Для каждого метода печатаются p50/p95/p99 в миллисекундах; --output
+сохраняет результаты в JSON (вместе с коммитом и объемами базы), --baseline
+сравнивает p95 с результатами предыдущего прогона. Тяжелые отчеты
+выполняются в HEAVY_FRACTION раз реже остальных методов.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import sqlite3
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+
+from database import Database, archive_path_for
+from db_profiler import DB_PROFILE
+from benchmarks.generate_dataset import dataset_summary
+
+logger = logging.getLogger(__name__)
+
+HEAVY_FRACTION = 20
+MIN_HEAVY_ITERATIONS = 3
+BUYER_ID_BASE = 900_000_000_000
+BUYER_BALANCE_KOP = 10_000_000 * 100
+SEARCH_TERMS = ['меч', 'нож', 'огн', 'золотой клинок', 'древний', 'револьвер', 'ледяной серп', 'неон']
+
+
+class BenchCase:
+    """Замер одного метода: run выполняется с замером времени, setup - перед ним без замера"""
+
+    def __init__(self, name, run, setup=None, heavy=False):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.heavy = heavy
+
+
+class Workload:
+    """Выборки из базы, на которых выполняются замеры"""
+
+    def __init__(self, database, rng, buyers):
+        self.database = database
+        self.rng = rng
+        conn = database.get_connection()
+
+        self.user_ids = [row[0] for row in conn.execute(
+            'SELECT user_id FROM users WHERE user_id < ? ORDER BY RANDOM() LIMIT 1000', (BUYER_ID_BASE,)
+        )]
+        # Пользователи с большими инвентарями и корзинами - самый тяжелый случай для экранов бота
+        self.inventory_users = [row[0] for row in conn.execute(
+            'SELECT user_id FROM user_inventory GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 200'
+        )] or self.user_ids
+        self.cart_users = [row[0] for row in conn.execute(
+            'SELECT user_id FROM user_cart GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 200'
+        )] or self.user_ids
+        self.skin_ids = [row[0] for row in conn.execute('SELECT skin_id FROM skins')]
+        if not self.user_ids or not self.skin_ids:
+            raise RuntimeError("в базе нет пользователей или скинов - сначала запустите generate_dataset")
+
+        self.buyers = self._create_buyers(buyers)
+        self._next_buyer = 0
+
+    def _create_buyers(self, count):
+        """Заводит пользователей с большим балансом для замеров корзины и покупки"""
+        buyers = [BUYER_ID_BASE + index for index in range(count)]
+        for user_id in buyers:
+            self.database.add_user(user_id, f"bench{user_id}", "Bench")
+        credits = [
+            {'user_id': user_id, 'delta_kop': BUYER_BALANCE_KOP, 'note': 'benchmark', 'line': line}
+            for line, user_id in enumerate(buyers, 1)
+        ]
+        result = self.database.apply_balance_credits(credits)
+        if not result or result['failed']:
+            raise RuntimeError("не удалось пополнить баланс покупателей")
+        return buyers
+
+    def user(self):
+        return self.rng.choice(self.user_ids)
+
+    def inventory_user(self):
+        return self.rng.choice(self.inventory_users)
+
+    def cart_user(self):
+        return self.rng.choice(self.cart_users)
+
+    def skin(self):
+        return self.rng.choice(self.skin_ids)
+
+    def search_term(self):
+        return self.rng.choice(SEARCH_TERMS)
+
+    def next_buyer(self):
+        """Новый покупатель на каждую итерацию: у него нет скинов в инвентаре и корзине"""
+        buyer = self.buyers[self._next_buyer % len(self.buyers)]
+        self._next_buyer += 1
+        return buyer
+
+    def fill_cart(self, user_id, items=1):
+        """Кладет в корзину items скинов из наличия; возвращает их ID"""
+        added = []
+        for _ in range(items * 20):
+            skin_id = self.skin()
+            if self.database.add_to_cart(user_id, skin_id).get('success'):
+                added.append(skin_id)
+                if len(added) == items:
+                    break
+        if not added:
+            raise RuntimeError("не удалось положить скины в корзину - в базе закончился товар")
+        return added
+
+
+def build_cases(database, workload):
+    """Список замеров: все методы, которые вызывают обработчики бота и админ-панель"""
+    state = {}
+
+    def prepare_cart(items):
+        def setup():
+            state['buyer'] = workload.next_buyer()
+            state['skins'] = workload.fill_cart(state['buyer'], items)
+        return setup
+
+    def prepare_buyer():
+        state['buyer'] = workload.next_buyer()
+
+    return [
+        BenchCase('get_user', lambda: database.get_user(workload.user())),
+        BenchCase('get_balance', lambda: database.get_balance(workload.user())),
+        BenchCase('get_all_skins', lambda: database.get_all_skins()),
+        BenchCase('get_catalog_snapshot', lambda: database.get_catalog_snapshot()),
+        BenchCase('get_search_catalog', lambda: database.get_search_catalog()),
+        BenchCase('get_skin_by_id', lambda: database.get_skin_by_id(workload.skin())),
+        BenchCase('search_skins', lambda: database.search_skins(workload.search_term())),
+        BenchCase('search_skins_page', lambda: database.search_skins_page(workload.search_term(), 0, 5)),
+        BenchCase('search_skin_ids', lambda: database.search_skin_ids(workload.search_term())),
+        BenchCase('get_user_inventory', lambda: database.get_user_inventory(workload.inventory_user())),
+        BenchCase('get_inventory_with_details', lambda: database.get_inventory_with_details(workload.inventory_user())),
+        BenchCase('get_inventory_page', lambda: database.get_inventory_page(workload.inventory_user(), 2, 5)),
+        BenchCase('get_user_cart', lambda: database.get_user_cart(workload.cart_user())),
+        BenchCase('get_cart_count', lambda: database.get_cart_count(workload.cart_user())),
+        BenchCase('get_user_purchases', lambda: database.get_user_purchases(workload.inventory_user())),
+        BenchCase('get_balance_history', lambda: database.get_balance_history(workload.user())),
+        BenchCase('get_user_transactions', lambda: database.get_user_transactions(workload.user(), 20, True)),
+        BenchCase('replay_balance', lambda: database.replay_balance(workload.user())),
+        BenchCase('add_user', lambda: database.add_user(workload.user(), 'bench', 'Bench')),
+        BenchCase('update_user_balance', lambda: database.update_user_balance(workload.user(), 1, 'benchmark')),
+        BenchCase('add_to_cart', lambda: database.add_to_cart(state['buyer'], workload.skin()), setup=prepare_buyer),
+        BenchCase('remove_from_cart', lambda: database.remove_from_cart(state['buyer'], state['skins'][0]),
+                  setup=prepare_cart(1)),
+        BenchCase('clear_user_cart', lambda: database.clear_user_cart(state['buyer']), setup=prepare_cart(3)),
+        # Путь покупки: корзина из трех скинов оформляется одной транзакцией
+        BenchCase('checkout', lambda: database.checkout(state['buyer']), setup=prepare_cart(3)),
+        BenchCase('get_users_page', lambda: database.get_users_page(workload.rng.randrange(100), 5)),
+        BenchCase('get_bot_stats', lambda: database.get_bot_stats()),
+        BenchCase('get_detailed_stats', lambda: database.get_detailed_stats(), heavy=True),
+        BenchCase('get_transaction_totals', lambda: database.get_transaction_totals(), heavy=True),
+        BenchCase('get_archive_stats', lambda: database.get_archive_stats(), heavy=True),
+        BenchCase('get_all_users', lambda: database.get_all_users(), heavy=True),
+        BenchCase('audit_balances', lambda: database.audit_balances(), heavy=True),
+    ]
+
+
+def percentile(sorted_values, fraction):
+    """Перцентиль по ближайшему рангу"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def summarize(timings):
+    values = sorted(timing * 1000 for timing in timings)
+    return {
+        'iterations': len(values),
+        'p50_ms': round(percentile(values, 0.50), 3),
+        'p95_ms': round(percentile(values, 0.95), 3),
+        'p99_ms': round(percentile(values, 0.99), 3),
+        'mean_ms': round(sum(values) / len(values), 3),
+        'min_ms': round(values[0], 3),
+        'max_ms': round(values[-1], 3),
+    }
+
+
+def run_case(case, iterations, warmup):
+    """Выполняет замер; возвращает список длительностей в секундах"""
+    if case.heavy:
+        iterations = max(iterations // HEAVY_FRACTION, MIN_HEAVY_ITERATIONS)
+        warmup = min(warmup, 1)
+
+    timings = []
+    for iteration in range(warmup + iterations):
+        if case.setup:
+            case.setup()
+        started = time.perf_counter()
+        case.run()
+        elapsed = time.perf_counter() - started
+        if iteration >= warmup:
+            timings.append(elapsed)
+    return timings
+
+
+def copy_database(source_path, target_path):
+    """Копирует базу через backup API (корректно и для базы в режиме WAL)"""
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(db_path, iterations=200, warmup=10, seed=1, only=None):
+    """Выполняет замеры на копии базы db_path; возвращает результаты в виде словаря для JSON"""
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(f"база {db_path} не найдена")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_path = os.path.join(tmp, 'bench.db')
+        copy_database(db_path, bench_path)
+        if os.path.exists(archive_path_for(db_path)):
+            copy_database(archive_path_for(db_path), archive_path_for(bench_path))
+
+        dataset = dataset_summary(bench_path)
+        database = Database(bench_path)
+        try:
+            rng = random.Random(seed)
+            # На каждую итерацию замеров корзины и покупки - новый покупатель
+            workload = Workload(database, rng, buyers=(iterations + warmup) * 4)
+
+            results = {}
+            for case in build_cases(database, workload):
+                if only and case.name not in only:
+                    continue
+                results[case.name] = summarize(run_case(case, iterations, warmup))
+                print(f"⏱️ {case.name:28} p50 {results[case.name]['p50_ms']:9.3f}  "
+                      f"p95 {results[case.name]['p95_ms']:9.3f}  p99 {results[case.name]['p99_ms']:9.3f} мс")
+        finally:
+            database.close()
+
+    return {
+        'meta': {
+            'commit': current_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'iterations': iterations,
+            'warmup': warmup,
+            'seed': seed,
+            'profiling': DB_PROFILE,
+            'dataset': dataset,
+        },
+        'results': results,
+    }
+
+
+def compare(report, baseline):
+    """Печатает изменение p95 относительно предыдущего прогона"""
+    print(f"\n📊 Сравнение p95 с {baseline['meta'].get('commit') or 'предыдущим прогоном'}:")
+    for name, result in report['results'].items():
+        before = baseline['results'].get(name)
+        if not before:
+            print(f"   {name:28} новый замер")
+            continue
+        change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0
+        mark = '🔺' if change > 10 else '🔻' if change < -10 else '  '
+        print(f"{mark} {name:28} {before['p95_ms']:9.3f} -> {result['p95_ms']:9.3f} мс ({change:+.0f}%)")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Замер времени методов Database")
+    parser.add_argument('--db', default='bench.db', help="база, созданная generate_dataset (не изменяется)")
+    parser.add_argument('--iterations', type=int, default=200, help="вызовов каждого метода")
+    parser.add_argument('--warmup', type=int, default=10, help="вызовов без замера перед замером")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--only', nargs='+', help="замерить только перечисленные методы")
+    parser.add_argument('--output', help="сохранить результаты в JSON-файл")
+    parser.add_argument('--baseline', help="JSON-файл предыдущего прогона для сравнения")
+    return parser
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.WARNING)
+    args = build_parser().parse_args()
+
+    try:
+        report = run_benchmarks(args.db, args.iterations, args.warmup, args.seed, args.only)
+    except (FileNotFoundError, RuntimeError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n✅ Результаты сохранены в {args.output}")
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,623 @@
+"""Локальный сервер Bot API для сквозных замеров бота без сети.
+
+Сервер отвечает на те же HTTP-запросы, что и api.telegram.org: бот
+забирает обновления через getUpdates из заранее подготовленного потока,
+а его вызовы (sendMessage, editMessageText, answerCallbackQuery, ...)
+записываются вместе со временем. Так измеряется весь путь обновления -
+от выдачи в getUpdates до первого ответа бота - и число вызовов API
+на одно действие пользователя.
+
+    python -m benchmarks.fake_bot_api --port 8081 --users 500 --updates 20000 --rate 200 --output e2e.json
+    TELEGRAM_API_BASE_URL=http://127.0.0.1:8081/bot BOT_TOKEN=123:fake ADMIN_ID=1 DB_PATH=bench.db python bot.py
+
+Поток обновлений генерируется по смеси действий (веса и действия как в
+load_test) для пользователей с id от --first-user-id (по умолчанию - как
+в generate_dataset) или читается из --script (JSON Lines, по одному
+Update на строку; update_id можно не указывать). Обновления начинают
+поступать после первого getUpdates с частотой --rate в секунду.
+
+Ограничения Telegram:
+- --latency-ms и --jitter-ms - задержка ответа на каждый вызов;
+- --chat-rate и --global-rate - лимит исходящих сообщений в секунду на чат
+  и на бота; при превышении сервер отвечает 429 с retry_after;
+- --error-rate - доля исходящих сообщений, на которые 429 приходит случайно.
+
+Ответ на обновление сопоставляется по callback_query_id (кнопки) или по
+первому вызову с chat_id этого чата (сообщения). Когда все обновления
+выданы и бот --idle секунд ничего не вызывает, сервер печатает отчет и
+завершается (Ctrl+C - досрочно).
+"""
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from collections import Counter, defaultdict, deque
+from datetime import datetime
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from benchmarks.load_test import DEFAULT_MIX, SEARCH_TERMS, ADMIN_ACTIONS, parse_mix, percentiles
+
+# Методы, на которые действуют лимиты исходящих сообщений
+SEND_METHODS = {
+    'sendMessage', 'sendPhoto', 'sendDocument', 'sendMediaGroup', 'copyMessage', 'forwardMessage',
+    'editMessageText', 'editMessageCaption', 'editMessageMedia', 'editMessageReplyMarkup',
+}
+# Текстовые параметры передаются как есть, остальные - в JSON
+TEXT_PARAMS = {'text', 'caption', 'callback_query_id', 'inline_query_id', 'parse_mode', 'inline_message_id'}
+FIRST_USER_ID = 100_000_000  # как в generate_dataset
+
+
+def error_body(code, description, retry_after=None):
+    body = {'ok': False, 'error_code': code, 'description': description}
+    if retry_after is not None:
+        body['parameters'] = {'retry_after': retry_after}
+    return body
+
+
+class RateLimit:
+    """Ведро токенов: rate событий в секунду, не больше burst подряд"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def wait(self, now):
+        """Сколько секунд ждать до следующего разрешенного события (0 - можно сейчас)"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+def make_user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': 'Load', 'username': f"load{user_id}"}
+
+
+def message_update(user_id, text):
+    message = {'chat': {'id': user_id, 'type': 'private'}, 'from': make_user(user_id), 'text': text}
+    if text.startswith('/'):
+        # Без сущности bot_command CommandHandler не распознает команду
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'message': message}
+
+
+def callback_update(user_id, data):
+    return {'callback_query': {'from': make_user(user_id), 'chat_instance': str(user_id), 'data': data}}
+
+
+def generate_updates(count, users=500, mix=None, skins=5000, first_user_id=FIRST_USER_ID, admin_id=None, seed=1):
+    """Поток обновлений: первое обновление каждого пользователя - /start, дальше действия по весам mix"""
+    rng = random.Random(seed)
+    mix = dict(mix or DEFAULT_MIX)
+    if admin_id is None:
+        mix.pop('admin', None)
+    actions, weights = zip(*mix.items())
+    user_ids = [first_user_id + index for index in range(users)]
+    started = set()
+    updates = []
+
+    while len(updates) < count:
+        user_id = rng.choice(user_ids)
+        if user_id not in started:
+            started.add(user_id)
+            updates.append(message_update(user_id, '/start'))
+            continue
+
+        action = rng.choices(actions, weights)[0]
+        if action == 'catalog':
+            updates.append(message_update(user_id, '/catalog'))
+        elif action == 'page':
+            updates.append(callback_update(user_id, f"page_{rng.randrange(5)}"))
+        elif action in ('skin_info', 'cart_add'):
+            updates.append(callback_update(user_id, f"{action}_{rng.randint(1, skins)}"))
+        elif action in ('view_cart', 'confirm_purchase', 'inventory', 'balance'):
+            updates.append(callback_update(user_id, action))
+        elif action == 'search':
+            updates.append(callback_update(user_id, 'search_skins'))
+            updates.append(message_update(user_id, rng.choice(SEARCH_TERMS)))
+        elif action == 'message':
+            updates.append(message_update(user_id, 'привет'))
+        elif action == 'admin':
+            updates.append(callback_update(admin_id, rng.choice(ADMIN_ACTIONS)))
+
+    for update_id, update in enumerate(updates[:count], 1):
+        update['update_id'] = update_id
+    return updates[:count]
+
+
+def load_script(path):
+    """Обновления из JSON Lines; недостающие update_id нумеруются подряд"""
+    updates = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                updates.append(json.loads(line))
+    next_id = 1
+    for update in updates:
+        update.setdefault('update_id', next_id)
+        next_id = update['update_id'] + 1
+    return updates
+
+
+class FakeBotApi:
+    """Состояние сервера: очередь обновлений, выданные сообщения бота, журнал вызовов"""
+
+    def __init__(self, updates, rate=0, latency_ms=0, jitter_ms=0, chat_rate=0, chat_burst=3,
+                 global_rate=0, global_burst=30, error_rate=0, retry_after=1, token=None, seed=1):
+        self.updates = updates
+        self.rate = rate
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_limit = RateLimit(global_rate, global_burst) if global_rate else None
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.token = token
+        self.rng = random.Random(seed)
+
+        self.cond = threading.Condition()
+        self.queue = deque()          # выпущенные, но еще не подтвержденные offset обновления
+        self.released = 0
+        self.closing = False
+        self.polling_started = threading.Event()
+        self.started = time.monotonic()
+        self.last_call = None
+
+        self.next_message_id = 1
+        self.messages = {}            # (chat_id, message_id) -> сообщение бота
+        self.last_message = {}        # chat_id -> последнее сообщение бота в чате
+        self.chat_limits = {}
+
+        self.delivered = {}           # update_id -> (время выдачи, тип)
+        self.answered = {}            # update_id -> время первого ответа
+        self.awaiting_callbacks = {}  # callback_query_id -> update_id
+        self.awaiting_messages = defaultdict(deque)  # chat_id -> update_id сообщений без ответа
+        self.calls = []
+        self.call_counts = Counter()
+        self.rate_limited = Counter()
+
+    # --- поток обновлений ---
+
+    def feed(self):
+        """Выпускает обновления с частотой rate после первого getUpdates"""
+        self.polling_started.wait()
+        started = time.monotonic()
+        for index, update in enumerate(self.updates):
+            if self.rate:
+                delay = started + index / self.rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            with self.cond:
+                if self.closing:
+                    return
+                self.queue.append(update)
+                self.released += 1
+                self.cond.notify_all()
+
+    def get_updates(self, params):
+        self.polling_started.set()
+        offset = params.get('offset') or 0
+        limit = min(params.get('limit') or 100, 100)
+        timeout = params.get('timeout') or 0
+        with self.cond:
+            while self.queue and self.queue[0]['update_id'] < offset:
+                self.queue.popleft()
+            if not self.queue and timeout:
+                self.cond.wait_for(lambda: self.queue or self.closing, timeout)
+            batch = list(self.queue)[:limit]
+            now = time.monotonic()
+            for update in batch:
+                if update['update_id'] not in self.delivered:
+                    self._deliver(update, now)
+        return batch
+
+    def _deliver(self, update, now):
+        # Вызывается под self.cond
+        update_id = update['update_id']
+        date = int(time.time())
+        if 'message' in update:
+            message = update['message']
+            message.setdefault('message_id', self._message_id())
+            message.setdefault('date', date)
+            self.awaiting_messages[message['chat']['id']].append(update_id)
+            self.delivered[update_id] = (now, 'message')
+        elif 'callback_query' in update:
+            query = update['callback_query']
+            query.setdefault('id', str(update_id))
+            chat_id = query['from']['id']
+            # Кнопка нажата под последним сообщением бота в этом чате
+            if 'message' not in query:
+                query['message'] = dict(self.last_message.get(chat_id) or {}) or {
+                    'message_id': self._message_id(), 'date': date,
+                    'chat': {'id': chat_id, 'type': 'private'}, 'text': 'Меню',
+                }
+            self.awaiting_callbacks[query['id']] = update_id
+            self.delivered[update_id] = (now, 'callback_query')
+        else:
+            self.delivered[update_id] = (now, next((key for key in update if key != 'update_id'), 'unknown'))
+
+    # --- вызовы бота ---
+
+    def handle(self, method, params):
+        """Возвращает (HTTP-статус, тело ответа) и записывает вызов в журнал"""
+        if method != 'getUpdates':
+            delay = self.latency + (self.rng.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+            if delay > 0:
+                time.sleep(delay)
+
+        now = time.monotonic()
+        chat_id = params.get('chat_id')
+        status, body, limited_by = 200, None, None
+        if method in SEND_METHODS:
+            limited_by, retry_after = self._check_limits(chat_id, now)
+            if limited_by:
+                status, body = 429, error_body(429, f"Too Many Requests: retry after {retry_after}", retry_after)
+
+        if body is None:
+            try:
+                body = {'ok': True, 'result': self._result(method, params)}
+            except (KeyError, TypeError, ValueError) as e:
+                status, body = 400, error_body(400, f"Bad Request: {e}")
+
+        with self.cond:
+            if method != 'getUpdates':
+                self.last_call = now
+                self.call_counts[method] += 1
+                if limited_by:
+                    self.rate_limited[limited_by] += 1
+                elif status == 200:
+                    self._match_response(method, params, chat_id, now)
+            self.calls.append({
+                't': round(now - self.started, 4), 'method': method, 'status': status,
+                'chat_id': chat_id, 'params': {key: value for key, value in params.items() if key != 'reply_markup'},
+                'limited_by': limited_by,
+            })
+        return status, body
+
+    def _check_limits(self, chat_id, now):
+        # Сначала случайная ошибка, затем лимиты чата и бота; токен списывается, только если прошли все
+        if self.error_rate and self.rng.random() < self.error_rate:
+            return 'random', self.retry_after
+        with self.cond:
+            limits = []
+            if self.chat_rate and chat_id is not None:
+                limit = self.chat_limits.get(chat_id)
+                if limit is None:
+                    limit = self.chat_limits[chat_id] = RateLimit(self.chat_rate, self.chat_burst)
+                limits.append(('chat', limit))
+            if self.global_limit:
+                limits.append(('global', self.global_limit))
+            for name, limit in limits:
+                wait = limit.wait(now)
+                if wait:
+                    return name, max(1, math.ceil(wait))
+            for _, limit in limits:
+                limit.take()
+        return None, None
+
+    def _match_response(self, method, params, chat_id, now):
+        # Вызывается под self.cond
+        update_id = None
+        if method == 'answerCallbackQuery':
+            update_id = self.awaiting_callbacks.pop(params.get('callback_query_id'), None)
+        elif chat_id is not None:
+            pending = self.awaiting_messages.get(chat_id)
+            if pending:
+                update_id = pending.popleft()
+        if update_id is not None and update_id not in self.answered:
+            self.answered[update_id] = now
+
+    def _message_id(self):
+        message_id = self.next_message_id
+        self.next_message_id += 1
+        return message_id
+
+    def _result(self, method, params):
+        if method == 'getUpdates':
+            return self.get_updates(params)
+        if method == 'getMe':
+            bot_id = self.token.split(':')[0] if self.token else '1'
+            return {'id': int(bot_id) if bot_id.isdigit() else 1, 'is_bot': True, 'first_name': 'FakeBot',
+                    'username': 'fake_bot', 'can_join_groups': True, 'can_read_all_group_messages': False,
+                    'supports_inline_queries': True}
+        if method == 'deleteWebhook':
+            if params.get('drop_pending_updates'):
+                with self.cond:
+                    self.queue.clear()
+            return True
+        if method == 'getWebhookInfo':
+            return {'url': '', 'has_custom_certificate': False, 'pending_update_count': len(self.queue)}
+        if method.startswith('send') and method != 'sendChatAction':
+            return self._send(method, params)
+        if method.startswith('editMessage'):
+            return self._edit(method, params)
+        # answerCallbackQuery, deleteMessage, setMyCommands и прочие вызовы без результата
+        return True
+
+    def _send(self, method, params):
+        chat_id = params['chat_id']
+        message = {
+            'message_id': 0, 'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'},
+        }
+        if method == 'sendPhoto':
+            message['photo'] = [{'file_id': 'fake-photo', 'file_unique_id': 'fake-photo', 'width': 1, 'height': 1}]
+        elif method == 'sendDocument':
+            message['document'] = {'file_id': 'fake-document', 'file_unique_id': 'fake-document'}
+        elif method != 'sendMessage':
+            return True
+        self._apply(message, params)
+        with self.cond:
+            message['message_id'] = self._message_id()
+            self.messages[(chat_id, message['message_id'])] = message
+            self.last_message[chat_id] = message
+        return message
+
+    def _edit(self, method, params):
+        if params.get('inline_message_id'):
+            return True
+        chat_id, message_id = params['chat_id'], params['message_id']
+        with self.cond:
+            # Копия: прежняя версия сообщения могла уже уйти в ответ другому потоку
+            message = dict(self.messages.get((chat_id, message_id)) or {
+                'message_id': message_id, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'},
+            })
+            if method == 'editMessageMedia':
+                message.pop('text', None)
+                message['photo'] = [{'file_id': 'fake-photo', 'file_unique_id': 'fake-photo', 'width': 1, 'height': 1}]
+            self._apply(message, params)
+            self.messages[(chat_id, message_id)] = message
+            self.last_message[chat_id] = message
+        return message
+
+    @staticmethod
+    def _apply(message, params):
+        if 'text' in params:
+            message['text'] = params['text']
+        if 'caption' in params:
+            message['caption'] = params['caption']
+        if 'reply_markup' in params:
+            message['reply_markup'] = params['reply_markup']
+
+    # --- завершение и отчет ---
+
+    def finished(self, idle):
+        """Все обновления выданы, а бот idle секунд ничего не вызывал"""
+        with self.cond:
+            return (self.released == len(self.updates) and not self.queue and self.last_call is not None
+                    and time.monotonic() - self.last_call >= idle)
+
+    def close(self):
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+        self.polling_started.set()
+
+    def report(self):
+        with self.cond:
+            delivered = dict(self.delivered)
+            answered = dict(self.answered)
+            call_counts = Counter(self.call_counts)
+            rate_limited = Counter(self.rate_limited)
+            last_call = self.last_call
+
+        latencies = defaultdict(list)
+        for update_id, answered_at in answered.items():
+            delivered_at, kind = delivered[update_id]
+            latencies[kind].append(answered_at - delivered_at)
+        first_delivery = min((at for at, _ in delivered.values()), default=None)
+        duration = (last_call - first_delivery) if first_delivery is not None and last_call else 0
+        total_calls = sum(call_counts.values())
+
+        return {
+            'meta': {
+                'started_at': datetime.now().isoformat(timespec='seconds'),
+                'rate': self.rate,
+                'latency_ms': round(self.latency * 1000, 1),
+                'jitter_ms': round(self.jitter * 1000, 1),
+                'chat_rate': self.chat_rate,
+                'global_rate': self.global_limit.rate if self.global_limit else 0,
+                'error_rate': self.error_rate,
+            },
+            'updates': {
+                'total': len(self.updates),
+                'delivered': len(delivered),
+                'answered': len(answered),
+                'unanswered': len(delivered) - len(answered),
+            },
+            'duration_s': round(duration, 2),
+            'updates_per_s': round(len(answered) / duration, 1) if duration else 0,
+            'e2e_latency': percentiles([value for values in latencies.values() for value in values]),
+            'e2e_latency_by_kind': {kind: percentiles(values) for kind, values in sorted(latencies.items())},
+            'api_calls': dict(call_counts.most_common()),
+            'api_calls_per_update': round(total_calls / len(delivered), 2) if delivered else 0,
+            'rate_limited': {'total': sum(rate_limited.values()), **rate_limited},
+        }
+
+
+def decode_params(raw):
+    """Параметры из формы: PTB кодирует все, кроме строк, в JSON"""
+    params = {}
+    for key, value in raw.items():
+        if key in TEXT_PARAMS or not isinstance(value, str):
+            params[key] = value
+            continue
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """HTTP-вход: /bot<token>/<method>, параметры в query string, JSON, форме или multipart"""
+
+    api = None  # FakeBotApi, задается в make_server
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_POST(self):
+        self.dispatch()
+
+    def dispatch(self):
+        path = urlsplit(self.path)
+        parts = path.path.strip('/').split('/')
+        if len(parts) != 2 or not parts[0].startswith('bot'):
+            return self.respond(404, error_body(404, 'Not Found'))
+        token, method = parts[0][3:], parts[1]
+        if self.api.token and token != self.api.token:
+            return self.respond(401, error_body(401, 'Unauthorized'))
+
+        try:
+            params = decode_params(dict(parse_qsl(path.query)))
+            params.update(self.read_body())
+        except ValueError as e:
+            return self.respond(400, error_body(400, f"Bad Request: {e}"))
+        status, body = self.api.handle(method, params)
+        self.respond(status, body)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if not body:
+            return {}
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('application/json'):
+            return json.loads(body)
+        if content_type.startswith('multipart/form-data'):
+            message = BytesParser(policy=HTTP).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+            raw = {}
+            for part in message.iter_parts():
+                name = part.get_param('name', header='content-disposition')
+                # Содержимое файлов не хранится
+                raw[name] = part.get_content() if part.get_filename() is None else f"<file {part.get_filename()}>"
+            return decode_params(raw)
+        return decode_params(dict(parse_qsl(body.decode('utf-8'), keep_blank_values=True)))
+
+    def respond(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Журнал вызовов ведет FakeBotApi
+        pass
+
+
+def make_server(api, host='127.0.0.1', port=8081):
+    handler = type('BoundRequestHandler', (RequestHandler,), {'api': api})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def print_report(report):
+    updates, limited = report['updates'], report['rate_limited']
+    print(f"\n⚡ Обновлений: выдано {updates['delivered']} из {updates['total']}, с ответом {updates['answered']}, "
+          f"без ответа {updates['unanswered']} ({report['updates_per_s']}/с за {report['duration_s']} с)")
+    for kind, stats in [('все', report['e2e_latency'])] + list(report['e2e_latency_by_kind'].items()):
+        print(f"⏱️ {kind:16} p50 {stats['p50_ms']:8.2f}  p95 {stats['p95_ms']:8.2f}  "
+              f"p99 {stats['p99_ms']:8.2f}  макс. {stats['max_ms']:8.2f} мс")
+    print(f"\n📨 Вызовы Bot API ({report['api_calls_per_update']} на обновление): {report['api_calls']}")
+    print(f"🚦 Ответов 429: {limited}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Локальный сервер Bot API для сквозных замеров бота")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--token', help="принимать только этот токен (по умолчанию любой)")
+    parser.add_argument('--script', help="обновления из JSON Lines вместо генерации")
+    parser.add_argument('--updates', type=int, default=10_000, help="сколько обновлений сгенерировать")
+    parser.add_argument('--users', type=int, default=500, help="пользователей в сгенерированном потоке")
+    parser.add_argument('--first-user-id', type=int, default=FIRST_USER_ID)
+    parser.add_argument('--skins', type=int, default=5000, help="скины в callback-данных: id от 1 до N")
+    parser.add_argument('--admin-id', type=int, help="id админа для действия admin (без него действие исключается)")
+    parser.add_argument('--mix', help="веса действий, например catalog=40,cart_add=30 "
+                                      f"(по умолчанию {','.join(f'{k}={v}' for k, v in DEFAULT_MIX.items())})")
+    parser.add_argument('--rate', type=float, default=100, help="обновлений в секунду (0 - все сразу)")
+    parser.add_argument('--latency-ms', type=float, default=0, help="задержка ответа на каждый вызов")
+    parser.add_argument('--jitter-ms', type=float, default=0, help="разброс задержки, +-мс")
+    parser.add_argument('--chat-rate', type=float, default=0, help="лимит сообщений в секунду на чат (0 - без лимита)")
+    parser.add_argument('--chat-burst', type=int, default=3, help="сообщений в чат подряд без ожидания")
+    parser.add_argument('--global-rate', type=float, default=0, help="лимит сообщений в секунду на бота (0 - без лимита)")
+    parser.add_argument('--global-burst', type=int, default=30, help="сообщений подряд без ожидания")
+    parser.add_argument('--error-rate', type=float, default=0, help="доля исходящих сообщений со случайным 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="retry_after для случайных 429, секунд")
+    parser.add_argument('--idle', type=float, default=5, help="завершить после стольких секунд без вызовов")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="сохранить отчет в JSON-файл")
+    parser.add_argument('--record', help="сохранить журнал всех вызовов в JSON Lines")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    try:
+        if args.script:
+            updates = load_script(args.script)
+        else:
+            mix = parse_mix(args.mix) if args.mix else None
+            updates = generate_updates(args.updates, users=args.users, mix=mix, skins=args.skins,
+                                       first_user_id=args.first_user_id, admin_id=args.admin_id, seed=args.seed)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    api = FakeBotApi(updates, rate=args.rate, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                     chat_rate=args.chat_rate, chat_burst=args.chat_burst, global_rate=args.global_rate,
+                     global_burst=args.global_burst, error_rate=args.error_rate, retry_after=args.retry_after,
+                     token=args.token, seed=args.seed)
+    try:
+        server = make_server(api, args.host, args.port)
+    except OSError as e:
+        print(f"❌ Не удалось открыть {args.host}:{args.port}: {e}")
+        sys.exit(1)
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    threading.Thread(target=api.feed, daemon=True).start()
+    print(f"🧪 Bot API на http://{args.host}:{args.port}, обновлений: {len(updates)}")
+    print(f"   Запуск бота: TELEGRAM_API_BASE_URL=http://{args.host}:{args.port}/bot python bot.py")
+
+    try:
+        while not api.finished(args.idle):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        print("\n⏹️ Остановлено")
+    finally:
+        api.close()
+        server.shutdown()
+
+    report = api.report()
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n✅ Отчет сохранен в {args.output}")
+    if args.record:
+        with open(args.record, 'w', encoding='utf-8') as f:
+            for call in api.calls:
+                f.write(json.dumps(call, ensure_ascii=False, default=str) + '\n')
+        print(f"✅ Журнал вызовов ({len(api.calls)}) сохранен в {args.record}")
+
+
+if __name__ == "__main__":
+    main()
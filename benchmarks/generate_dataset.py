@@ -0,0 +1,364 @@
+"""Генератор синтетической базы бота для нагрузочных замеров.
+
+Создает новую базу со схемой последней версии и заполняет ее данными
+в заданных объемах:
+
+    python -m benchmarks.generate_dataset --db bench.db --users 200000 --skins 5000 \\
+        --transactions 2000000 --inventory-per-user 5 --cart-users 0.02 --max-cart 30
+
+Распределения приближены к боевым:
+- редкость: Legendary 70%, Godly 25%, Ancient 5%; цена - логнормальная
+  с медианой, зависящей от редкости; около 10% скинов раскуплены;
+- активность пользователей и популярность скинов - степенные (немногие
+  пользователи делают большую часть покупок, немногие скины - большую часть продаж);
+- транзакции равномерно распределены по последним двум годам, так что
+  большая часть старше DB_ARCHIVE_AFTER_DAYS;
+- журнал баланса сходится с балансами пользователей (manage.py audit-balances),
+  резервы скинов - с корзинами.
+
+Генерация детерминирована при одинаковом --seed.
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import logging
+import argparse
+from itertools import accumulate
+
+from database import Database, CART_RESERVATION_TTL, archive_path_for
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50_000
+
+# Доля скинов каждой редкости и медианная цена, ₽
+RARITIES = {
+    'Legendary': (0.70, 150),
+    'Godly': (0.25, 700),
+    'Ancient': (0.05, 4000),
+}
+PRICE_SIGMA = 0.6
+SOLD_OUT_SHARE = 0.10
+
+ADJECTIVES = ['Огненный', 'Ледяной', 'Теневой', 'Золотой', 'Кристальный', 'Призрачный',
+              'Звездный', 'Кровавый', 'Небесный', 'Древний', 'Радужный', 'Неоновый']
+NOUNS = ['меч', 'нож', 'клинок', 'пистолет', 'топор', 'кинжал', 'лук', 'серп', 'молот', 'револьвер']
+COLLECTIONS = ['Хэллоуин', 'Рождество', 'Лето', 'Классика', 'Турнир', 'Пасха']
+FIRST_NAMES = ['Алексей', 'Мария', 'Иван', 'Анна', 'Дмитрий', 'Елена', 'Максим', 'Ольга', 'Никита', 'Софья']
+
+# (тип транзакции, доля, описание)
+TRANSACTION_TYPES = [
+    ('purchase', 0.70, 'Покупка скина: {name}'),
+    ('bulk_credit', 0.20, 'Пополнение баланса'),
+    ('admin_adjustment', 0.10, 'Корректировка баланса администратором'),
+]
+DEPOSITS_KOP = [10_000, 50_000, 100_000, 300_000]
+
+HISTORY_SECONDS = 2 * 365 * 24 * 60 * 60
+
+
+def timestamp(seconds):
+    """Время в формате CURRENT_TIMESTAMP SQLite (UTC)"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(seconds))
+
+
+def power_law_weights(count, exponent=0.8):
+    """Накопленные веса степенного распределения для random.choices(cum_weights=...)"""
+    return list(accumulate(1 / (rank + 1) ** exponent for rank in range(count)))
+
+
+def insert_batches(conn, sql, rows):
+    """Вставляет строки пачками по BATCH_SIZE; возвращает количество строк"""
+    total = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            conn.executemany(sql, batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        conn.executemany(sql, batch)
+        total += len(batch)
+    return total
+
+
+def generate_skins(rng, count, now):
+    """Возвращает список скинов (словари с полями таблицы skins)"""
+    rarities = list(RARITIES)
+    shares = [share for share, _ in RARITIES.values()]
+    skins = []
+    for skin_id in range(1, count + 1):
+        rarity = rng.choices(rarities, shares)[0]
+        median = RARITIES[rarity][1]
+        noun = rng.choice(NOUNS)
+        quantity = 0 if rng.random() < SOLD_OUT_SHARE else int(rng.expovariate(1 / 15)) + 1
+        skins.append({
+            'skin_id': skin_id,
+            'name': f"{rng.choice(ADJECTIVES)} {noun} {skin_id}",
+            'description': f"{rarity} {noun} из коллекции «{rng.choice(COLLECTIONS)}»",
+            'price': round(max(10.0, rng.lognormvariate(0, PRICE_SIGMA) * median), 2),
+            'rarity': rarity,
+            'roblox_id': f"bench_{skin_id:06d}",
+            'image_url': f"https://example.com/skins/{skin_id}.png",
+            'quantity': quantity,
+            'reserved': 0,
+            'created_at': timestamp(now - rng.randrange(HISTORY_SECONDS)),
+        })
+    return skins
+
+
+def generate_users(conn, rng, count, ledger_per_user, now):
+    """Вставляет пользователей вместе с журналом баланса; возвращает список user_id"""
+    user_ids = [100_000_000 + index for index in range(count)]
+    users, ledger = [], []
+
+    def flush():
+        conn.executemany(
+            'INSERT INTO users (user_id, username, first_name, balance, balance_kop, created_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            users
+        )
+        conn.executemany(
+            'INSERT INTO balance_ledger (user_id, delta_kop, balance_kop, kind, description, created_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            ledger
+        )
+        users.clear()
+        ledger.clear()
+
+    with conn:
+        for user_id in user_ids:
+            created = now - rng.randrange(HISTORY_SECONDS)
+            balance_kop = 0
+            entries = int(rng.expovariate(1 / ledger_per_user)) if ledger_per_user else 0
+            for moment in sorted(rng.randrange(created, now + 1) for _ in range(entries)):
+                if balance_kop == 0 or rng.random() < 0.5:
+                    delta_kop, kind, description = rng.choice(DEPOSITS_KOP), 'bulk_credit', 'Пополнение баланса'
+                else:
+                    delta_kop, kind, description = -rng.randint(1, balance_kop), 'purchase', 'Покупка скинов'
+                balance_kop += delta_kop
+                ledger.append((user_id, delta_kop, balance_kop, kind, description, timestamp(moment)))
+
+            users.append((
+                user_id,
+                f"user{user_id}" if rng.random() < 0.8 else None,
+                rng.choice(FIRST_NAMES),
+                balance_kop / 100,
+                balance_kop,
+                timestamp(created),
+            ))
+            if len(users) >= BATCH_SIZE:
+                flush()
+        flush()
+    return user_ids
+
+
+def generate_inventories(conn, rng, user_ids, skins, per_user, user_weights, skin_weights, now):
+    """Вставляет инвентари и соответствующие им заказы; возвращает (предметов, заказов)"""
+    items_total = 0
+    orders_total = 0
+    inventory, orders, order_items = [], [], []
+
+    def flush():
+        conn.executemany('INSERT INTO orders (order_id, user_id, total, items_count, created_at) VALUES (?, ?, ?, ?, ?)',
+                         orders)
+        conn.executemany('INSERT INTO order_items (order_id, skin_id, skin_name, price) VALUES (?, ?, ?, ?)',
+                         order_items)
+        conn.executemany('INSERT INTO user_inventory (user_id, skin_id, purchased_at) VALUES (?, ?, ?)',
+                         inventory)
+        inventory.clear()
+        orders.clear()
+        order_items.clear()
+
+    # Число предметов у пользователя пропорционально его активности
+    total_weight = user_weights[-1]
+    with conn:
+        previous = 0
+        for user_id, cumulative in zip(user_ids, user_weights):
+            weight, previous = cumulative - previous, cumulative
+            expected = per_user * len(user_ids) * weight / total_weight
+            count = min(int(rng.expovariate(1 / expected)) if expected else 0, len(skins))
+            if not count:
+                continue
+
+            picks = rng.choices(skins, cum_weights=skin_weights, k=count)
+            owned = list({skin['skin_id']: skin for skin in picks}.values())
+            while owned:
+                orders_total += 1
+                size = rng.randint(1, 3)
+                order, owned = owned[:size], owned[size:]
+                moment = timestamp(now - rng.randrange(HISTORY_SECONDS))
+                orders.append((orders_total, user_id, round(sum(skin['price'] for skin in order), 2), len(order), moment))
+                for skin in order:
+                    order_items.append((orders_total, skin['skin_id'], skin['name'], skin['price']))
+                    inventory.append((user_id, skin['skin_id'], moment))
+                items_total += len(order)
+
+            if len(inventory) >= BATCH_SIZE:
+                flush()
+        flush()
+    return items_total, orders_total
+
+
+def generate_carts(rng, user_ids, skins, cart_share, max_cart, now):
+    """Собирает корзины части пользователей и проставляет резервы скинов; возвращает строки user_cart"""
+    in_stock = [skin for skin in skins if skin['quantity'] > 0]
+    if not in_stock or not max_cart:
+        return []
+
+    carts = []
+    expires_at = timestamp(now + CART_RESERVATION_TTL)
+    for user_id in rng.sample(user_ids, int(len(user_ids) * cart_share)):
+        for skin in rng.sample(in_stock, min(rng.randint(1, max_cart), len(in_stock))):
+            skin['reserved'] += 1
+            carts.append((user_id, skin['skin_id'], timestamp(now), expires_at))
+
+    # Зарезервировать можно только то, что есть в наличии
+    for skin in in_stock:
+        skin['quantity'] = max(skin['quantity'], skin['reserved'])
+    return carts
+
+
+def generate_transactions(conn, rng, count, user_ids, user_weights, skins, skin_weights, now):
+    """Вставляет count транзакций"""
+    types = [kind for kind, _, _ in TRANSACTION_TYPES]
+    shares = [share for _, share, _ in TRANSACTION_TYPES]
+    descriptions = {kind: description for kind, _, description in TRANSACTION_TYPES}
+
+    def rows():
+        for start in range(0, count, BATCH_SIZE):
+            for user_id in rng.choices(user_ids, cum_weights=user_weights, k=min(BATCH_SIZE, count - start)):
+                kind = rng.choices(types, shares)[0]
+                if kind == 'purchase':
+                    skin = rng.choices(skins, cum_weights=skin_weights)[0]
+                    amount, description = -skin['price'], descriptions[kind].format(name=skin['name'])
+                else:
+                    amount, description = rng.choice(DEPOSITS_KOP) / 100, descriptions[kind]
+                yield user_id, amount, kind, description, timestamp(now - rng.randrange(HISTORY_SECONDS))
+
+    with conn:
+        return insert_batches(
+            conn,
+            'INSERT INTO transactions (user_id, amount, type, description, created_at) VALUES (?, ?, ?, ?, ?)',
+            rows()
+        )
+
+
+def generate_dataset(db_path, users=200_000, skins=5_000, transactions=2_000_000, inventory_per_user=5,
+                     cart_users=0.02, max_cart=30, ledger_per_user=3, seed=42):
+    """Создает базу db_path (файл не должен существовать) и заполняет ее; возвращает объемы таблиц"""
+    if os.path.exists(db_path):
+        raise FileExistsError(f"база {db_path} уже существует")
+
+    rng = random.Random(seed)
+    now = int(time.time())
+
+    # Схема создается теми же миграциями, что и у бота
+    Database(db_path).close()
+
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -262144')
+    try:
+        started = time.monotonic()
+        skin_rows = generate_skins(rng, skins, now)
+        # Популярность скинов не зависит от их номера
+        popular_skins = rng.sample(skin_rows, len(skin_rows))
+        skin_weights = power_law_weights(len(popular_skins))
+
+        user_ids = generate_users(conn, rng, users, ledger_per_user, now)
+        print(f"👥 Пользователи и журнал баланса: {users} ({time.monotonic() - started:.1f} с)")
+
+        active_users = rng.sample(user_ids, len(user_ids))
+        user_weights = power_law_weights(len(active_users))
+
+        items, orders = generate_inventories(
+            conn, rng, active_users, popular_skins, inventory_per_user, user_weights, skin_weights, now
+        )
+        print(f"🎒 Инвентари: {items} предметов, {orders} заказов ({time.monotonic() - started:.1f} с)")
+
+        carts = generate_carts(rng, user_ids, skin_rows, cart_users, max_cart, now)
+        with conn:
+            insert_batches(
+                conn,
+                'INSERT INTO skins (skin_id, name, description, price, rarity, roblox_id, image_url, '
+                'quantity, reserved, created_at) VALUES (:skin_id, :name, :description, :price, :rarity, '
+                ':roblox_id, :image_url, :quantity, :reserved, :created_at)',
+                skin_rows
+            )
+            insert_batches(conn, 'INSERT INTO user_cart (user_id, skin_id, added_at, expires_at) VALUES (?, ?, ?, ?)',
+                           carts)
+        print(f"🎮 Скины: {skins}, позиций в корзинах: {len(carts)} ({time.monotonic() - started:.1f} с)")
+
+        generate_transactions(conn, rng, transactions, active_users, user_weights, popular_skins, skin_weights, now)
+        print(f"💳 Транзакции: {transactions} ({time.monotonic() - started:.1f} с)")
+
+        conn.execute('ANALYZE')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    finally:
+        conn.close()
+
+    # Счетчики статистики поддерживаются триггерами, но сверить их дешево
+    database = Database(db_path)
+    database.rebuild_stats()
+    database.close()
+
+    return dataset_summary(db_path)
+
+
+def dataset_summary(db_path):
+    """Количество строк в основных таблицах базы"""
+    conn = sqlite3.connect(db_path)
+    try:
+        tables = ['users', 'skins', 'transactions', 'user_inventory', 'user_cart', 'orders', 'balance_ledger']
+        return {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table in tables}
+    finally:
+        conn.close()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Генерация синтетической базы для нагрузочных замеров")
+    parser.add_argument('--db', default='bench.db', help="путь к новой базе (по умолчанию bench.db)")
+    parser.add_argument('--users', type=int, default=200_000)
+    parser.add_argument('--skins', type=int, default=5_000)
+    parser.add_argument('--transactions', type=int, default=2_000_000)
+    parser.add_argument('--inventory-per-user', type=float, default=5, help="среднее число предметов в инвентаре")
+    parser.add_argument('--cart-users', type=float, default=0.02, help="доля пользователей с непустой корзиной")
+    parser.add_argument('--max-cart', type=int, default=30, help="наибольший размер корзины")
+    parser.add_argument('--ledger-per-user', type=float, default=3, help="среднее число записей журнала баланса")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--force', action='store_true', help="удалить существующую базу и ее архив")
+    return parser
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.WARNING)
+    args = build_parser().parse_args()
+
+    if args.force:
+        for path in (args.db, archive_path_for(args.db)):
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+    started = time.monotonic()
+    try:
+        summary = generate_dataset(
+            args.db, users=args.users, skins=args.skins, transactions=args.transactions,
+            inventory_per_user=args.inventory_per_user, cart_users=args.cart_users, max_cart=args.max_cart,
+            ledger_per_user=args.ledger_per_user, seed=args.seed,
+        )
+    except FileExistsError as e:
+        print(f"❌ {e}. Укажите другой путь или --force")
+        sys.exit(1)
+
+    print(f"\n✅ База {args.db} готова за {time.monotonic() - started:.1f} с")
+    for table, count in summary.items():
+        print(f"   {table}: {count}")
+
+
+if __name__ == "__main__":
+    main()
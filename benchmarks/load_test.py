@@ -0,0 +1,476 @@
+"""Нагрузочный прогон настоящих обработчиков бота без Telegram.
+
+Тысячи виртуальных пользователей одновременно нажимают кнопки и пишут
+сообщения: обновления передаются прямо в button_handler, show_catalog,
+admin_button_handler и handle_message (покупка корзины - через
+confirm_purchase), а Bot, Message и CallbackQuery заменены заглушками,
+которые только считают вызовы API (и по желанию имитируют задержку сети).
+
+    python -m benchmarks.load_test --db bench.db --users 2000 --duration 60 --output load.json
+    python -m benchmarks.load_test --db bench.db --mix catalog=40,cart_add=30,confirm_purchase=30
+
+База (например, из generate_dataset) копируется во временный каталог.
+Каждый пользователь выполняет случайные действия по весам --mix с паузами
+(в среднем --think-ms); одновременно обрабатывается не больше
+--max-concurrent обновлений, как у Application с concurrent_updates.
+
+Отчет: перцентили задержки по действиям, пропускная способность,
+задержка event loop, ожидания и ошибки блокировок базы, вызовы Bot API.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import itertools
+from collections import Counter, defaultdict
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Действие -> вес в смеси по умолчанию
+DEFAULT_MIX = {
+    'catalog': 15,
+    'page': 20,
+    'skin_info': 10,
+    'cart_add': 15,
+    'view_cart': 10,
+    'confirm_purchase': 5,
+    'inventory': 10,
+    'balance': 5,
+    'search': 7,
+    'message': 1,
+    'admin': 2,
+}
+SEARCH_TERMS = ['меч', 'нож', 'огн', 'золотой клинок', 'древний', 'револьвер', 'ледяной серп', 'неон']
+ADMIN_ACTIONS = ['admin_stats', 'admin_detailed_stats', 'admin_users', 'admin_skins']
+LAG_INTERVAL = 0.01
+START_BALANCE = 10_000  # ₽ на счету каждого виртуального пользователя
+
+
+def parse_mix(text):
+    """'catalog=40,cart_add=30' -> {'catalog': 40, 'cart_add': 30}"""
+    mix = {}
+    for part in filter(None, (part.strip() for part in text.split(','))):
+        name, _, weight = part.partition('=')
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"неизвестное действие {name} (доступны: {', '.join(DEFAULT_MIX)})")
+        mix[name] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("смесь действий пуста")
+    return mix
+
+
+def percentiles(values):
+    """p50/p95/p99/max в миллисекундах (перцентиль по ближайшему рангу)"""
+    if not values:
+        return {'p50_ms': 0, 'p95_ms': 0, 'p99_ms': 0, 'max_ms': 0}
+    values = sorted(values)
+
+    def pick(fraction):
+        return round(values[max(0, math.ceil(fraction * len(values)) - 1)] * 1000, 2)
+
+    return {'p50_ms': pick(0.50), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99), 'max_ms': round(values[-1] * 1000, 2)}
+
+
+# -----------------------ЗАГЛУШКИ-TELEGRAM------------------------- #
+
+class RecordingBot:
+    """Заглушка Bot: считает вызовы методов API вместо запросов к Telegram"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+
+    async def call(self, method, chat_id=None, **kwargs):
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return StubMessage(self, chat_id, text=kwargs.get('text'), reply_markup=kwargs.get('reply_markup'))
+
+    def next_message_id(self):
+        return next(self._message_ids)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return await self.call('sendMessage', chat_id, text=text, **kwargs)
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        return await self.call('sendPhoto', chat_id, **kwargs)
+
+    async def send_document(self, chat_id, document, **kwargs):
+        return await self.call('sendDocument', chat_id, **kwargs)
+
+
+class StubUser:
+    def __init__(self, user_id, first_name='Load', username=None):
+        self.id = user_id
+        self.first_name = first_name
+        self.last_name = None
+        self.username = username
+        self.is_bot = False
+
+    def mention_html(self):
+        return f'<a href="tg://user?id={self.id}">{self.first_name}</a>'
+
+
+class StubMessage:
+    """Сообщение в чате: ответы на него уходят в RecordingBot, правки меняют его текст и кнопки"""
+
+    def __init__(self, bot, chat_id, text=None, reply_markup=None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = bot.next_message_id()
+        self.text = text
+        self.reply_markup = reply_markup
+        self.photo = None
+        self.document = None
+
+    async def reply_text(self, text, **kwargs):
+        return await self.bot.call('sendMessage', self.chat_id, text=text, **kwargs)
+
+    async def reply_html(self, text, **kwargs):
+        return await self.bot.call('sendMessage', self.chat_id, text=text, **kwargs)
+
+    async def reply_photo(self, photo, **kwargs):
+        return await self.bot.call('sendPhoto', self.chat_id, **kwargs)
+
+    async def reply_document(self, document, **kwargs):
+        return await self.bot.call('sendDocument', self.chat_id, **kwargs)
+
+    async def edit_text(self, text, reply_markup=None, **kwargs):
+        self.text, self.reply_markup = text, reply_markup
+        await self.bot.call('editMessageText', self.chat_id)
+        return self
+
+
+class StubCallbackQuery:
+    """Нажатие кнопки под сообщением message"""
+
+    def __init__(self, bot, user, message, data):
+        self.id = str(message.message_id)
+        self.from_user = user
+        self.message = message
+        self.data = data
+        self.bot = bot
+
+    async def answer(self, text=None, show_alert=False, **kwargs):
+        await self.bot.call('answerCallbackQuery')
+        return True
+
+    async def edit_message_text(self, text, reply_markup=None, **kwargs):
+        return await self.message.edit_text(text, reply_markup=reply_markup)
+
+    async def edit_message_reply_markup(self, reply_markup=None, **kwargs):
+        self.message.reply_markup = reply_markup
+        await self.bot.call('editMessageReplyMarkup')
+        return self.message
+
+    async def edit_message_media(self, media, reply_markup=None, **kwargs):
+        self.message.photo, self.message.reply_markup = [media], reply_markup
+        await self.bot.call('editMessageMedia')
+        return self.message
+
+    async def edit_message_caption(self, caption=None, reply_markup=None, **kwargs):
+        self.message.reply_markup = reply_markup
+        await self.bot.call('editMessageCaption')
+        return self.message
+
+
+class StubUpdate:
+    def __init__(self, user, message=None, callback_query=None):
+        self.effective_user = user
+        self.message = message
+        self.callback_query = callback_query
+        self.inline_query = None
+
+
+class StubContext:
+    """Контекст обработчика: user_data хранится у виртуального пользователя между обновлениями"""
+
+    def __init__(self, bot, user_data, args=None):
+        self.bot = bot
+        self.user_data = user_data
+        self.args = args or []
+
+
+class ErrorCounter(logging.Handler):
+    """Считает ошибки в логе: обработчики и Database перехватывают исключения и только логируют их"""
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.errors = 0
+        self.lock_errors = 0
+
+    def emit(self, record):
+        self.errors += 1
+        message = record.getMessage().lower()
+        if 'database is locked' in message or 'database is busy' in message:
+            self.lock_errors += 1
+
+
+# -----------------------ВИРТУАЛЬНЫЕ-ПОЛЬЗОВАТЕЛИ------------------------- #
+
+class LoadTest:
+    """Прогон: виртуальные пользователи, смесь действий и собранные замеры"""
+
+    def __init__(self, bot, user_ids, skin_ids, admin_id, mix, max_concurrent, think_time, seed):
+        from handlers import button_handler, show_catalog
+        from admin_handlers import admin_button_handler
+        from bot import handle_message
+
+        self.handlers = {
+            'button_handler': button_handler,
+            'show_catalog': show_catalog,
+            'admin_button_handler': admin_button_handler,
+            'handle_message': handle_message,
+        }
+        self.bot = bot
+        self.user_ids = user_ids
+        self.skin_ids = skin_ids
+        self.admin_id = admin_id
+        self.actions = list(mix)
+        self.weights = list(mix.values())
+        self.think_time = think_time
+        self.rng = random.Random(seed)
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+
+        self.latencies = defaultdict(list)
+        self.failures = Counter()
+        self.completed = 0
+
+    async def dispatch(self, label, handler_name, update, context):
+        """Передает обновление обработчику и замеряет время (включая ожидание свободного слота)"""
+        started = time.perf_counter()
+        async with self.semaphore:
+            try:
+                await self.handlers[handler_name](update, context)
+            except Exception as e:
+                self.failures[label] += 1
+                logger.error(f"{handler_name} ({label}) упал: {e}")
+        self.latencies[label].append(time.perf_counter() - started)
+        self.completed += 1
+
+    async def press(self, label, user, session, data, handler_name='button_handler'):
+        query = StubCallbackQuery(self.bot, user, session['message'], data)
+        await self.dispatch(label, handler_name, StubUpdate(user, callback_query=query),
+                            StubContext(self.bot, session['user_data']))
+
+    async def write(self, label, user, session, text, handler_name='handle_message'):
+        message = StubMessage(self.bot, user.id, text=text)
+        await self.dispatch(label, handler_name, StubUpdate(user, message=message),
+                            StubContext(self.bot, session['user_data']))
+
+    async def perform(self, action, user, session):
+        rng = self.rng
+        if action == 'catalog':
+            await self.write('show_catalog', user, session, '/catalog', 'show_catalog')
+        elif action == 'page':
+            await self.press('button_handler[page]', user, session, f"page_{rng.randrange(5)}")
+        elif action == 'skin_info':
+            await self.press('button_handler[skin_info]', user, session, f"skin_info_{rng.choice(self.skin_ids)}")
+        elif action == 'cart_add':
+            await self.press('button_handler[cart_add]', user, session, f"cart_add_{rng.choice(self.skin_ids)}")
+        elif action == 'view_cart':
+            await self.press('button_handler[view_cart]', user, session, 'view_cart')
+        elif action == 'confirm_purchase':
+            await self.press('button_handler[confirm_purchase]', user, session, 'confirm_purchase')
+        elif action == 'inventory':
+            await self.press('button_handler[inventory]', user, session, 'inventory')
+        elif action == 'balance':
+            await self.press('button_handler[balance]', user, session, 'balance')
+        elif action == 'search':
+            await self.press('button_handler[search_skins]', user, session, 'search_skins')
+            await self.write('handle_message[search]', user, session, rng.choice(SEARCH_TERMS))
+        elif action == 'message':
+            await self.write('handle_message', user, session, 'привет')
+        elif action == 'admin':
+            admin = StubUser(self.admin_id, 'Admin', 'admin')
+            await self.press('admin_button_handler', admin, session, rng.choice(ADMIN_ACTIONS), 'admin_button_handler')
+
+    async def user_loop(self, user_id, deadline):
+        user = StubUser(user_id, 'Load', f"load{user_id}")
+        # Сообщение бота, под которым пользователь нажимает кнопки
+        session = {'message': StubMessage(self.bot, user_id, text='/start'), 'user_data': {}}
+        # Пользователи приходят не одновременно
+        await asyncio.sleep(self.rng.random() * self.think_time)
+        while time.perf_counter() < deadline:
+            action = self.rng.choices(self.actions, self.weights)[0]
+            await self.perform(action, user, session)
+            await asyncio.sleep(self.rng.expovariate(1 / self.think_time) if self.think_time else 0)
+
+    async def run(self, duration):
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(self.user_loop(user_id, deadline) for user_id in self.user_ids))
+
+
+async def monitor_event_loop(samples, stop):
+    """Задержка event loop: насколько позже запланированного просыпается короткий sleep"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(LAG_INTERVAL)
+        samples.append(max(loop.time() - started - LAG_INTERVAL, 0))
+
+
+async def run_load_test(users=2000, duration=60, mix=None, max_concurrent=256, think_ms=1000,
+                        api_latency_ms=0, seed=1):
+    """Выполняет прогон на базе из DB_PATH; возвращает отчет в виде словаря для JSON"""
+    from config import Config
+    from database import get_db
+
+    db = get_db()
+    conn = db.database.get_connection()
+    user_ids = [row[0] for row in conn.execute('SELECT user_id FROM users ORDER BY RANDOM() LIMIT ?', (users,))]
+    skin_ids = [row[0] for row in conn.execute('SELECT skin_id FROM skins WHERE quantity > reserved')]
+    if not user_ids or not skin_ids:
+        raise RuntimeError("в базе нет пользователей или скинов в наличии - сначала запустите generate_dataset")
+
+    # Деньги на покупки: без них confirm_purchase проверял бы только отказ
+    credits = [
+        {'user_id': user_id, 'delta_kop': START_BALANCE * 100, 'note': 'load test', 'line': line}
+        for line, user_id in enumerate(user_ids, 1)
+    ]
+    await db.apply_balance_credits(credits)
+    # Каталог загружается в кеш до начала замеров, как после первого запроса в работе
+    await db.get_all_skins()
+    pool_before = await db.get_pool_stats()
+
+    bot = RecordingBot(api_latency_ms / 1000)
+    test = LoadTest(bot, user_ids, skin_ids, Config.ADMIN_ID_INT, mix or DEFAULT_MIX,
+                    max_concurrent, think_ms / 1000, seed)
+    if Config.ADMIN_ID_INT is None and 'admin' in test.actions:
+        raise RuntimeError("для действий admin нужен ADMIN_ID")
+
+    error_counter = ErrorCounter()
+    logging.getLogger().addHandler(error_counter)
+    lag_samples = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_event_loop(lag_samples, stop))
+
+    started = time.perf_counter()
+    try:
+        await test.run(duration)
+    finally:
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await monitor
+        logging.getLogger().removeHandler(error_counter)
+
+    pool_after = await db.get_pool_stats()
+    writer_stats = await db.get_writer_stats()
+    await db.close()
+
+    handlers = {}
+    for label, values in sorted(test.latencies.items()):
+        handlers[label] = {'count': len(values), 'errors': test.failures[label], **percentiles(values)}
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'users': len(user_ids),
+            'duration_s': round(elapsed, 1),
+            'mix': mix or DEFAULT_MIX,
+            'max_concurrent': max_concurrent,
+            'think_ms': think_ms,
+            'api_latency_ms': api_latency_ms,
+        },
+        'throughput': {
+            'updates': test.completed,
+            'updates_per_s': round(test.completed / elapsed, 1) if elapsed else 0,
+        },
+        'handlers': handlers,
+        'event_loop_lag': percentiles(lag_samples),
+        'database': {
+            'lock_waits': pool_after['lock_waits'] - pool_before['lock_waits'],
+            'lock_wait_time_s': round(pool_after['lock_wait_time'] - pool_before['lock_wait_time'], 3),
+            'lock_failures': pool_after['lock_failures'] - pool_before['lock_failures'],
+            'logged_lock_errors': error_counter.lock_errors,
+            'logged_errors': error_counter.errors,
+            'writer': writer_stats,
+        },
+        'bot_api_calls': dict(bot.calls.most_common()),
+    }
+
+
+def print_report(report):
+    meta, throughput, lag, database = report['meta'], report['throughput'], report['event_loop_lag'], report['database']
+    print(f"\n👥 Пользователей: {meta['users']}, длительность: {meta['duration_s']} с")
+    print(f"⚡ Обновлений: {throughput['updates']} ({throughput['updates_per_s']}/с)\n")
+    for label, stats in report['handlers'].items():
+        errors = f"  ошибок: {stats['errors']}" if stats['errors'] else ''
+        print(f"⏱️ {label:36} {stats['count']:7}  p50 {stats['p50_ms']:8.2f}  p95 {stats['p95_ms']:8.2f}  "
+              f"p99 {stats['p99_ms']:8.2f} мс{errors}")
+    print(f"\n🌀 Задержка event loop: p50 {lag['p50_ms']} мс, p99 {lag['p99_ms']} мс, макс. {lag['max_ms']} мс")
+    print(f"🔒 Ожиданий блокировки базы: {database['lock_waits']} ({database['lock_wait_time_s']} с), "
+          f"не дождались: {database['lock_failures']}, ошибок блокировки в логе: {database['logged_lock_errors']}")
+    print(f"❗ Ошибок в логе: {database['logged_errors']}")
+    print(f"📨 Вызовы Bot API: {report['bot_api_calls']}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон обработчиков бота")
+    parser.add_argument('--db', default='bench.db', help="база, созданная generate_dataset (не изменяется)")
+    parser.add_argument('--users', type=int, default=2000, help="виртуальных пользователей")
+    parser.add_argument('--duration', type=float, default=60, help="длительность прогона, секунд")
+    parser.add_argument('--mix', help="веса действий, например catalog=40,cart_add=30 "
+                                      f"(по умолчанию {','.join(f'{k}={v}' for k, v in DEFAULT_MIX.items())})")
+    parser.add_argument('--max-concurrent', type=int, default=256, help="одновременно обрабатываемых обновлений")
+    parser.add_argument('--think-ms', type=float, default=1000, help="средняя пауза пользователя между действиями")
+    parser.add_argument('--api-latency-ms', type=float, default=0, help="имитация задержки ответа Bot API")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="сохранить отчет в JSON-файл")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    try:
+        mix = parse_mix(args.mix) if args.mix else None
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    if not os.path.exists(args.db):
+        print(f"❌ база {args.db} не найдена")
+        sys.exit(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Модули бота читают настройки при импорте: путь к копии базы задается до него
+        os.environ['DB_PATH'] = os.path.join(tmp, 'load.db')
+        os.environ['DB_ARCHIVE_PATH'] = os.path.join(tmp, 'load_archive.db')
+        os.environ.setdefault('BOT_TOKEN', 'load-test')
+        os.environ.setdefault('ADMIN_ID', '1')
+
+        from benchmarks.bench_database import copy_database
+        from database import archive_path_for
+        copy_database(args.db, os.environ['DB_PATH'])
+        if os.path.exists(archive_path_for(args.db)):
+            copy_database(archive_path_for(args.db), os.environ['DB_ARCHIVE_PATH'])
+
+        # bot.py настраивает логирование на INFO при импорте; в прогоне нужны только предупреждения
+        import bot  # noqa: F401
+        logging.getLogger().setLevel(logging.WARNING)
+
+        try:
+            report = asyncio.run(run_load_test(
+                users=args.users, duration=args.duration, mix=mix, max_concurrent=args.max_concurrent,
+                think_ms=args.think_ms, api_latency_ms=args.api_latency_ms, seed=args.seed,
+            ))
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n✅ Отчет сохранен в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
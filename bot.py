@@ -1,13 +1,19 @@
 import telegram
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ContextTypes
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ContextTypes, InlineQueryHandler
 from config import Config
-from database import Database
-from handlers import show_catalog, button_handler, show_inventory
-from admin_handlers import admin_panel, admin_button_handler
+from database import get_db
+from handlers import show_catalog, button_handler, show_inventory, inline_query_handler
+from admin_handlers import admin_panel, admin_button_handler, backup_status_command, db_profile_command
+from jobs import register_jobs
+from money import format_money
+from bulk_import import (
+    parse_skins_file, parse_balance_file, build_balance_error_csv, ImportFormatError, MAX_IMPORT_FILE_SIZE
+)
 from flask import Flask
 import threading
+import io
 import os
 
 app = Flask(__name__)
@@ -72,7 +78,7 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         logger.error(f"Ошибка при отправке уведомления админу: {e}")
 
-db = Database()
+db = get_db()
 
 # ---------------------КОМАНДЫ----------------------- #
 
@@ -82,7 +88,7 @@ async def start(update, context):
 
     user = update.effective_user
 
-    db.add_user(user_id=user.id, username=user.username, first_name=user.first_name, last_name=user.last_name)
+    await db.add_user(user_id=user.id, username=user.username, first_name=user.first_name, last_name=user.last_name)
 
     await update.message.reply_html(
 f"Привет {user.mention_html()}! 👋\n"
@@ -138,12 +144,11 @@ async def balance_command(update, context):
     """Обработчик команды /balance"""
 
     user = update.effective_user
-    user_data = db.get_user(user.id)
+    balance_kop = await db.get_balance(user.id)
 
-    if user_data:
-        balance = user_data['balance']
+    if balance_kop is not None:
         await update.message.reply_text(
-            f"💰 Твой баланс: {balance} ₽\n\n"
+            f"💰 Твой баланс: {format_money(balance_kop)} ₽\n\n"
             f"Для пополнения баланса обратись к администратору @m1kellaa"
         )
     else:
@@ -185,7 +190,7 @@ async def photo_command(update, context):
 
     try:
         skin_id = int(context.args[0])
-        skin = db.get_skin_by_id(skin_id)
+        skin = await db.get_skin_by_id(skin_id)
 
         if not skin:
             await update.message.reply_text("❌ Скин с таким ID не найден")
@@ -208,7 +213,7 @@ async def photo_command(update, context):
                 f"🎮 *{skin['name']}*\n\n"
                 f"💎 Редкость: {skin['rarity']}\n"
                 f"💰 Цена: {skin['price']} ₽\n"
-                f"📦 В наличии: {skin['quantity']} шт.\n\n"
+                f"📦 В наличии: {skin['available']} шт.\n\n"
                 f"📝 {skin['description']}"
             ),
             parse_mode='Markdown'
@@ -238,7 +243,7 @@ async def skin_info_command(update, context):
 
     try:
         skin_id = int(context.args[0])
-        skin = db.get_skin_by_id(skin_id)
+        skin = await db.get_skin_by_id(skin_id)
 
         if not skin:
             await update.message.reply_text("❌ Скин с таким ID не найден")
@@ -254,7 +259,7 @@ async def skin_info_command(update, context):
             f"{rarity_emoji} *{skin['name']}*\n\n"
             f"💎 *Редкость:* {skin['rarity']}\n"
             f"💰 *Цена:* {skin['price']} ₽\n"
-            f"📦 *В наличии:* {skin['quantity']} шт.\n"
+            f"📦 *В наличии:* {skin['available']} шт.\n"
         )
 
         #if skin['description']:
@@ -326,7 +331,6 @@ async def handle_message(update, context):
 async def process_balance_change(update, context, text):
     """Обрабатывает изменение баланса пользователя"""
     from admin_handlers import is_admin
-    from database import Database
 
     user_id = update.effective_user.id
     if not is_admin(user_id):
@@ -347,12 +351,11 @@ async def process_balance_change(update, context, text):
         new_balance = float(parts[1].strip())
 
         # Изменяем баланс
-        db = Database()
-        success = db.update_user_balance_directly(target_user_id, new_balance)
+        success = await db.update_user_balance_directly(target_user_id, new_balance)
 
         if success:
             # Записываем транзакцию
-            db.add_transaction(
+            await db.add_transaction(
                 user_id=target_user_id,
                 amount=new_balance,
                 transaction_type='admin_adjustment',
@@ -375,8 +378,7 @@ async def process_balance_change(update, context, text):
 
 async def process_search_query(update, context, text):
     """Обрабатывает поисковый запрос"""
-    from database import Database
-    from handlers import show_search_results
+    from handlers import show_search_results, search_sessions
 
     search_term = text.strip()
 
@@ -385,10 +387,9 @@ async def process_search_query(update, context, text):
         return
 
     # Ищем скины
-    db = Database()
-    found_skins = db.search_skins(search_term)
+    skin_ids = await db.search_skin_ids(search_term)
 
-    if not found_skins:
+    if not skin_ids:
         await update.message.reply_text(
             f"😔 По запросу \"{search_term}\" ничего не найдено\n\n"
             f"Попробуйте:\n"
@@ -398,7 +399,8 @@ async def process_search_query(update, context, text):
         )
     else:
         # Показываем результаты поиска
-        await show_search_results(update, context, found_skins, search_term)
+        token = search_sessions.create(search_term, skin_ids)
+        await show_search_results(update, context, token)
 
     # Сбрасываем состояние ожидания
     context.user_data['waiting_for_search'] = False
@@ -406,7 +408,6 @@ async def process_search_query(update, context, text):
 async def process_skin_input(update, context, text):
     """Обрабатывает ввод данных скина от админа"""
     from admin_handlers import is_admin
-    from database import Database
 
     user_id = update.effective_user.id
     if not is_admin(user_id):
@@ -440,8 +441,7 @@ async def process_skin_input(update, context, text):
             return
 
         # Добавляем скин в базу
-        db = Database()
-        success = db.add_skin(name, description, price, rarity, roblox_id, image_url, quantity)
+        success = await db.add_skin(name, description, price, rarity, roblox_id, image_url, quantity)
 
         if success:
             await update.message.reply_text(
@@ -464,10 +464,125 @@ async def process_skin_input(update, context, text):
 
     context.user_data['waiting_for_skin'] = False
 
+# Сколько ошибок импорта показывать в ответе
+MAX_IMPORT_ERRORS_SHOWN = 20
+
+async def handle_document(update, context):
+    """Обрабатывает файлы (импорт скинов от админа)"""
+    if context.user_data.get('waiting_for_skin_import'):
+        await process_skin_import(update, context)
+        return
+
+    if context.user_data.get('waiting_for_balance_file'):
+        await process_balance_file(update, context)
+        return
+
+    await update.message.reply_text("📎 Файлы принимаются только при импорте из админ-панели")
+
+async def download_document(update):
+    """Скачивает присланный файл; возвращает (имя, содержимое) или None, если файл слишком большой"""
+    document = update.message.document
+    if document.file_size and document.file_size > MAX_IMPORT_FILE_SIZE:
+        await update.message.reply_text(f"❌ Файл слишком большой (максимум {MAX_IMPORT_FILE_SIZE // 1024} КБ)")
+        return None
+
+    file = await document.get_file()
+    return document.file_name, bytes(await file.download_as_bytearray())
+
+async def process_skin_import(update, context):
+    """Импортирует скины из CSV/JSON файла, присланного админом"""
+    from admin_handlers import is_admin
+
+    user_id = update.effective_user.id
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ Нет доступа")
+        return
+
+    try:
+        downloaded = await download_document(update)
+        if downloaded is None:
+            return
+        skins, errors = parse_skins_file(*downloaded)
+    except ImportFormatError as e:
+        await update.message.reply_text(f"❌ Файл не подходит для импорта: {e}")
+        return
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке файла импорта: {e}")
+        await update.message.reply_text(f"❌ Ошибка при загрузке файла: {str(e)}")
+        return
+
+    result = {'inserted': 0, 'updated': 0}
+    if skins:
+        result = await db.import_skins(skins)
+        if result is None:
+            await update.message.reply_text("❌ Ошибка при сохранении скинов, ничего не импортировано")
+            return
+
+    report = (
+        f"📥 Импорт завершен\n\n"
+        f"➕ Добавлено: {result['inserted']}\n"
+        f"🔄 Обновлено: {result['updated']}\n"
+        f"⚠️ Строк с ошибками: {len(errors)}"
+    )
+    if errors:
+        report += "\n\n" + "\n".join(
+            f"Строка {number}: {error}" for number, error in errors[:MAX_IMPORT_ERRORS_SHOWN]
+        )
+        if len(errors) > MAX_IMPORT_ERRORS_SHOWN:
+            report += f"\n... и еще {len(errors) - MAX_IMPORT_ERRORS_SHOWN} ошибок"
+
+    await update.message.reply_text(report)
+    context.user_data['waiting_for_skin_import'] = False
+
+async def process_balance_file(update, context):
+    """Применяет пакет изменений баланса из CSV файла, присланного админом"""
+    from admin_handlers import is_admin
+
+    user_id = update.effective_user.id
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ Нет доступа")
+        return
+
+    try:
+        downloaded = await download_document(update)
+        if downloaded is None:
+            return
+        credits, errors = parse_balance_file(*downloaded)
+    except ImportFormatError as e:
+        await update.message.reply_text(f"❌ Файл не подходит: {e}")
+        return
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке файла пополнений: {e}")
+        await update.message.reply_text(f"❌ Ошибка при загрузке файла: {str(e)}")
+        return
+
+    result = {'applied': 0, 'total_kop': 0, 'failed': []}
+    if credits:
+        result = await db.apply_balance_credits(credits)
+        if result is None:
+            await update.message.reply_text("❌ Ошибка при изменении балансов, ничего не применено")
+            return
+
+    failed = sorted(errors + result['failed'], key=lambda error: error['line'])
+    await update.message.reply_text(
+        f"📑 Пополнения применены\n\n"
+        f"✅ Строк применено: {result['applied']}\n"
+        f"💰 Сумма: {format_money(result['total_kop'])} ₽\n"
+        f"⚠️ Строк с ошибками: {len(failed)}"
+    )
+
+    if failed:
+        await update.message.reply_document(
+            document=io.BytesIO(build_balance_error_csv(failed)),
+            filename='balance_errors.csv',
+            caption="⚠️ Строки, которые не были применены"
+        )
+
+    context.user_data['waiting_for_balance_file'] = False
+
 async def process_delete_skin(update, context, text):
     """Обрабатывает удаление скина"""
     from admin_handlers import is_admin
-    from database import Database
 
     user_id = update.effective_user.id
     if not is_admin(user_id):
@@ -476,18 +591,17 @@ async def process_delete_skin(update, context, text):
 
     try:
         skin_id = int(text.strip())
-        db = Database()
 
         # Проверяем существует ли скин
-        skin = db.get_skin_by_id(skin_id)
+        skin = await db.get_skin_by_id(skin_id)
         if not skin:
             await update.message.reply_text("❌ Скин с таким ID не найден")
             return
 
         # Удаляем скин
-        with db.get_connection() as conn:
-            conn.execute('DELETE FROM skins WHERE skin_id = ?', (skin_id,))
-            conn.commit()
+        if not await db.delete_skin(skin_id):
+            await update.message.reply_text("❌ Ошибка при удалении скина")
+            return
 
         await update.message.reply_text(
             f"✅ Скин '{skin['name']}' (ID: {skin_id}) успешно удален!"
@@ -513,7 +627,6 @@ async def my_id(update, context):
 async def delete_skin_command(update, context):
     """Команда для удаления скина (только для админа)"""
     from admin_handlers import is_admin
-    from database import Database
     
     user_id = update.effective_user.id
     if not is_admin(user_id):
@@ -529,16 +642,15 @@ async def delete_skin_command(update, context):
         
     try:
         skin_id = int(context.args[0])
-        db = Database()
-        skin = db.get_skin_by_id(skin_id)
+        skin = await db.get_skin_by_id(skin_id)
         
         if not skin:
             await update.message.reply_text("❌ Скин с таким ID не найден")
             return
             
-        with db.get_connection() as conn:
-            conn.execute('DELETE FROM skins WHERE skin_id = ?', (skin_id,))
-            conn.commit()
+        if not await db.delete_skin(skin_id):
+            await update.message.reply_text("❌ Ошибка при удалении скина")
+            return
             
         await update.message.reply_text(
             f"✅ Скин '{skin['name']}' успешно удален!"
@@ -551,6 +663,10 @@ async def delete_skin_command(update, context):
 
 # -----------------------ЗАПУСК-БОТА------------------------- #
 
+async def on_shutdown(application):
+    """Останавливает пул потоков базы данных при завершении бота"""
+    await db.close()
+
 def main():
     """Основная функция запуска бота"""
     try:
@@ -565,12 +681,16 @@ def main():
         print("✅ Flask web server started")
 
         # Создаем приложение Telegram
-        application = (
+        builder = (
             Application.builder()
             .token(Config.BOT_TOKEN)
             .concurrent_updates(True)
-            .build()
+            .post_shutdown(on_shutdown)
         )
+        if Config.TELEGRAM_API_BASE_URL:
+            print(f"🧪 Bot API: {Config.TELEGRAM_API_BASE_URL}")
+            builder = builder.base_url(Config.TELEGRAM_API_BASE_URL)
+        application = builder.build()
         
         # Добавляем обработчики команд
         application.add_handler(CommandHandler("start", start))
@@ -583,23 +703,32 @@ def main():
         application.add_handler(CommandHandler("photo", photo_command))
         application.add_handler(CommandHandler("skin", skin_info_command))
         application.add_handler(CommandHandler("delete_skin", delete_skin_command))
+        application.add_handler(CommandHandler("backup_status", backup_status_command))
+        application.add_handler(CommandHandler("db_profile", db_profile_command))
 
         # ⭐⭐ Важно: сначала админ хендлеры, потом обычные ⭐⭐
         application.add_handler(CallbackQueryHandler(admin_button_handler, pattern="^admin_"))
         application.add_handler(CallbackQueryHandler(button_handler))
 
+        # Inline-режим (@bot запрос); должен быть включен в @BotFather командой /setinline
+        application.add_handler(InlineQueryHandler(inline_query_handler))
+
         # Добавляем обработчик текстовых сообщений
         application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+        application.add_handler(MessageHandler(filters.Document.ALL, handle_document))
 
         # Добавляем обработчик ошибок
         application.add_error_handler(error_handler)
 
+        # Периодические задачи (снимки балансов, очистка резервов корзин, архивация транзакций)
+        register_jobs(application)
+
         print("🤖 Starting Telegram bot...")
         
         # Запускаем с защитой от конфликтов
         application.run_polling(
             drop_pending_updates=True,  # Игнорируем старые сообщения
-            allowed_updates=['message', 'callback_query'],
+            allowed_updates=['message', 'callback_query', 'inline_query'],
             close_loop=False
         )
         
@@ -0,0 +1,245 @@
+"""Разбор файлов для массового импорта скинов и пополнений баланса.
+
+CSV - первая строка с заголовками:
+
+    name,description,price,rarity,quantity,roblox_id,image_url
+    Огненный меч,Мощное оружие,1500,Godly,5,fire_sword_001,https://example.com/fire.jpg
+
+Разделитель - запятая или точка с запятой. JSON - список объектов с теми
+же полями (или объект {"skins": [...]}).
+
+Пополнения баланса - CSV без заголовка (или с заголовком user_id,delta,note):
+
+    123456789,500,Оплата картой №42
+    987654321,-150.50,Возврат
+
+Каждая строка проверяется отдельно: ошибки возвращаются с номером строки,
+а корректные строки можно импортировать, не исправляя весь файл.
+"""
+import csv
+import io
+import json
+import math
+from urllib.parse import urlparse
+
+from money import to_kopecks
+
+VALID_RARITIES = ['Legendary', 'Godly', 'Ancient']
+REQUIRED_FIELDS = ['name', 'price', 'rarity', 'quantity', 'roblox_id']
+FIELDS = ['name', 'description', 'price', 'rarity', 'quantity', 'roblox_id', 'image_url']
+
+MAX_IMPORT_ROWS = 5000
+MAX_IMPORT_FILE_SIZE = 2 * 1024 * 1024  # байт
+MAX_BALANCE_DELTA_KOP = 10_000_000 * 100  # защита от опечаток в сумме (10 млн ₽)
+
+
+class ImportFormatError(Exception):
+    """Файл целиком не подходит для импорта (формат, кодировка, размер)"""
+
+
+def validate_skin_row(raw):
+    """Проверяет одну строку импорта; возвращает (скин, None) или (None, текст ошибки)"""
+    row = {field: str(raw.get(field) if raw.get(field) is not None else '').strip() for field in FIELDS}
+
+    missing = [field for field in REQUIRED_FIELDS if not row[field]]
+    if missing:
+        return None, f"не заполнены поля: {', '.join(missing)}"
+
+    try:
+        price = float(row['price'].replace(',', '.'))
+    except ValueError:
+        return None, f"цена должна быть числом: {row['price']}"
+    if not math.isfinite(price) or price <= 0:
+        return None, f"цена должна быть больше нуля: {row['price']}"
+
+    try:
+        quantity = int(row['quantity'])
+    except ValueError:
+        return None, f"количество должно быть целым числом: {row['quantity']}"
+    if quantity < 0:
+        return None, f"количество не может быть отрицательным: {quantity}"
+
+    if row['rarity'] not in VALID_RARITIES:
+        return None, f"неверная редкость {row['rarity']} (допустимые: {', '.join(VALID_RARITIES)})"
+
+    image_url = row['image_url']
+    if image_url:
+        parsed = urlparse(image_url)
+        if parsed.scheme not in ('http', 'https') or not parsed.netloc:
+            return None, f"неверная ссылка на изображение: {image_url}"
+
+    return {
+        'name': row['name'],
+        'description': row['description'],
+        'price': round(price, 2),
+        'rarity': row['rarity'],
+        'quantity': quantity,
+        'roblox_id': row['roblox_id'],
+        'image_url': image_url,
+    }, None
+
+
+def _read_csv(text):
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;')
+    except csv.Error:
+        dialect = csv.excel
+
+    reader = csv.DictReader(io.StringIO(text), dialect=dialect)
+    if not reader.fieldnames:
+        raise ImportFormatError("файл пуст")
+
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    unknown = [name for name in REQUIRED_FIELDS if name not in reader.fieldnames]
+    if unknown:
+        raise ImportFormatError(f"в заголовке нет столбцов: {', '.join(unknown)}")
+
+    for raw in reader:
+        yield reader.line_num, raw
+
+
+def _read_json(text):
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ImportFormatError(f"неверный JSON: {e}")
+
+    if isinstance(data, dict):
+        data = data.get('skins')
+    if not isinstance(data, list):
+        raise ImportFormatError("ожидается список скинов или объект {\"skins\": [...]}")
+
+    for number, raw in enumerate(data, 1):
+        yield number, raw
+
+
+def _decode(content):
+    if len(content) > MAX_IMPORT_FILE_SIZE:
+        raise ImportFormatError(f"файл больше {MAX_IMPORT_FILE_SIZE // 1024} КБ")
+    try:
+        return content.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise ImportFormatError("файл должен быть в кодировке UTF-8")
+
+
+def parse_skins_file(filename, content):
+    """Разбирает файл импорта.
+
+    content - содержимое файла (bytes). Возвращает (скины, ошибки), где
+    ошибки - список (номер строки, текст). Для JSON номер строки - номер
+    записи в списке. Повторный roblox_id в файле считается ошибкой.
+    """
+    text = _decode(content)
+    name = (filename or '').lower()
+    if name.endswith('.json'):
+        rows = _read_json(text)
+    elif name.endswith('.csv') or name.endswith('.txt'):
+        rows = _read_csv(text)
+    else:
+        raise ImportFormatError("поддерживаются только файлы .csv и .json")
+
+    skins = []
+    errors = []
+    seen = {}
+    for number, raw in rows:
+        if len(skins) + len(errors) >= MAX_IMPORT_ROWS:
+            raise ImportFormatError(f"в файле больше {MAX_IMPORT_ROWS} строк")
+        if not isinstance(raw, dict):
+            errors.append((number, "запись должна быть объектом"))
+            continue
+
+        skin, error = validate_skin_row(raw)
+        if error:
+            errors.append((number, error))
+            continue
+        if skin['roblox_id'] in seen:
+            errors.append((number, f"roblox_id {skin['roblox_id']} уже был в строке {seen[skin['roblox_id']]}"))
+            continue
+
+        seen[skin['roblox_id']] = number
+        skins.append(skin)
+
+    return skins, errors
+
+
+def validate_balance_row(fields):
+    """Проверяет строку пополнения; возвращает (пополнение, None) или (None, текст ошибки)"""
+    fields = [field.strip() for field in fields]
+    if len(fields) < 2:
+        return None, "нужно минимум 2 поля: user_id, delta"
+
+    try:
+        user_id = int(fields[0])
+    except ValueError:
+        return None, f"user_id должен быть числом: {fields[0]}"
+    if user_id <= 0:
+        return None, f"неверный user_id: {user_id}"
+
+    try:
+        delta_kop = to_kopecks(fields[1].replace(',', '.').replace(' ', ''))
+    except (ArithmeticError, ValueError):
+        return None, f"сумма должна быть числом: {fields[1]}"
+    if delta_kop == 0:
+        return None, "сумма не может быть нулевой"
+    if abs(delta_kop) > MAX_BALANCE_DELTA_KOP:
+        return None, f"слишком большая сумма: {fields[1]}"
+
+    # Запятые в примечании без кавычек не ломают строку
+    note = ','.join(fields[2:]).strip()
+    return {'user_id': user_id, 'delta_kop': delta_kop, 'note': note}, None
+
+
+def parse_balance_file(filename, content):
+    """Разбирает файл пополнений (CSV: user_id, delta, note).
+
+    Возвращает (пополнения, ошибки): у каждого пополнения есть поле line -
+    номер строки в файле; ошибки - словари line, user_id, delta, note, error
+    (как в build_balance_error_csv).
+    """
+    text = _decode(content)
+    name = (filename or '').lower()
+    if not (name.endswith('.csv') or name.endswith('.txt')):
+        raise ImportFormatError("поддерживаются только файлы .csv и .txt")
+
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;')
+    except csv.Error:
+        dialect = csv.excel
+
+    credits = []
+    errors = []
+    reader = csv.reader(io.StringIO(text), dialect=dialect)
+    for fields in reader:
+        if not any(field.strip() for field in fields):
+            continue
+        # Необязательный заголовок
+        if reader.line_num == 1 and fields[0].strip().lower() == 'user_id':
+            continue
+        if len(credits) + len(errors) >= MAX_IMPORT_ROWS:
+            raise ImportFormatError(f"в файле больше {MAX_IMPORT_ROWS} строк")
+
+        credit, error = validate_balance_row(fields)
+        if error:
+            errors.append({
+                'line': reader.line_num,
+                'user_id': fields[0].strip(),
+                'delta': fields[1].strip() if len(fields) > 1 else '',
+                'note': ','.join(fields[2:]).strip(),
+                'error': error,
+            })
+            continue
+
+        credit['line'] = reader.line_num
+        credits.append(credit)
+
+    return credits, errors
+
+
+def build_balance_error_csv(errors):
+    """Собирает CSV с непримененными строками: line, user_id, delta, note, error"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['line', 'user_id', 'delta', 'note', 'error'])
+    for error in errors:
+        writer.writerow([error['line'], error['user_id'], error['delta'], error['note'], error['error']])
+    return output.getvalue().encode('utf-8-sig')
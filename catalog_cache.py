@@ -0,0 +1,138 @@
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Порядок редкостей в каталоге (как в ORDER BY CASE rarity ...)
+RARITY_ORDER = {
+    'Legendary': 1,
+    'Godly': 2,
+    'Ancient': 3,
+}
+
+# Поля, от которых зависят поисковый индекс и порядок найденных скинов
+SEARCH_FIELDS = ('name', 'description', 'price', 'rarity')
+
+
+def catalog_sort_key(skin):
+    return RARITY_ORDER.get(skin['rarity'], 4), skin['price'], skin['skin_id']
+
+
+def available_quantity(skin):
+    """Сколько единиц скина можно купить: остаток за вычетом резервов в корзинах"""
+    return max(skin['quantity'] - skin.get('reserved', 0), 0)
+
+
+class CatalogCache:
+    """Кеш каталога скинов в памяти процесса.
+
+    Хранит отсортированный список скинов в наличии и индекс skin_id -> скин.
+    У каждого скина есть поле available - остаток за вычетом резервов в корзинах;
+    скины с available = 0 в списке каталога не показываются.
+    Каждое изменение увеличивает version; text_version растет, только когда
+    меняется состав каталога или поля SEARCH_FIELDS (но не остаток и резервы),
+    и служит ключом поискового индекса. Словари скинов не изменяются на
+    месте (при обновлении создается новый словарь), поэтому их можно
+    отдавать обработчикам без копирования - но изменять их нельзя.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl  # секунды; None или 0 - без ограничения срока жизни
+        self.version = 0
+        self.text_version = 0
+        self._skins_by_id = None
+        self._sorted = []
+        self._sorted_dirty = False
+        self._loaded_at = 0.0
+        self._lock = threading.RLock()
+
+    def _is_fresh(self):
+        if self._skins_by_id is None:
+            return False
+        if self.ttl and time.monotonic() - self._loaded_at > self.ttl:
+            return False
+        return True
+
+    def needs_reload(self):
+        """True, если при следующем чтении кеш вызовет загрузчик"""
+        with self._lock:
+            return not self._is_fresh()
+
+    def _mark_changed(self, text_changed=True):
+        # Список пересортируется лениво, при следующем чтении каталога
+        self._sorted_dirty = True
+        self.version += 1
+        if text_changed:
+            self.text_version += 1
+
+    def _ensure_loaded(self, loader):
+        if self._is_fresh():
+            return
+        skins = loader()
+        for skin in skins:
+            skin['available'] = available_quantity(skin)
+        self._skins_by_id = {skin['skin_id']: skin for skin in skins}
+        self._loaded_at = time.monotonic()
+        self._mark_changed()
+        logger.info(f"Каталог загружен в кеш: {len(skins)} скинов (версия {self.version})")
+
+    def get_skins(self, loader):
+        """Возвращает скины в наличии в порядке каталога.
+
+        loader - функция без аргументов, возвращающая все скины из базы;
+        вызывается, только если кеш пуст или устарел.
+        """
+        return self.get_snapshot(loader)[1]
+
+    def get_snapshot(self, loader):
+        """Возвращает (версия, скины в наличии), согласованные между собой"""
+        with self._lock:
+            self._ensure_loaded(loader)
+            if self._sorted_dirty:
+                self._sorted = sorted(
+                    (skin for skin in self._skins_by_id.values() if skin['available'] > 0),
+                    key=catalog_sort_key
+                )
+                self._sorted_dirty = False
+            return self.version, list(self._sorted)
+
+    def get_search_snapshot(self, loader):
+        """Возвращает (text_version, {skin_id: скин}) - все скины, включая закончившиеся"""
+        with self._lock:
+            self._ensure_loaded(loader)
+            return self.text_version, dict(self._skins_by_id)
+
+    def get_skin(self, skin_id, loader):
+        """Возвращает скин по ID (в том числе закончившийся) или None"""
+        with self._lock:
+            self._ensure_loaded(loader)
+            return self._skins_by_id.get(skin_id)
+
+    def update_skin(self, skin_id, **fields):
+        """Обновляет поля скина в кеше (например, quantity после покупки или reserved)"""
+        with self._lock:
+            if self._skins_by_id is None or skin_id not in self._skins_by_id:
+                return
+            old = self._skins_by_id[skin_id]
+            skin = dict(old)
+            skin.update(fields)
+            skin['available'] = available_quantity(skin)
+            self._skins_by_id[skin_id] = skin
+            self._mark_changed(any(field in fields and fields[field] != old.get(field) for field in SEARCH_FIELDS))
+
+    def remove_skin(self, skin_id):
+        """Удаляет скин из кеша"""
+        with self._lock:
+            if self._skins_by_id is None or self._skins_by_id.pop(skin_id, None) is None:
+                return
+            self._mark_changed()
+
+    def invalidate(self):
+        """Сбрасывает кеш; следующий запрос перечитает каталог из базы"""
+        with self._lock:
+            self._skins_by_id = None
+            self._sorted = []
+            self._sorted_dirty = False
+            self.version += 1
+            self.text_version += 1
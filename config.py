@@ -7,6 +7,9 @@ load_dotenv()
 class Config:
     BOT_TOKEN = os.getenv('BOT_TOKEN')
     ADMIN_ID = os.getenv('ADMIN_ID')
+    # Адрес Bot API вида http://host:port/bot (токен дописывается в конец).
+    # По умолчанию - api.telegram.org; для офлайн-замеров - benchmarks/fake_bot_api.py
+    TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL')
 
     # Отладочная информация
     print(f"🛠️ DEBUG: BOT_TOKEN loaded: {'Yes' if BOT_TOKEN else 'No'}")
@@ -1,108 +1,256 @@
+import os
+import abc
+import time
 import sqlite3
+import asyncio
 import logging
-from datetime import datetime
+import threading
+from functools import partial
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from db_pool import ConnectionPool
+from db_profiler import (
+    profiler, profile_methods, hot_query, check_plans, PlanRegressionError,
+    DB_PROFILE, DB_PLAN_ASSERT,
+)
+from migrations import apply_migrations, rebuild_stats_counters, ensure_archive_schema
+from catalog_cache import CatalogCache
+from batch_writer import BatchWriter
+from money import to_kopecks
+from storage import (
+    Storage, CheckoutError, Purchase, CreditBatch,
+    search_words, page_offset, format_bot_stats, split_import,
+    DB_CATALOG_TTL, CART_RESERVATION_TTL, DB_ARCHIVE_AFTER_DAYS, DB_ARCHIVE_BATCH,
+    DB_ANALYTICS_WORKERS, DB_ANALYTICS_TIMEOUT_MS, DB_BACKEND,
+)
 
 logger = logging.getLogger(__name__)
 
+# Настройки SQLite-базы (читаются из окружения, .env загружается в config.py);
+# настройки, общие с PostgreSQL, - в storage.py
+DB_PATH = os.getenv('DB_PATH', 'skins_bot.db')
+DB_WORKERS = int(os.getenv('DB_WORKERS', '4'))
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000'))
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', '8192'))
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', str(64 * 1024 * 1024)))
+DB_LOCK_RETRIES = int(os.getenv('DB_LOCK_RETRIES', '5'))
+DB_WRITE_BEHIND = os.getenv('DB_WRITE_BEHIND', '1') == '1'  # фоновая запись журнала и регистраций
+DB_WRITE_FLUSH_MS = int(os.getenv('DB_WRITE_FLUSH_MS', '200'))
+DB_WRITE_BATCH = int(os.getenv('DB_WRITE_BATCH', '500'))
+DB_WRITE_QUEUE = int(os.getenv('DB_WRITE_QUEUE', '100000'))
+DB_ARCHIVE_PATH = os.getenv('DB_ARCHIVE_PATH', f"{os.path.splitext(DB_PATH)[0]}_archive.db")
+
+# Базы, для которых миграции уже применены в этом процессе
+_migrated_databases = set()
+_migrate_lock = threading.Lock()
+
+def build_fts_query(search_term):
+    """Превращает пользовательский запрос в запрос FTS5: каждое слово - префикс, все слова обязательны"""
+    return ' '.join(f'"{word}"*' for word in search_words(search_term))
+
+def analytics_query(method):
+    """Помечает метод как тяжелый отчет: AsyncDatabase выполняет такие методы
+    в отдельном пуле потоков на DB_ANALYTICS_WORKERS потоков"""
+    method.analytics = True
+    return method
+
+def archive_path_for(db_name):
+    """Путь к архивной базе по умолчанию: skins_bot.db -> skins_bot_archive.db"""
+    return f"{os.path.splitext(db_name)[0]}_archive.db"
+
+# Запросы горячего пути: их планы проверяются (manage.py check-plans, DB_PLAN_ASSERT=1),
+# переход любого из них на полный просмотр таблицы считается регрессией
+SQL_USER_BY_ID = hot_query('user_lookup', 'SELECT * FROM users WHERE user_id = ?', (1,))
+SQL_BALANCE_BY_USER = hot_query('balance', 'SELECT balance_kop FROM users WHERE user_id = ?', (1,))
+SQL_CART_ITEMS = hot_query('cart', '''
+    SELECT uc.*, s.name, s.description, s.price, s.rarity, s.quantity, s.image_url
+    FROM user_cart uc
+    JOIN skins s ON uc.skin_id = s.skin_id
+    WHERE uc.user_id = ?
+''', (1,))
+SQL_CART_COUNT = hot_query('cart_count', 'SELECT COUNT(*) FROM user_cart WHERE user_id = ?', (1,))
+SQL_INVENTORY_COUNT = hot_query('inventory_count', '''
+    SELECT COUNT(*)
+    FROM user_inventory ui
+    JOIN skins s ON ui.skin_id = s.skin_id
+    WHERE ui.user_id = ?
+''', (1,))
+SQL_INVENTORY_PAGE = hot_query('inventory_page', '''
+    SELECT ui.*, s.skin_id, s.name, s.description, s.rarity, s.image_url, s.price
+    FROM user_inventory ui
+    JOIN skins s ON ui.skin_id = s.skin_id
+    WHERE ui.user_id = ?
+    ORDER BY ui.purchased_at DESC, ui.inventory_id DESC
+    LIMIT ? OFFSET ?
+''', (1, 5, 0))
+SQL_BALANCE_HISTORY = hot_query('balance_history', '''
+    SELECT * FROM balance_ledger
+    WHERE user_id = ?
+    ORDER BY entry_id DESC
+    LIMIT ?
+''', (1, 20))
+SQL_SEARCH_COUNT = hot_query('catalog_search_count', '''
+    SELECT COUNT(*)
+    FROM skins_fts f
+    JOIN skins s ON s.skin_id = f.rowid
+    WHERE skins_fts MATCH ? AND s.quantity > s.reserved
+''', ('"меч"*',))
+SQL_SEARCH_PAGE = hot_query('catalog_search', '''
+    SELECT s.*, s.quantity - s.reserved AS available
+    FROM skins_fts f
+    JOIN skins s ON s.skin_id = f.rowid
+    WHERE skins_fts MATCH ? AND s.quantity > s.reserved
+    ORDER BY bm25(skins_fts, 10.0, 1.0), s.price ASC, s.skin_id ASC
+    LIMIT ? OFFSET ?
+''', ('"меч"*', 5, 0))
+
 class Database:
 
-    def __init__(self, db_name='skins_bot.db'):
+    def __init__(self, db_name=DB_PATH, archive_path=None):
         self.db_name = db_name
-        self.create_tables()
+        # Архив старых транзакций - отдельный файл, подключенный к каждому соединению как схема archive
+        if archive_path is None:
+            archive_path = DB_ARCHIVE_PATH if db_name == DB_PATH else archive_path_for(db_name)
+        self.archive_path = archive_path
+        # Время запросов для журнала медленных запросов и проверки планов
+        self.profiler = profiler if DB_PROFILE or DB_PLAN_ASSERT else None
+        self.pool = ConnectionPool(
+            db_name,
+            busy_timeout_ms=DB_BUSY_TIMEOUT_MS,
+            cache_size_kb=DB_CACHE_SIZE_KB,
+            mmap_size=DB_MMAP_SIZE,
+            lock_retries=DB_LOCK_RETRIES,
+            attachments={'archive': archive_path},
+            profiler=self.profiler,
+        )
+        # Соединения только для чтения для отчетов админки (открываются после миграций)
+        self.analytics_pool = ConnectionPool(
+            db_name,
+            busy_timeout_ms=DB_BUSY_TIMEOUT_MS,
+            cache_size_kb=DB_CACHE_SIZE_KB,
+            mmap_size=DB_MMAP_SIZE,
+            lock_retries=DB_LOCK_RETRIES,
+            attachments={'archive': archive_path},
+            read_only=True,
+            profiler=self.profiler,
+        )
+        self.catalog = CatalogCache(ttl=DB_CATALOG_TTL)
+        self.writer = BatchWriter(
+            self.pool,
+            flush_interval_ms=DB_WRITE_FLUSH_MS,
+            max_batch=DB_WRITE_BATCH,
+            max_queue=DB_WRITE_QUEUE,
+        ) if DB_WRITE_BEHIND else None
+        self.migrate()
+        if DB_PLAN_ASSERT:
+            self.assert_query_plans()
 
     def get_connection(self):
-        """Создает соединение с базой данных"""
-        conn = sqlite3.connect(self.db_name)
-        conn.row_factory = sqlite3.Row  # Чтобы получать данные как словарь
-        return conn
-
-    def create_tables(self):
-
-        """Создает необходимые таблицы в базе данных"""
-
+        """Возвращает соединение текущего потока из пула"""
+        return self.pool.get_connection()
+
+    def get_pool_stats(self):
+        """Возвращает счетчики пула соединений"""
+        return self.pool.get_stats()
+
+    def get_profile_stats(self):
+        """Возвращает статистику методов (вызовы, время, строки) и число медленных запросов"""
+        return self.profiler.get_stats() if self.profiler else {}
+
+    def assert_query_plans(self):
+        """Проверяет, что запросы горячего пути используют индексы; иначе бросает PlanRegressionError"""
+        violations = check_plans(self.get_connection())
+        if violations:
+            details = '; '.join(f"{v['name']}: {', '.join(v['scans'])}" for v in violations)
+            raise PlanRegressionError(f"Запросы горячего пути читают таблицы целиком: {details}")
+
+    def get_writer_stats(self):
+        """Возвращает счетчики фоновой записи (глубина очереди, пачки, ошибки)"""
+        return self.writer.get_stats() if self.writer else {}
+
+    def flush_writes(self, timeout=5.0):
+        """Дожидается сохранения записей, стоящих в очереди фоновой записи"""
+        return self.writer.flush(timeout) if self.writer else True
+
+    def _write_behind(self, sql, params, key=None):
+
+        """Ставит некритичную запись в очередь фоновой записи (или пишет сразу, если она выключена)"""
+
+        if self.writer and self.writer.submit(sql, params, key):
+            return
+        with self.get_connection() as conn:
+            conn.execute(sql, params)
+            conn.commit()
+
+    def _flush_if_pending(self, user_id):
+
+        """Сохраняет очередь фоновой записи, если в ней ждут записи пользователя user_id; True - если пришлось ждать"""
+
+        # Для неизвестного пользователя не ждем: иначе каждый такой запрос стоял бы до flush
+        if self.writer and self.writer.pending(('user', user_id)):
+            self.writer.flush()
+            return True
+        return False
+
+    def close(self):
+        """Сохраняет очередь фоновой записи и закрывает все соединения с базой данных"""
+        if self.writer:
+            self.writer.close()
+        self.pool.close_all()
+        self.analytics_pool.close_all()
+
+    @contextmanager
+    def analytics_snapshot(self, timeout_ms=DB_ANALYTICS_TIMEOUT_MS):
+        """Соединение только для чтения с открытой транзакцией для отчетов.
+
+        Все запросы внутри видят один и тот же снимок базы (WAL), не
+        блокируют запись и не ждут ее. Данные, которые еще в очереди
+        фоновой записи, в снимок не попадают. Запросы дольше timeout_ms
+        прерываются с TimeoutError.
+        """
+
+        conn = self.analytics_pool.get_connection()
+        deadline = time.monotonic() + timeout_ms / 1000
+        conn.set_progress_handler(lambda: time.monotonic() > deadline, 10000)
         try:
-            with self.get_connection() as conn:
-                # Таблица пользователей
-                conn.execute('''
-                    CREATE TABLE IF NOT EXISTS users (
-                        user_id INTEGER PRIMARY KEY,
-                        username TEXT,
-                        first_name TEXT,
-                        last_name TEXT,
-                        balance REAL DEFAULT 0.0,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-
-                # Таблица скинов
-                conn.execute('''
-                    CREATE TABLE IF NOT EXISTS skins (
-                        skin_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        name TEXT NOT NULL,
-                        description TEXT,
-                        price REAL NOT NULL,
-                        rarity TEXT DEFAULT 'Common',
-                        roblox_id TEXT,
-                        image_url TEXT,
-                        quantity INTEGER DEFAULT 1,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-
-                # Таблица инвентаря пользователей
-                conn.execute('''
-                    CREATE TABLE IF NOT EXISTS user_inventory (
-                        inventory_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER,
-                        skin_id INTEGER,
-                        purchased_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (user_id) REFERENCES users (user_id),
-                        FOREIGN KEY (skin_id) REFERENCES skins (skin_id)
-                    )
-                ''')
-
-                # Таблица транзакций
-                conn.execute('''
-                    CREATE TABLE IF NOT EXISTS transactions (
-                        transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER,
-                        amount REAL,
-                        type TEXT, -- 'deposit', 'purchase', 'sale'
-                        description TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (user_id) REFERENCES users (user_id)
-                    )
-                ''')
-
-                # Таблица корзины пользователей
-                conn.execute('''
-                        CREATE TABLE IF NOT EXISTS user_cart (
-                            cart_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            user_id INTEGER,
-                            skin_id INTEGER,
-                            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            FOREIGN KEY (user_id) REFERENCES users (user_id),
-                            FOREIGN KEY (skin_id) REFERENCES skins (skin_id)
-                        )
-                    ''')
-
-                logger.info("Таблицы базы данных успешно созданы")
-
-        except Exception as e:
-            logger.error(f"Ошибка при создании таблиц: {e}")
+            conn.execute('BEGIN')
+            yield conn
+        except sqlite3.OperationalError as e:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"отчет не уложился в {timeout_ms} мс") from e
+            raise
+        finally:
+            conn.rollback()
+            conn.set_progress_handler(None, 0)
+
+    def migrate(self):
+
+        """Применяет миграции схемы (один раз за процесс для каждого файла базы)"""
+
+        with _migrate_lock:
+            if self.db_name in _migrated_databases:
+                return
+
+            try:
+                conn = self.get_connection()
+                applied = apply_migrations(conn)
+                ensure_archive_schema(conn)
+                _migrated_databases.add(self.db_name)
+                if applied:
+                    logger.info(f"Схема базы данных обновлена до версии {applied[-1]}")
+            except Exception as e:
+                logger.error(f"Ошибка при применении миграций: {e}")
 
     def add_user(self, user_id, username, first_name, last_name=None):
 
-        """Добавляет нового пользователя в базу данных"""
+        """Добавляет нового пользователя в базу данных (через фоновую запись)"""
 
         try:
-            with self.get_connection() as conn:
-                conn.execute('''
-                    INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
-                    VALUES (?, ?, ?, ?)
-                ''', (user_id, username, first_name, last_name))
-                conn.commit()
-                logger.info(f"Пользователь {user_id} добавлен в базу")
+            self._write_behind('''
+                INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, username, first_name, last_name), key=('user', user_id))
+            logger.info(f"Пользователь {user_id} добавлен в базу")
         except Exception as e:
             logger.error(f"Ошибка при добавлении пользователя: {e}")
 
@@ -112,63 +260,125 @@ class Database:
 
         try:
             with self.get_connection() as conn:
-                user = conn.execute(
-                    'SELECT * FROM users WHERE user_id = ?',
-                    (user_id,)
-                ).fetchone()
+                user = conn.execute(SQL_USER_BY_ID, (user_id,)).fetchone()
+                # Пользователь мог только что зарегистрироваться и еще стоять в очереди записи
+                if not user and self._flush_if_pending(user_id):
+                    user = conn.execute(SQL_USER_BY_ID, (user_id,)).fetchone()
                 return dict(user) if user else None
         except Exception as e:
             logger.error(f"Ошибка при получении пользователя: {e}")
             return None
 
-    def update_user_balance(self, user_id, amount):
+    def update_user_balance(self, user_id, amount, description=None):
 
-        """Обновляет баланс пользователя"""
+        """Изменяет баланс пользователя на amount рублей (с записью в журнал баланса)"""
 
+        conn = self.get_connection()
         try:
-            with self.get_connection() as conn:
-                conn.execute(
-                    'UPDATE users SET balance = balance + ? WHERE user_id = ?',
-                    (amount, user_id)
-                )
-                conn.commit()
-                logger.info(f"Баланс пользователя {user_id} обновлен на {amount}")
+            conn.execute('BEGIN IMMEDIATE')
+            balance_kop = self._apply_balance_delta(conn, user_id, to_kopecks(amount), 'adjustment', description)
+            if balance_kop is None and self.writer and self.writer.pending(('user', user_id)):
+                # Отпускаем блокировку, чтобы фоновая запись сохранила нового пользователя
+                conn.rollback()
+                self.writer.flush()
+                conn.execute('BEGIN IMMEDIATE')
+                balance_kop = self._apply_balance_delta(conn, user_id, to_kopecks(amount), 'adjustment', description)
+            if balance_kop is None:
+                conn.rollback()
+                logger.warning(f"Баланс пользователя {user_id} не изменен на {amount}: "
+                               f"пользователь не найден или недостаточно средств")
+                return False
+            conn.commit()
+            logger.info(f"Баланс пользователя {user_id} обновлен на {amount}")
+            return True
         except Exception as e:
+            conn.rollback()
             logger.error(f"Ошибка при обновлении баланса: {e}")
+            return False
 
-    def get_all_skins(self):
+    def apply_balance_credits(self, credits):
+        """Применяет пакет изменений баланса одной транзакцией.
 
-        """Получает все скины из базы данных"""
+        credits - строки из bulk_import.parse_balance_file (user_id, delta_kop,
+        note, line). Каждое изменение записывается в журнал баланса и в
+        transactions. Строки для неизвестных пользователей (и списания больше
+        баланса) пропускаются. Возвращает {'applied': N, 'total_kop': сумма,
+        'failed': [...]} или None при ошибке (ничего не записано).
+        """
+        if self.writer and self.writer.pending():
+            # Пользователи, зарегистрированные только что, могут быть еще в очереди записи
+            self.writer.flush()
 
+        conn = self.get_connection()
         try:
-            with self.get_connection() as conn:
-                skins = conn.execute('''
-                    SELECT * FROM skins WHERE quantity > 0 ORDER BY 
-                    CASE rarity
-                        WHEN 'Legendary' THEN 1
-                        WHEN 'Godly' THEN 2
-                        WHEN 'Ancient' THEN 3
-                        ELSE 4
-                    END,
-                    price ASC
-                ''').fetchall()
-                return [dict(skin) for skin in skins]
+            conn.execute('BEGIN IMMEDIATE')
+            batch = CreditBatch()
+            for credit in credits:
+                balance_kop = self._apply_balance_delta(
+                    conn, credit['user_id'], credit['delta_kop'], 'bulk_credit', batch.description(credit)
+                )
+                if balance_kop is not None:
+                    batch.add_applied(credit)
+                    continue
+
+                exists = conn.execute('SELECT 1 FROM users WHERE user_id = ?', (credit['user_id'],)).fetchone()
+                batch.add_failed(credit, exists is not None)
+
+            conn.executemany(
+                'INSERT INTO transactions (user_id, amount, type, description) VALUES (?, ?, ?, ?)',
+                batch.transaction_rows()
+            )
+            conn.commit()
+            return batch.result()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Ошибка при пакетном изменении баланса: {e}")
+            return None
 
+    def get_all_skins(self):
+
+        """Получает все скины в наличии (из кеша каталога)"""
+
+        try:
+            return self.catalog.get_skins(self.load_catalog)
         except Exception as e:
             logger.error(f"Ошибка при получении скинов: {e}")
             return []
 
+    def get_catalog_snapshot(self):
+
+        """Получает (версия каталога, скины в наличии) из кеша каталога"""
+
+        try:
+            return self.catalog.get_snapshot(self.load_catalog)
+        except Exception as e:
+            logger.error(f"Ошибка при получении каталога: {e}")
+            return None, []
+
+    def get_search_catalog(self):
+
+        """Получает (версия текста каталога, все скины по ID) для inline-поиска"""
+
+        try:
+            return self.catalog.get_search_snapshot(self.load_catalog)
+        except Exception as e:
+            logger.error(f"Ошибка при получении каталога для поиска: {e}")
+            return None, {}
+
+    def load_catalog(self):
+
+        """Читает все скины из базы для кеша каталога"""
+
+        with self.get_connection() as conn:
+            skins = conn.execute('SELECT * FROM skins').fetchall()
+            return [dict(skin) for skin in skins]
+
     def get_skin_by_id(self, skin_id):
 
-        """Получает скин по ID"""
+        """Получает скин по ID (из кеша каталога)"""
 
         try:
-            with self.get_connection() as conn:
-                skin = conn.execute(
-                    'SELECT * FROM skins WHERE skin_id = ?',
-                    (skin_id,)
-                ).fetchone()
-                return dict(skin) if skin else None
+            return self.catalog.get_skin(skin_id, self.load_catalog)
         except Exception as e:
             logger.error(f"Ошибка при получении скина: {e}")
             return None
@@ -179,26 +389,33 @@ class Database:
 
         try:
             with self.get_connection() as conn:
-                # Проверяем, есть ли уже такой скин у пользователя
-                existing = conn.execute(
-                    'SELECT * FROM user_inventory WHERE user_id = ? AND skin_id = ?',
-                    (user_id, skin_id)
-                ).fetchone()
+                conn.execute('BEGIN IMMEDIATE')
 
-                if not existing:
-                    conn.execute(
-                        'INSERT INTO user_inventory (user_id, skin_id) VALUES (?, ?)',
-                        (user_id, skin_id)
-                    )
-                    # Уменьшаем количество скина
-                    conn.execute(
-                        'UPDATE skins SET quantity = quantity - 1 WHERE skin_id = ?',
-                        (skin_id,)
+                # Уменьшаем количество скина, только если есть незарезервированный остаток
+                row = conn.execute(
+                    'UPDATE skins SET quantity = quantity - 1 WHERE skin_id = ? AND quantity - reserved > 0 '
+                    'RETURNING skin_id, quantity, reserved',
+                    (skin_id,)
+                ).fetchone()
+                if not row:
+                    conn.rollback()
+                    return False
+
+                # Добавляем, только если такого скина еще нет у пользователя
+                cursor = conn.execute('''
+                    INSERT INTO user_inventory (user_id, skin_id)
+                    SELECT ?, ?
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM user_inventory WHERE user_id = ? AND skin_id = ?
                     )
-                    conn.commit()
-                    logger.info(f"Скин {skin_id} добавлен в инвентарь пользователя {user_id}")
-                    return True
-                return False
+                ''', (user_id, skin_id, user_id, skin_id))
+                if cursor.rowcount == 0:
+                    conn.rollback()
+                    return False
+
+                self._commit_with_stock(conn, [row])
+                logger.info(f"Скин {skin_id} добавлен в инвентарь пользователя {user_id}")
+                return True
         except Exception as e:
             logger.error(f"Ошибка при добавлении в инвентарь: {e}")
             return False
@@ -223,16 +440,15 @@ class Database:
 
     def add_transaction(self, user_id, amount, transaction_type, description):
 
-        """Добавляет запись о транзакции"""
+        """Добавляет запись о транзакции (через фоновую запись)"""
 
         try:
-            with self.get_connection() as conn:
-                conn.execute(
-                    'INSERT INTO transactions (user_id, amount, type, description) VALUES (?, ?, ?, ?)',
-                    (user_id, amount, transaction_type, description)
-                )
-                conn.commit()
-                logger.info(f"Транзакция добавлена для пользователя {user_id}")
+            self._write_behind(
+                'INSERT INTO transactions (user_id, amount, type, description) VALUES (?, ?, ?, ?)',
+                (user_id, amount, transaction_type, description),
+                key=('user', user_id)
+            )
+            logger.info(f"Транзакция добавлена для пользователя {user_id}")
         except Exception as e:
             logger.error(f"Ошибка при добавлении транзакции: {e}")
 
@@ -245,12 +461,50 @@ class Database:
                     VALUES (?, ?, ?, ?, ?, ?, ?)
                 ''', (name, description, price, rarity, roblox_id, image_url, quantity))
                 conn.commit()
+                self.catalog.invalidate()
                 logger.info(f"Скин '{name}' добавлен в базу (количество: {quantity})")
                 return True
         except Exception as e:
             logger.error(f"Ошибка при добавлении скина: {e}")
             return False
 
+    def import_skins(self, skins):
+        """Добавляет или обновляет скины одной транзакцией (ключ - roblox_id).
+
+        skins - проверенные строки из bulk_import.parse_skins_file. Скин с уже
+        существующим roblox_id обновляется: quantity становится новым остатком,
+        но не меньше числа резервов в корзинах. Возвращает
+        {'inserted': N, 'updated': M} или None при ошибке (ничего не записано).
+        """
+        try:
+            with self.get_connection() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                existing = {
+                    row['roblox_id'] for row in conn.execute(
+                        'SELECT DISTINCT roblox_id FROM skins WHERE roblox_id IS NOT NULL'
+                    )
+                }
+                updates, inserts = split_import(skins, existing)
+
+                conn.executemany('''
+                    UPDATE skins
+                    SET name = :name, description = :description, price = :price, rarity = :rarity,
+                        image_url = :image_url, quantity = MAX(:quantity, reserved)
+                    WHERE roblox_id = :roblox_id
+                ''', updates)
+                conn.executemany('''
+                    INSERT INTO skins (name, description, price, rarity, roblox_id, image_url, quantity)
+                    VALUES (:name, :description, :price, :rarity, :roblox_id, :image_url, :quantity)
+                ''', inserts)
+                conn.commit()
+
+            self.catalog.invalidate()
+            logger.info(f"Импорт скинов: добавлено {len(inserts)}, обновлено {len(updates)}")
+            return {'inserted': len(inserts), 'updated': len(updates)}
+        except Exception as e:
+            logger.error(f"Ошибка при импорте скинов: {e}")
+            return None
+
     def get_all_users(self):
 
         """Получает всех пользователей"""
@@ -265,155 +519,720 @@ class Database:
             logger.error(f"Ошибка при получении пользователей: {e}")
             return []
 
+    @analytics_query
+    def get_users_page(self, page=0, per_page=5):
+        """Получает страницу пользователей (новые первыми): возвращает (пользователи, общее количество)"""
+
+        try:
+            with self.analytics_snapshot() as conn:
+                total = conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+                users = conn.execute('''
+                    SELECT user_id, username, first_name, last_name, balance_kop, created_at
+                    FROM users
+                    ORDER BY created_at DESC, user_id DESC
+                    LIMIT ? OFFSET ?
+                ''', (per_page, page_offset(page, per_page))).fetchall()
+                return [dict(user) for user in users], total
+        except Exception as e:
+            logger.error(f"Ошибка при получении страницы пользователей: {e}")
+            return [], 0
+
     def get_bot_stats(self):
 
         """Получает статистику бота"""
 
         try:
             with self.get_connection() as conn:
-                stats = {}
+                return self._read_stats_counters(conn)
+        except Exception as e:
+            logger.error(f"Ошибка при получении статистики: {e}")
+            return {}
+
+    def _read_stats_counters(self, conn):
 
-                # Общее количество пользователей
-                stats['total_users'] = conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+        """Читает общие счетчики, которые поддерживаются триггерами (миграция 5)"""
 
-                # Общее количество скинов
-                stats['total_skins'] = conn.execute('SELECT COUNT(*) FROM skins').fetchone()[0]
+        counters = {row['name']: row['value'] for row in conn.execute('SELECT name, value FROM stats_counters')}
+        return format_bot_stats(
+            counters.get('users', 0), counters.get('skins', 0),
+            counters.get('purchases', 0), counters.get('revenue', 0),
+        )
 
-                # Общее количество покупок
-                stats['total_purchases'] = conn.execute('SELECT COUNT(*) FROM user_inventory').fetchone()[0]
+    def search_skins(self, search_term):
 
-                # Общий оборот
-                result = conn.execute('SELECT SUM(amount) FROM transactions WHERE amount < 0').fetchone()[0]
-                stats['total_revenue'] = abs(result) if result else 0
+        """Ищет скины по названию или описанию (все результаты)"""
 
-                return stats
+        skins, _ = self.search_skins_page(search_term, page=0, per_page=-1)
+        return skins
+
+    def search_skins_page(self, search_term, page=0, per_page=5):
+
+        """Ищет скины через полнотекстовый индекс: возвращает (скины страницы, общее количество найденных).
+
+        Каждое слово запроса ищется как префикс без учета регистра и различия
+        'е'/'ё' ("нож" найдет "Нож" и "Ножницы"), результаты упорядочены по релевантности.
+        per_page=-1 возвращает все результаты.
+        """
+
+        fts_query = build_fts_query(search_term)
+        if not fts_query:
+            return [], 0
+
+        try:
+            with self.get_connection() as conn:
+                total = conn.execute(SQL_SEARCH_COUNT, (fts_query,)).fetchone()[0]
+
+                if total == 0:
+                    return [], 0
+
+                # Совпадение в названии весит больше, чем в описании
+                skins = conn.execute(
+                    SQL_SEARCH_PAGE, (fts_query, per_page, page_offset(page, per_page))
+                ).fetchall()
+                return [dict(skin) for skin in skins], total
         except Exception as e:
-            logger.error(f"Ошибка при получении статистики: {e}")
-            return {}
+            logger.error(f"Ошибка при поиске скинов: {e}")
+            return [], 0
 
-    def search_skins(self, search_term):
+    def search_skin_ids(self, search_term):
 
-        """Ищет скины по названию или описанию"""
+        """Ищет скины в наличии и возвращает только их ID в порядке релевантности"""
+
+        fts_query = build_fts_query(search_term)
+        if not fts_query:
+            return []
 
         try:
             with self.get_connection() as conn:
-                skins = conn.execute('''
-                    SELECT * FROM skins 
-                    WHERE quantity > 0 
-                    AND (name LIKE ? OR description LIKE ?)
-                    ORDER BY 
-                        CASE rarity 
-                            WHEN 'Legendary' THEN 1
-                            WHEN 'Godly' THEN 2 
-                            WHEN 'Ancient' THEN 3
-                            ELSE 4
-                        END,
-                        price ASC
-                ''', (f'%{search_term}%', f'%{search_term}%')).fetchall()
-                return [dict(skin) for skin in skins]
+                rows = conn.execute('''
+                    SELECT s.skin_id
+                    FROM skins_fts f
+                    JOIN skins s ON s.skin_id = f.rowid
+                    WHERE skins_fts MATCH ? AND s.quantity > s.reserved
+                    ORDER BY bm25(skins_fts, 10.0, 1.0), s.price ASC, s.skin_id ASC
+                ''', (fts_query,)).fetchall()
+                return [row[0] for row in rows]
         except Exception as e:
             logger.error(f"Ошибка при поиске скинов: {e}")
             return []
 
-    # -----------------------МЕТОДЫ-КОРЗИНЫ------------------------- #
+    def get_skins_by_ids(self, skin_ids):
+
+        """Получает скины по списку ID (из кеша каталога), пропуская удаленные"""
+
+        skins = []
+        for skin_id in skin_ids:
+            skin = self.get_skin_by_id(skin_id)
+            if skin:
+                skins.append(skin)
+        return skins
+
+    # -----------------------ЖУРНАЛ-БАЛАНСА------------------------- #
+
+    def _apply_balance_delta(self, conn, user_id, delta_kop, kind, description=None):
+
+        """Меняет баланс на delta_kop копеек и добавляет запись в журнал.
+
+        Вызывается внутри уже открытой транзакции. Возвращает новый баланс
+        в копейках или None, если пользователь не найден или баланс стал бы
+        отрицательным.
+        """
+
+        row = conn.execute('''
+            UPDATE users
+            SET balance_kop = balance_kop + ?, balance = (balance_kop + ?) / 100.0
+            WHERE user_id = ? AND balance_kop + ? >= 0
+            RETURNING balance_kop
+        ''', (delta_kop, delta_kop, user_id, delta_kop)).fetchone()
+        if not row:
+            return None
+
+        conn.execute(
+            'INSERT INTO balance_ledger (user_id, delta_kop, balance_kop, kind, description) VALUES (?, ?, ?, ?, ?)',
+            (user_id, delta_kop, row['balance_kop'], kind, description)
+        )
+        return row['balance_kop']
+
+    def get_balance(self, user_id):
+
+        """Получает текущий баланс пользователя в копейках (None, если пользователя нет)"""
 
-    def add_to_cart(self, user_id, skin_id):
-        """Добавляет скин в корзину пользователя"""
         try:
             with self.get_connection() as conn:
-                # Проверяем, есть ли уже в корзине
-                existing = conn.execute(
-                    'SELECT * FROM user_cart WHERE user_id = ? AND skin_id = ?',
-                    (user_id, skin_id)
-                ).fetchone()
+                row = conn.execute(SQL_BALANCE_BY_USER, (user_id,)).fetchone()
+                if not row and self._flush_if_pending(user_id):
+                    row = conn.execute(SQL_BALANCE_BY_USER, (user_id,)).fetchone()
+                return row['balance_kop'] if row else None
+        except Exception as e:
+            logger.error(f"Ошибка при получении баланса: {e}")
+            return None
+
+    def get_balance_history(self, user_id, limit=20):
+
+        """Получает последние записи журнала баланса пользователя"""
+
+        try:
+            with self.get_connection() as conn:
+                entries = conn.execute(SQL_BALANCE_HISTORY, (user_id, limit)).fetchall()
+                return [dict(entry) for entry in entries]
+        except Exception as e:
+            logger.error(f"Ошибка при получении журнала баланса: {e}")
+            return []
+
+    def replay_balance(self, user_id):
+
+        """Восстанавливает баланс по журналу: последний снимок + записи после него"""
 
-                if not existing:
-                    conn.execute(
-                        'INSERT INTO user_cart (user_id, skin_id) VALUES (?, ?)',
-                        (user_id, skin_id)
+        try:
+            with self.get_connection() as conn:
+                row = conn.execute('''
+                    SELECT
+                        IFNULL(s.balance_kop, 0) + IFNULL((
+                            SELECT SUM(l.delta_kop) FROM balance_ledger l
+                            WHERE l.user_id = ? AND l.entry_id > IFNULL(s.entry_id, 0)
+                        ), 0)
+                    FROM (SELECT 1)
+                    LEFT JOIN (
+                        SELECT entry_id, balance_kop FROM balance_snapshots
+                        WHERE user_id = ?
+                        ORDER BY entry_id DESC
+                        LIMIT 1
+                    ) s
+                ''', (user_id, user_id)).fetchone()
+                return row[0]
+        except Exception as e:
+            logger.error(f"Ошибка при восстановлении баланса по журналу: {e}")
+            return None
+
+    def audit_balances(self):
+
+        """Сверяет балансы пользователей с журналом.
+
+        Возвращает список расхождений [{'user_id', 'balance_kop', 'replayed_kop'}]
+        (пустой, если все сходится) или None при ошибке.
+        """
+
+        try:
+            with self.get_connection() as conn:
+                rows = conn.execute('''
+                    SELECT * FROM (
+                        SELECT
+                            u.user_id,
+                            u.balance_kop,
+                            IFNULL(s.balance_kop, 0) + IFNULL((
+                                SELECT SUM(l.delta_kop) FROM balance_ledger l
+                                WHERE l.user_id = u.user_id AND l.entry_id > IFNULL(s.entry_id, 0)
+                            ), 0) AS replayed_kop
+                        FROM users u
+                        LEFT JOIN balance_snapshots s ON s.user_id = u.user_id AND s.entry_id = (
+                            SELECT MAX(entry_id) FROM balance_snapshots WHERE user_id = u.user_id
+                        )
                     )
-                    conn.commit()
-                    logger.info(f"Скин {skin_id} добавлен в корзину пользователя {user_id}")
-                    return True
-                return False
+                    WHERE balance_kop != replayed_kop
+                ''').fetchall()
+                mismatches = [dict(row) for row in rows]
+                if mismatches:
+                    logger.error(f"Балансы расходятся с журналом у {len(mismatches)} пользователей")
+                return mismatches
+        except Exception as e:
+            logger.error(f"Ошибка при сверке балансов: {e}")
+            return None
+
+    def snapshot_balances(self):
+
+        """Делает снимки балансов пользователей, у которых появились новые записи в журнале.
+
+        Снимок считается сверткой журнала от предыдущего снимка, поэтому
+        последующие сверки и восстановление читают только свежие записи.
+        Возвращает количество новых снимков или None при ошибке.
+        """
+
+        conn = self.get_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            cursor = conn.execute('''
+                INSERT INTO balance_snapshots (user_id, entry_id, balance_kop)
+                SELECT l.user_id, MAX(l.entry_id), IFNULL(s.balance_kop, 0) + SUM(l.delta_kop)
+                FROM balance_ledger l
+                LEFT JOIN balance_snapshots s ON s.user_id = l.user_id AND s.entry_id = (
+                    SELECT MAX(entry_id) FROM balance_snapshots WHERE user_id = l.user_id
+                )
+                WHERE l.entry_id > IFNULL(s.entry_id, 0)
+                GROUP BY l.user_id
+            ''')
+            conn.commit()
+            logger.info(f"Сделано снимков балансов: {cursor.rowcount}")
+            return cursor.rowcount
         except Exception as e:
+            conn.rollback()
+            logger.error(f"Ошибка при создании снимков балансов: {e}")
+            return None
+
+    # -----------------------АРХИВ-ТРАНЗАКЦИЙ------------------------- #
+
+    def archive_transactions(self, older_than_days=DB_ARCHIVE_AFTER_DAYS, batch_size=DB_ARCHIVE_BATCH):
+        """Переносит транзакции старше older_than_days дней в архивную базу.
+
+        Строки переносятся пачками по batch_size, каждая пачка - своей
+        транзакцией, чтобы не держать блокировку записи долго. Вместо
+        перенесенных строк в transaction_rollups накапливаются итоги по
+        (пользователь, тип, месяц). Итоги и удаление пишутся в основную базу
+        вместе; вставка в архив идемпотентна (INSERT OR IGNORE), поэтому
+        прерванную архивацию можно просто запустить заново.
+        Возвращает количество перенесенных строк или None при ошибке.
+        """
+
+        conn = self.get_connection()
+        moved = 0
+        try:
+            cutoff = conn.execute("SELECT datetime('now', ?)", (f'-{int(older_than_days)} days',)).fetchone()[0]
+            while True:
+                conn.execute('BEGIN IMMEDIATE')
+                last_id = conn.execute('''
+                    SELECT MAX(transaction_id) FROM (
+                        SELECT transaction_id FROM main.transactions
+                        WHERE created_at < ?
+                        ORDER BY transaction_id
+                        LIMIT ?
+                    )
+                ''', (cutoff, batch_size)).fetchone()[0]
+                if last_id is None:
+                    conn.rollback()
+                    break
+
+                batch = (cutoff, last_id)
+                conn.execute('''
+                    INSERT OR IGNORE INTO archive.transactions
+                        (transaction_id, user_id, amount, type, description, created_at)
+                    SELECT transaction_id, user_id, amount, type, description, created_at
+                    FROM main.transactions
+                    WHERE created_at < ? AND transaction_id <= ?
+                ''', batch)
+                conn.execute('''
+                    INSERT INTO transaction_rollups (user_id, type, month, count, total_amount)
+                    SELECT IFNULL(user_id, 0), IFNULL(type, ''), strftime('%Y-%m', created_at), COUNT(*), IFNULL(SUM(amount), 0)
+                    FROM main.transactions
+                    WHERE created_at < ? AND transaction_id <= ?
+                    GROUP BY 1, 2, 3
+                    ON CONFLICT (user_id, type, month) DO UPDATE SET
+                        count = count + excluded.count,
+                        total_amount = total_amount + excluded.total_amount
+                ''', batch)
+                deleted = conn.execute(
+                    'DELETE FROM main.transactions WHERE created_at < ? AND transaction_id <= ?', batch
+                ).rowcount
+                conn.commit()
+
+                moved += deleted
+                if deleted < batch_size:
+                    break
+
+            logger.info(f"В архив перенесено транзакций: {moved} (старше {older_than_days} дней)")
+            return moved
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Ошибка при архивации транзакций (перенесено {moved}): {e}")
+            return None
+
+    def get_user_transactions(self, user_id, limit=20, include_archive=False):
+        """Получает последние транзакции пользователя.
+
+        С include_archive=True читает и архивную базу; у каждой строки есть
+        поле archived (0 - основная таблица, 1 - архив).
+        """
+
+        self._flush_if_pending(user_id)
+        try:
+            with self.get_connection() as conn:
+                if include_archive:
+                    rows = conn.execute('''
+                        SELECT transaction_id, user_id, amount, type, description, created_at, 0 AS archived
+                        FROM main.transactions WHERE user_id = ?
+                        UNION ALL
+                        SELECT transaction_id, user_id, amount, type, description, created_at, 1 AS archived
+                        FROM archive.transactions WHERE user_id = ?
+                        ORDER BY created_at DESC, transaction_id DESC
+                        LIMIT ?
+                    ''', (user_id, user_id, limit)).fetchall()
+                else:
+                    rows = conn.execute('''
+                        SELECT transaction_id, user_id, amount, type, description, created_at, 0 AS archived
+                        FROM main.transactions WHERE user_id = ?
+                        ORDER BY created_at DESC, transaction_id DESC
+                        LIMIT ?
+                    ''', (user_id, limit)).fetchall()
+                return [dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Ошибка при получении транзакций пользователя: {e}")
+            return []
+
+    @analytics_query
+    def get_transaction_totals(self, user_id=None):
+        """Итоги транзакций по типам за все время (основная таблица + итоги архива).
+
+        Архивную базу не читает: для перенесенных строк используются
+        transaction_rollups. Без user_id - по всем пользователям.
+        """
+
+        try:
+            with self.analytics_snapshot() as conn:
+                rows = conn.execute('''
+                    SELECT type, SUM(count) AS count, ROUND(SUM(total), 2) AS total
+                    FROM (
+                        SELECT IFNULL(type, '') AS type, COUNT(*) AS count, IFNULL(SUM(amount), 0) AS total
+                        FROM main.transactions
+                        WHERE ?1 IS NULL OR user_id = ?1
+                        GROUP BY 1
+                        UNION ALL
+                        SELECT type, SUM(count), SUM(total_amount)
+                        FROM transaction_rollups
+                        WHERE ?1 IS NULL OR user_id = ?1
+                        GROUP BY type
+                    )
+                    GROUP BY type
+                    ORDER BY type
+                ''', (user_id,)).fetchall()
+                return [dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Ошибка при получении итогов транзакций: {e}")
+            return []
+
+    @analytics_query
+    def get_archive_stats(self):
+        """Размеры основной таблицы транзакций и архива"""
+
+        try:
+            with self.analytics_snapshot() as conn:
+                row = conn.execute('''
+                    SELECT
+                        (SELECT COUNT(*) FROM main.transactions) AS hot_rows,
+                        (SELECT MIN(created_at) FROM main.transactions) AS oldest_hot,
+                        (SELECT COUNT(*) FROM archive.transactions) AS archived_rows,
+                        (SELECT COUNT(*) FROM transaction_rollups) AS rollup_rows
+                ''').fetchone()
+                return dict(row)
+        except Exception as e:
+            logger.error(f"Ошибка при получении статистики архива: {e}")
+            return {}
+
+    # -----------------------МЕТОДЫ-КОРЗИНЫ------------------------- #
+
+    def _release_reservations(self, conn, user_id, skin_id=None):
+
+        """Удаляет позиции корзины пользователя (все или одну) и снимает их резервы.
+
+        Вызывается внутри уже открытой транзакции. Возвращает новые остатки
+        [{'skin_id', 'quantity', 'reserved'}] для обновления кеша каталога.
+        """
+
+        if skin_id is None:
+            cursor = conn.execute('DELETE FROM user_cart WHERE user_id = ? RETURNING skin_id', (user_id,))
+        else:
+            cursor = conn.execute(
+                'DELETE FROM user_cart WHERE user_id = ? AND skin_id = ? RETURNING skin_id',
+                (user_id, skin_id)
+            )
+        released = [row['skin_id'] for row in cursor.fetchall()]
+
+        stock = []
+        for released_skin_id in released:
+            row = conn.execute(
+                'UPDATE skins SET reserved = reserved - 1 WHERE skin_id = ? AND reserved > 0 '
+                'RETURNING skin_id, quantity, reserved',
+                (released_skin_id,)
+            ).fetchone()
+            if row:
+                stock.append(dict(row))
+        return stock
+
+    def _update_cached_stock(self, stock):
+        """Переносит новые остатки и резервы скинов в кеш каталога"""
+        for row in stock:
+            self.catalog.update_skin(row['skin_id'], quantity=row['quantity'], reserved=row['reserved'])
+
+    def _commit_with_stock(self, conn, stock):
+        """Фиксирует транзакцию BEGIN IMMEDIATE и переносит остатки в кеш каталога.
+
+        Кеш обновляется до COMMIT, пока транзакция держит блокировку записи:
+        так кеш меняется в том же порядке, в каком фиксируются транзакции, и
+        остатки более старой транзакции не перезапишут новые. Если COMMIT не
+        удался, кеш каталога сбрасывается.
+        """
+        self._update_cached_stock(stock)
+        try:
+            conn.commit()
+        except Exception:
+            self.catalog.invalidate()
+            raise
+
+    def add_to_cart(self, user_id, skin_id):
+        """Добавляет скин в корзину и резервирует единицу товара на CART_RESERVATION_TTL секунд.
+
+        Резерв каждой позиции живет CART_RESERVATION_TTL секунд с момента ее
+        добавления; новые добавления не продлевают резервы остальных позиций,
+        иначе товар можно держать в корзине бесконечно. Возвращает
+            {'success': True, 'expires_at': ...}
+            {'success': False, 'reason': 'already_in_cart' | 'out_of_stock' | 'error'}
+        """
+        expires_in = f'+{CART_RESERVATION_TTL} seconds'
+        conn = self.get_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+
+            if conn.execute(
+                'SELECT 1 FROM user_cart WHERE user_id = ? AND skin_id = ?',
+                (user_id, skin_id)
+            ).fetchone():
+                conn.rollback()
+                return {'success': False, 'reason': 'already_in_cart'}
+
+            # Резерв проходит, только если есть незарезервированный остаток
+            row = conn.execute(
+                'UPDATE skins SET reserved = reserved + 1 WHERE skin_id = ? AND quantity - reserved > 0 '
+                'RETURNING skin_id, quantity, reserved',
+                (skin_id,)
+            ).fetchone()
+            if not row:
+                conn.rollback()
+                return {'success': False, 'reason': 'out_of_stock'}
+
+            expires_at = conn.execute(
+                "INSERT INTO user_cart (user_id, skin_id, expires_at) VALUES (?, ?, datetime('now', ?)) "
+                "RETURNING expires_at",
+                (user_id, skin_id, expires_in)
+            ).fetchone()['expires_at']
+
+            self._commit_with_stock(conn, [row])
+            logger.info(f"Скин {skin_id} добавлен в корзину пользователя {user_id} (резерв до {expires_at})")
+            return {'success': True, 'expires_at': expires_at}
+        except Exception as e:
+            conn.rollback()
             logger.error(f"Ошибка при добавлении в корзину: {e}")
-            return False
+            return {'success': False, 'reason': 'error'}
 
     def get_user_cart(self, user_id):
         """Получает корзину пользователя"""
         try:
             with self.get_connection() as conn:
-                cart = conn.execute('''
-                    SELECT uc.*, s.name, s.description, s.price, s.rarity, s.quantity, s.image_url
-                    FROM user_cart uc
-                    JOIN skins s ON uc.skin_id = s.skin_id
-                    WHERE uc.user_id = ?
-                ''', (user_id,)).fetchall()
+                cart = conn.execute(SQL_CART_ITEMS, (user_id,)).fetchall()
                 return [dict(item) for item in cart]
         except Exception as e:
             logger.error(f"Ошибка при получении корзины: {e}")
             return []
 
     def clear_user_cart(self, user_id):
-        """Очищает корзину пользователя"""
+        """Очищает корзину пользователя и снимает резервы"""
+        conn = self.get_connection()
         try:
-            with self.get_connection() as conn:
-                conn.execute('DELETE FROM user_cart WHERE user_id = ?', (user_id,))
-                conn.commit()
-                logger.info(f"Корзина пользователя {user_id} очищена")
-                return True
+            conn.execute('BEGIN IMMEDIATE')
+            stock = self._release_reservations(conn, user_id)
+            self._commit_with_stock(conn, stock)
+            logger.info(f"Корзина пользователя {user_id} очищена")
+            return True
         except Exception as e:
+            conn.rollback()
             logger.error(f"Ошибка при очистке корзины: {e}")
             return False
 
     def remove_from_cart(self, user_id, skin_id):
-        """Удаляет скин из корзины"""
+        """Удаляет скин из корзины и снимает его резерв"""
+        conn = self.get_connection()
         try:
-            with self.get_connection() as conn:
-                conn.execute(
-                    'DELETE FROM user_cart WHERE user_id = ? AND skin_id = ?',
-                    (user_id, skin_id)
-                )
-                conn.commit()
-                logger.info(f"Скин {skin_id} удален из корзины пользователя {user_id}")
-                return True
+            conn.execute('BEGIN IMMEDIATE')
+            stock = self._release_reservations(conn, user_id, skin_id)
+            self._commit_with_stock(conn, stock)
+            logger.info(f"Скин {skin_id} удален из корзины пользователя {user_id}")
+            return True
         except Exception as e:
+            conn.rollback()
             logger.error(f"Ошибка при удалении из корзины: {e}")
             return False
 
+    def release_expired_reservations(self):
+        """Снимает просроченные резервы корзин одной транзакцией.
+
+        Возвращает количество удаленных позиций корзин или None при ошибке.
+        """
+        conn = self.get_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # Одна отсечка на оба запроса, чтобы не снять резерв без удаления позиции
+            now = conn.execute("SELECT datetime('now')").fetchone()[0]
+
+            stock = [dict(row) for row in conn.execute('''
+                UPDATE skins
+                SET reserved = MAX(reserved - (
+                    SELECT COUNT(*) FROM user_cart uc
+                    WHERE uc.skin_id = skins.skin_id AND uc.expires_at <= ?
+                ), 0)
+                WHERE skin_id IN (SELECT skin_id FROM user_cart WHERE expires_at <= ?)
+                RETURNING skin_id, quantity, reserved
+            ''', (now, now)).fetchall()]
+            released = conn.execute('DELETE FROM user_cart WHERE expires_at <= ?', (now,)).rowcount
+
+            self._commit_with_stock(conn, stock)
+            if released:
+                logger.info(f"Сняты просроченные резервы корзин: {released} позиций, {len(stock)} скинов")
+            return released
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Ошибка при снятии просроченных резервов: {e}")
+            return None
+
     def get_cart_count(self, user_id):
         """Получает количество товаров в корзине"""
         try:
             with self.get_connection() as conn:
-                count = conn.execute(
-                    'SELECT COUNT(*) FROM user_cart WHERE user_id = ?',
-                    (user_id,)
-                ).fetchone()[0]
+                count = conn.execute(SQL_CART_COUNT, (user_id,)).fetchone()[0]
                 return count
         except Exception as e:
             logger.error(f"Ошибка при получении количества корзины: {e}")
             return 0
 
+    # -----------------------ОФОРМЛЕНИЕ-ПОКУПКИ------------------------- #
+
+    def checkout(self, user_id, skin_ids=None):
+        """Покупает скины одной транзакцией BEGIN IMMEDIATE.
+
+        Без skin_ids покупается вся корзина пользователя (и корзина очищается),
+        иначе - перечисленные скины. Резервы покупателя в корзине снимаются
+        внутри той же транзакции, так что зарезервированный товар ему гарантированно
+        достанется. Скины, которые уже есть в инвентаре, пропускаются; если
+        куплены все скины корзины, корзина очищается и возвращается 'already_owned'.
+        Возвращает словарь:
+            {'success': True, 'order_id': ..., 'items': [...], 'total_kop': ..., 'balance_kop': ...}
+            {'success': False, 'reason': 'out_of_stock' | 'insufficient_funds' | ..., ...}
+        """
+        result = self._checkout(user_id, skin_ids)
+        # Пользователь мог только что зарегистрироваться и еще стоять в очереди записи
+        if result.get('reason') == 'user_not_found' and self._flush_if_pending(user_id):
+            result = self._checkout(user_id, skin_ids)
+        return result
+
+    def _checkout(self, user_id, skin_ids):
+        from_cart = skin_ids is None
+        conn = self.get_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+
+            if from_cart:
+                rows = conn.execute('''
+                    SELECT s.skin_id, s.name, s.price, s.rarity
+                    FROM user_cart uc
+                    JOIN skins s ON uc.skin_id = s.skin_id
+                    WHERE uc.user_id = ?
+                    ORDER BY uc.cart_id
+                ''', (user_id,)).fetchall()
+                if not rows:
+                    raise CheckoutError('empty_cart')
+            else:
+                rows = []
+                for skin_id in skin_ids:
+                    row = conn.execute(
+                        'SELECT skin_id, name, price, rarity FROM skins WHERE skin_id = ?',
+                        (skin_id,)
+                    ).fetchone()
+                    if not row:
+                        raise CheckoutError('skin_not_found', skin_id=skin_id)
+                    rows.append(row)
+
+            owned = [
+                row[0] for row in conn.execute(
+                    'SELECT skin_id FROM user_inventory WHERE user_id = ?',
+                    (user_id,)
+                )
+            ]
+            purchase = Purchase(user_id, rows, owned)
+            items = purchase.items
+
+            # Снимаем резервы покупателя: под блокировкой BEGIN IMMEDIATE освобожденные
+            # единицы никто не перехватит, и ниже они спишутся как обычный остаток
+            if from_cart:
+                released = self._release_reservations(conn, user_id)
+            else:
+                released = []
+                for item in items:
+                    released += self._release_reservations(conn, user_id, item['skin_id'])
+
+            if not items:
+                # Все скины корзины уже куплены: корзина все равно очищается, иначе
+                # их резервы висели бы до снятия просроченных резервов
+                self._commit_with_stock(conn, released)
+                return {'success': False, 'reason': 'already_owned'}
+
+            # Остаток и баланс проверяет сама база: условные UPDATE не пропустят
+            # списание чужих резервов и баланса ниже нуля, даже при одновременных покупках
+            for item in items:
+                row = conn.execute(
+                    'UPDATE skins SET quantity = quantity - 1 WHERE skin_id = ? AND quantity - reserved > 0 '
+                    'RETURNING skin_id, quantity, reserved',
+                    (item['skin_id'],)
+                ).fetchone()
+                if not row:
+                    raise CheckoutError('out_of_stock', skin_id=item['skin_id'], skin_name=item['name'])
+                item['quantity'] = row['quantity']
+                released.append(dict(row))
+
+            balance_kop = self._apply_balance_delta(
+                conn, user_id, -purchase.total_kop, 'purchase', purchase.description
+            )
+            if balance_kop is None:
+                user = conn.execute('SELECT balance_kop FROM users WHERE user_id = ?', (user_id,)).fetchone()
+                if not user:
+                    raise CheckoutError('user_not_found')
+                raise CheckoutError('insufficient_funds', balance_kop=user['balance_kop'], total_kop=purchase.total_kop)
+
+            for item in items:
+                cursor = conn.execute('''
+                    INSERT INTO user_inventory (user_id, skin_id)
+                    SELECT ?, ?
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM user_inventory WHERE user_id = ? AND skin_id = ?
+                    )
+                ''', (user_id, item['skin_id'], user_id, item['skin_id']))
+                if cursor.rowcount == 0:
+                    raise CheckoutError('already_owned', skin_id=item['skin_id'], skin_name=item['name'])
+
+            conn.executemany(
+                'INSERT INTO transactions (user_id, amount, type, description) VALUES (?, ?, ?, ?)',
+                purchase.transaction_rows()
+            )
+            # Заказ с ценами на момент покупки
+            order_id = conn.execute(
+                'INSERT INTO orders (user_id, total, items_count) VALUES (?, ?, ?)',
+                (user_id, purchase.total_price, len(items))
+            ).lastrowid
+            conn.executemany(
+                'INSERT INTO order_items (order_id, skin_id, skin_name, price, quantity) VALUES (?, ?, ?, ?, 1)',
+                purchase.order_item_rows(order_id)
+            )
+
+            self._commit_with_stock(conn, released)
+            return purchase.result(order_id, balance_kop)
+
+        except CheckoutError as e:
+            conn.rollback()
+            return {'success': False, 'reason': e.reason, **e.details}
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Ошибка при оформлении покупки: {e}")
+            return {'success': False, 'reason': 'error'}
+
     # -----------------------МЕТОДЫ-ИНВЕНТОРЯ------------------------- #
 
     def remove_from_inventory_mm2(self, user_id, skin_id):
         """Удаляет скин из инвентаря после вывода в MM2 (без возврата в каталог)"""
         try:
             with self.get_connection() as conn:
-                # Проверяем, есть ли скин у пользователя
-                inventory_item = conn.execute(
-                    'SELECT * FROM user_inventory WHERE user_id = ? AND skin_id = ?',
+                # ⚠️ НЕ возвращаем в каталог - скин продан навсегда
+                cursor = conn.execute(
+                    'DELETE FROM user_inventory WHERE user_id = ? AND skin_id = ?',
                     (user_id, skin_id)
-                ).fetchone()
+                )
+                conn.commit()
 
-                if inventory_item:
-                    conn.execute(
-                        'DELETE FROM user_inventory WHERE user_id = ? AND skin_id = ?',
-                        (user_id, skin_id)
-                    )
-                    # ⚠️ НЕ возвращаем в каталог - скин продан навсегда
-                    conn.commit()
+                # Повторное подтверждение вывода ничего не удалит
+                if cursor.rowcount:
                     logger.info(f"Скин {skin_id} удален из инвентаря пользователя {user_id} (вывод в MM2)")
                     return True
                 return False
@@ -437,21 +1256,68 @@ class Database:
             logger.error(f"Ошибка при получении детального инвентаря: {e}")
             return []
 
+    def get_inventory_page(self, user_id, page=0, per_page=5):
+        """Получает страницу инвентаря: возвращает (предметы страницы, общее количество)"""
+        try:
+            with self.get_connection() as conn:
+                total = conn.execute(SQL_INVENTORY_COUNT, (user_id,)).fetchone()[0]
+
+                if total == 0:
+                    return [], 0
+
+                inventory = conn.execute(SQL_INVENTORY_PAGE, (user_id, per_page, page_offset(page, per_page))).fetchall()
+                return [dict(item) for item in inventory], total
+        except Exception as e:
+            logger.error(f"Ошибка при получении страницы инвентаря: {e}")
+            return [], 0
+
     # -----------------------АДМИН-ФУНКЦИИ------------------------- #
 
     def update_user_balance_directly(self, user_id, new_balance):
-        """Устанавливает точный баланс пользователя"""
+        """Устанавливает точный баланс пользователя (разница записывается в журнал баланса)"""
+        conn = self.get_connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT balance_kop FROM users WHERE user_id = ?', (user_id,)).fetchone()
+            if not row and self.writer and self.writer.pending(('user', user_id)):
+                # Отпускаем блокировку, чтобы фоновая запись сохранила нового пользователя
+                conn.rollback()
+                self.writer.flush()
+                conn.execute('BEGIN IMMEDIATE')
+                row = conn.execute('SELECT balance_kop FROM users WHERE user_id = ?', (user_id,)).fetchone()
+            if not row:
+                conn.rollback()
+                logger.warning(f"Пользователь {user_id} не найден при установке баланса")
+                return False
+
+            delta_kop = to_kopecks(new_balance) - row['balance_kop']
+            if delta_kop and self._apply_balance_delta(
+                conn, user_id, delta_kop, 'admin_set', f"Баланс установлен администратором: {new_balance}"
+            ) is None:
+                conn.rollback()
+                logger.warning(f"Баланс пользователя {user_id} не может быть отрицательным: {new_balance}")
+                return False
+
+            conn.commit()
+            logger.info(f"Баланс пользователя {user_id} установлен на {new_balance}")
+            return True
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Ошибка при установке баланса: {e}")
+            return False
+
+    def delete_skin(self, skin_id):
+        """Удаляет скин из каталога"""
         try:
             with self.get_connection() as conn:
-                conn.execute(
-                    'UPDATE users SET balance = ? WHERE user_id = ?',
-                    (new_balance, user_id)
-                )
+                conn.execute('DELETE FROM skins WHERE skin_id = ?', (skin_id,))
+                conn.execute('DELETE FROM user_cart WHERE skin_id = ?', (skin_id,))
                 conn.commit()
-                logger.info(f"Баланс пользователя {user_id} установлен на {new_balance}")
+                self.catalog.remove_skin(skin_id)
+                logger.info(f"Скин {skin_id} удален из каталога")
                 return True
         except Exception as e:
-            logger.error(f"Ошибка при установке баланса: {e}")
+            logger.error(f"Ошибка при удалении скина: {e}")
             return False
 
     def get_user_purchases(self, user_id):
@@ -459,56 +1325,49 @@ class Database:
         try:
             with self.get_connection() as conn:
                 purchases = conn.execute('''
-                    SELECT t.*, s.name as skin_name 
-                    FROM transactions t
-                    LEFT JOIN user_inventory ui ON t.description LIKE '%' || s.name || '%'
-                    LEFT JOIN skins s ON ui.skin_id = s.skin_id
-                    WHERE t.user_id = ? AND t.type = 'purchase'
-                    ORDER BY t.created_at DESC
+                    SELECT o.order_id, o.created_at, oi.skin_id, oi.skin_name, oi.price, oi.quantity
+                    FROM orders o
+                    JOIN order_items oi ON oi.order_id = o.order_id
+                    WHERE o.user_id = ?
+                    ORDER BY o.created_at DESC, o.order_id DESC
                 ''', (user_id,)).fetchall()
                 return [dict(purchase) for purchase in purchases]
         except Exception as e:
             logger.error(f"Ошибка при получении покупок пользователя: {e}")
             return []
 
+    @analytics_query
     def get_detailed_stats(self):
-        """Получает детальную статистику"""
+        """Получает детальную статистику (на соединении только для чтения, одним снимком)"""
         try:
-            with self.get_connection() as conn:
-                stats = {}
-
+            with self.analytics_snapshot() as conn:
                 # Базовая статистика
-                stats['total_users'] = conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
-                stats['total_skins'] = conn.execute('SELECT COUNT(*) FROM skins').fetchone()[0]
-                stats['total_purchases'] = conn.execute('SELECT COUNT(*) FROM user_inventory').fetchone()[0]
-
-                # Оборот
-                result = conn.execute('SELECT SUM(amount) FROM transactions WHERE amount < 0').fetchone()[0]
-                stats['total_revenue'] = abs(result) if result else 0
+                stats = self._read_stats_counters(conn)
 
                 # Статистика по редкостям
                 rarity_stats = conn.execute('''
-                    SELECT rarity, COUNT(*) as count, SUM(price) as total_value 
-                    FROM skins GROUP BY rarity
+                    SELECT rarity, count, ROUND(total_value, 2) as total_value
+                    FROM rarity_stats
+                    WHERE count > 0
+                    ORDER BY rarity
                 ''').fetchall()
                 stats['rarity_stats'] = [dict(row) for row in rarity_stats]
 
                 # Топ пользователей по балансу
                 top_users = conn.execute('''
-                    SELECT user_id, username, first_name, balance 
-                    FROM users 
-                    ORDER BY balance DESC 
+                    SELECT user_id, username, first_name, balance_kop
+                    FROM users
+                    ORDER BY balance_kop DESC
                     LIMIT 10
                 ''').fetchall()
                 stats['top_users'] = [dict(row) for row in top_users]
 
                 # Популярные скины
                 popular_skins = conn.execute('''
-                    SELECT s.skin_id, s.name, s.rarity, s.price, COUNT(ui.inventory_id) as sales_count
-                    FROM skins s
-                    LEFT JOIN user_inventory ui ON s.skin_id = ui.skin_id
-                    GROUP BY s.skin_id
-                    ORDER BY sales_count DESC
+                    SELECT s.skin_id, s.name, s.rarity, s.price, ss.sales_count
+                    FROM skin_sales ss
+                    JOIN skins s ON s.skin_id = ss.skin_id
+                    ORDER BY ss.sales_count DESC
                     LIMIT 10
                 ''').fetchall()
                 stats['popular_skins'] = [dict(row) for row in popular_skins]
@@ -516,4 +1375,152 @@ class Database:
                 return stats
         except Exception as e:
             logger.error(f"Ошибка при получении детальной статистики: {e}")
-            return {}
\ No newline at end of file
+            return {}
+
+    def rebuild_stats(self):
+        """Пересчитывает счетчики статистики по данным таблиц.
+
+        Возвращает {счетчик: (было, стало)} для счетчиков, которые разошлись
+        с данными, или False при ошибке.
+        """
+        try:
+            with self.get_connection() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    before = self._read_stats_counters(conn)
+                    rebuild_stats_counters(conn)
+                    after = self._read_stats_counters(conn)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+
+            drift = {name: (before[name], after[name]) for name in after if before[name] != after[name]}
+            if drift:
+                logger.warning(f"Счетчики статистики расходились с данными: {drift}")
+            return drift
+        except Exception as e:
+            logger.error(f"Ошибка при пересчете статистики: {e}")
+            return False
+
+# Статистика вызовов методов (служебные методы и контекстные менеджеры не оборачиваются)
+if DB_PROFILE or DB_PLAN_ASSERT:
+    profile_methods(Database, exclude=(
+        'get_connection', 'get_pool_stats', 'get_profile_stats', 'get_writer_stats',
+        'flush_writes', 'close', 'analytics_snapshot', 'assert_query_plans',
+    ))
+
+class AsyncDatabase(Storage):
+    """Асинхронная обертка над Database (реализация Storage для SQLite).
+
+    Каждый вызов метода выполняется в отдельном пуле потоков, поэтому
+    медленный запрос не блокирует event loop бота:
+
+        skins = await db.get_all_skins()
+
+    Отчеты (методы с @analytics_query) выполняются в своем пуле на
+    DB_ANALYTICS_WORKERS потоков: лишние отчеты ждут очереди там и не
+    занимают потоки, нужные покупкам.
+
+    Методы интерфейса Storage создаются ниже (_delegate_storage_methods),
+    остальные методы Database доступны через __getattr__.
+    """
+
+    def __init__(self, database=None, max_workers=DB_WORKERS, analytics_workers=DB_ANALYTICS_WORKERS):
+        self.database = database or Database()
+        self.max_workers = max_workers
+        self.analytics_workers = analytics_workers
+        self.executor = None
+        self.analytics_executor = None
+        self._executor_lock = threading.Lock()
+
+    def get_executor(self):
+        """Возвращает пул потоков, создавая его при первом обращении"""
+        with self._executor_lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='db')
+            return self.executor
+
+    def get_analytics_executor(self):
+        """Возвращает пул потоков для отчетов, создавая его при первом обращении"""
+        with self._executor_lock:
+            if self.analytics_executor is None:
+                self.analytics_executor = ThreadPoolExecutor(
+                    max_workers=self.analytics_workers, thread_name_prefix='db-analytics'
+                )
+            return self.analytics_executor
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        method = getattr(self.database, name)
+        if not callable(method):
+            return method
+
+        async def wrapper(*args, **kwargs):
+            return await self._run(name, *args, **kwargs)
+
+        wrapper.__name__ = name
+        wrapper.__doc__ = method.__doc__
+        # Кешируем обертку, чтобы не создавать ее при каждом вызове
+        setattr(self, name, wrapper)
+        return wrapper
+
+    async def _run(self, name, *args, **kwargs):
+        """Выполняет метод Database в пуле потоков (отчеты - в пуле для отчетов)"""
+        method = getattr(self.database, name)
+        get_executor = self.get_analytics_executor if getattr(method, 'analytics', False) else self.get_executor
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_executor(), partial(method, *args, **kwargs))
+
+    async def close(self):
+        """Дожидается выполнения запросов, сохраняет очередь фоновой записи и останавливает пул потоков"""
+        with self._executor_lock:
+            executors = [self.executor, self.analytics_executor]
+            self.executor = self.analytics_executor = None
+
+        loop = asyncio.get_running_loop()
+        for executor in executors:
+            if executor is not None:
+                await loop.run_in_executor(None, partial(executor.shutdown, wait=True))
+        logger.info("Пул потоков базы данных остановлен")
+
+        await loop.run_in_executor(None, self.database.close)
+
+
+def _delegate_storage_methods(cls):
+    """Создает в cls методы интерфейса Storage, которые выполняют одноименный метод Database в пуле потоков"""
+    def make_method(name):
+        async def method(self, *args, **kwargs):
+            return await self._run(name, *args, **kwargs)
+        method.__name__ = name
+        method.__qualname__ = f'{cls.__name__}.{name}'
+        method.__doc__ = getattr(Database, name).__doc__
+        return method
+
+    for name in Storage.__abstractmethods__:
+        if name not in vars(cls):
+            setattr(cls, name, make_method(name))
+    abc.update_abstractmethods(cls)
+    return cls
+
+_delegate_storage_methods(AsyncDatabase)
+
+
+_shared_db = None
+_shared_db_lock = threading.Lock()
+
+def get_db():
+    """Возвращает общий для процесса экземпляр хранилища (по DB_BACKEND)"""
+    global _shared_db
+    with _shared_db_lock:
+        if _shared_db is None:
+            if DB_BACKEND == 'postgres':
+                from pg_database import PostgresDatabase
+                _shared_db = PostgresDatabase()
+            elif DB_BACKEND == 'sqlite':
+                _shared_db = AsyncDatabase()
+            else:
+                raise ValueError(f"Неизвестный DB_BACKEND: {DB_BACKEND} (ожидается sqlite или postgres)")
+        return _shared_db
@@ -0,0 +1,214 @@
+import os
+import time
+import random
+import sqlite3
+import logging
+import threading
+from urllib.parse import quote
+
+logger = logging.getLogger(__name__)
+
+
+def read_only_uri(path):
+    """URI для открытия файла базы только на чтение"""
+    return f"file:{quote(os.path.abspath(path))}?mode=ro"
+
+
+def is_lock_error(error):
+    """Проверяет, что ошибка SQLite вызвана блокировкой базы"""
+    message = str(error).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+
+class PoolStats:
+    """Счетчики пула соединений"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0            # соединение взято из пула
+        self.misses = 0          # создано новое соединение
+        self.lock_waits = 0      # повторы запроса из-за блокировки
+        self.lock_wait_time = 0.0
+        self.lock_failures = 0   # запросы, так и не дождавшиеся блокировки
+
+    def increment(self, name, value=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'lock_waits': self.lock_waits,
+                'lock_wait_time': round(self.lock_wait_time, 3),
+                'lock_failures': self.lock_failures,
+            }
+
+
+class RetryingConnection(sqlite3.Connection):
+    """Соединение, повторяющее запрос с экспоненциальной задержкой при 'database is locked'"""
+
+    stats = None
+    profiler = None
+    lock_retries = 5
+    retry_base_delay = 0.05
+
+    def _retry(self, func, *args, in_transaction_ok=False):
+        # Внутри уже открытой транзакции запрос не повторяется: у отложенной транзакции (BEGIN)
+        # устаревший снимок чтения (SQLITE_BUSY_SNAPSHOT) не даст выполнить его и при повторе,
+        # повторять нужно всю транзакцию. BEGIN IMMEDIATE сам выполняется вне транзакции
+        retry = in_transaction_ok or not self.in_transaction
+        attempt = 0
+        while True:
+            try:
+                return func(*args)
+            except sqlite3.OperationalError as e:
+                if not retry or not is_lock_error(e) or attempt >= self.lock_retries:
+                    if is_lock_error(e) and self.stats:
+                        self.stats.increment('lock_failures')
+                    raise
+
+                delay = self.retry_base_delay * (2 ** attempt) * (1 + random.random())
+                attempt += 1
+                if self.stats:
+                    self.stats.increment('lock_waits')
+                    self.stats.increment('lock_wait_time', delay)
+                logger.warning(f"База заблокирована, повтор {attempt}/{self.lock_retries} через {delay:.2f} с")
+                time.sleep(delay)
+
+    def execute(self, sql, parameters=()):
+        if self.profiler is None:
+            return self._retry(super().execute, sql, parameters)
+
+        self.profiler.before_statement(self, sql, parameters)
+        started = time.perf_counter()
+        cursor = self._retry(super().execute, sql, parameters)
+        self.profiler.after_statement(self, sql, parameters, time.perf_counter() - started)
+        return cursor
+
+    def executemany(self, sql, seq_of_parameters):
+        if self.profiler is None:
+            return self._retry(super().executemany, sql, seq_of_parameters)
+
+        # План строится по первому набору параметров, поэтому последовательность читается заранее
+        seq_of_parameters = list(seq_of_parameters)
+        if not seq_of_parameters:
+            return self._retry(super().executemany, sql, seq_of_parameters)
+
+        self.profiler.before_statement(self, sql, seq_of_parameters[0])
+        started = time.perf_counter()
+        cursor = self._retry(super().executemany, sql, seq_of_parameters)
+        self.profiler.after_statement(self, sql, seq_of_parameters[0], time.perf_counter() - started)
+        return cursor
+
+    def executescript(self, sql_script):
+        # executescript сначала фиксирует открытую транзакцию
+        return self._retry(super().executescript, sql_script, in_transaction_ok=True)
+
+    def commit(self):
+        # SQLITE_BUSY при COMMIT можно повторять: транзакция остается открытой
+        return self._retry(super().commit, in_transaction_ok=True)
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений SQLite: одно соединение на поток.
+
+    Соединения открываются в режиме WAL, поэтому читатели не блокируют
+    писателя, и живут до вызова close_all(). attachments - словарь
+    {имя схемы: путь к файлу} баз, подключаемых к каждому соединению через ATTACH.
+    С read_only=True соединения открываются только на чтение (mode=ro) - для
+    отчетов, которые не должны мешать записи; файлы базы уже должны существовать.
+    profiler (db_profiler.Profiler) получает время каждого запроса для журнала медленных запросов.
+    """
+
+    def __init__(self, db_name, busy_timeout_ms=5000, cache_size_kb=8192,
+                 mmap_size=64 * 1024 * 1024, lock_retries=5, attachments=None, read_only=False,
+                 profiler=None):
+        self.db_name = db_name
+        self.attachments = attachments or {}
+        self.read_only = read_only
+        self.profiler = profiler
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self.lock_retries = lock_retries
+        self.stats = PoolStats()
+
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            read_only_uri(self.db_name) if self.read_only else self.db_name,
+            uri=self.read_only,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,  # Соединения закрываются из общего потока в close_all
+            factory=RetryingConnection,
+        )
+        conn.stats = self.stats
+        conn.lock_retries = self.lock_retries
+        conn.row_factory = sqlite3.Row
+
+        if self.read_only:
+            # Режим WAL хранится в файле базы, менять его соединению только для чтения не нужно
+            conn.execute('PRAGMA query_only = ON')
+        else:
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout_ms)}')
+        conn.execute(f'PRAGMA cache_size = -{int(self.cache_size_kb)}')
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        conn.execute('PRAGMA temp_store = MEMORY')
+
+        for alias, path in self.attachments.items():
+            if self.read_only:
+                conn.execute(f'ATTACH DATABASE ? AS {alias}', (read_only_uri(path),))
+                continue
+            conn.execute(f'ATTACH DATABASE ? AS {alias}', (path,))
+            conn.execute(f'PRAGMA {alias}.journal_mode = WAL')
+            conn.execute(f'PRAGMA {alias}.synchronous = NORMAL')
+
+        # Служебные PRAGMA и ATTACH выше не профилируются
+        conn.profiler = self.profiler
+        return conn
+
+    def get_connection(self):
+        """Возвращает соединение текущего потока, создавая его при необходимости"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.generation == self._generation:
+            self.stats.increment('hits')
+            return conn
+
+        conn = self._connect()
+        with self._lock:
+            self._connections.append(conn)
+            self._local.generation = self._generation
+        self._local.conn = conn
+        self.stats.increment('misses')
+        logger.info(f"Открыто новое соединение с базой {self.db_name} "
+                    f"(поток {threading.current_thread().name})")
+        return conn
+
+    def close_all(self):
+        """Закрывает все соединения пула"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._generation += 1
+
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception as e:
+                logger.error(f"Ошибка при закрытии соединения: {e}")
+
+        logger.info(f"Пул соединений закрыт ({len(connections)} соединений)")
+
+    def get_stats(self):
+        """Возвращает счетчики пула"""
+        stats = self.stats.as_dict()
+        with self._lock:
+            stats['open_connections'] = len(self._connections)
+        return stats
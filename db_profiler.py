@@ -0,0 +1,253 @@
+"""Профилирование запросов к базе.
+
+- Для каждого публичного метода Database считаются вызовы, ошибки,
+  возвращенные строки и гистограмма времени выполнения.
+- Запросы дольше DB_SLOW_QUERY_MS попадают в лог вместе с EXPLAIN QUERY PLAN.
+- Запросы горячего пути (пользователь, корзина, инвентарь, каталог)
+  регистрируются через hot_query(). check_plans() проверяет, что ни один из
+  них не читает таблицу целиком. С DB_PLAN_ASSERT=1 проверка выполняется при
+  каждом таком запросе и падает с PlanRegressionError - режим для тестов и
+  нагрузочных прогонов, чтобы потерянный индекс не попал в релиз. Методы
+  Database перехватывают все исключения, поэтому ошибка повторно
+  выбрасывается из обертки метода после его завершения.
+"""
+import os
+import time
+import bisect
+import logging
+import sqlite3
+import threading
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+DB_PROFILE = os.getenv('DB_PROFILE', '1') == '1'
+DB_SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', '100'))
+DB_PLAN_ASSERT = os.getenv('DB_PLAN_ASSERT', '0') == '1'
+
+# Верхние границы корзин гистограммы, мс (последняя корзина - все, что дольше)
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# Служебные команды, для которых план не строится
+_NO_PLAN_PREFIXES = ('BEGIN', 'COMMIT', 'ROLLBACK', 'PRAGMA', 'ATTACH', 'DETACH', 'CREATE', 'DROP',
+                     'ALTER', 'EXPLAIN', 'SAVEPOINT', 'RELEASE', 'ANALYZE', 'VACUUM')
+
+# Запросы горячего пути: SQL -> (имя, пример параметров)
+HOT_QUERIES = {}
+
+
+class PlanRegressionError(AssertionError):
+    """Запрос горячего пути читает таблицу целиком"""
+
+
+def hot_query(name, sql, sample_params=()):
+    """Регистрирует запрос горячего пути и возвращает его SQL без изменений.
+
+    sample_params нужны, чтобы построить план запроса без реальных данных.
+    """
+    HOT_QUERIES[sql] = (name, sample_params)
+    return sql
+
+
+def explain(conn, sql, params=()):
+    """Возвращает строки EXPLAIN QUERY PLAN (поле detail)"""
+    # Вызовы в обход RetryingConnection.execute, чтобы не профилировать сам EXPLAIN.
+    # План EXPLAIN фиксируется при подготовке запроса, а кеш подготовленных запросов
+    # соединения не сбрасывается при изменении схемы - версия схемы в тексте запроса
+    # не дает получить план, построенный до удаления индекса
+    version = sqlite3.Connection.execute(conn, 'PRAGMA schema_version').fetchone()[0]
+    rows = sqlite3.Connection.execute(conn, f'/* schema {version} */ EXPLAIN QUERY PLAN {sql}', params).fetchall()
+    return [row[3] for row in rows]
+
+
+def full_scans(plan):
+    """Строки плана, где таблица читается целиком (без индекса)"""
+    return [
+        detail for detail in plan
+        if detail.startswith('SCAN ')
+        and 'USING' not in detail            # USING INDEX / COVERING INDEX / INTEGER PRIMARY KEY
+        and 'VIRTUAL TABLE' not in detail    # FTS5 ищет по своему индексу
+        and 'CONSTANT ROW' not in detail
+        and '(subquery' not in detail
+    ]
+
+
+def check_plans(conn):
+    """Проверяет планы всех зарегистрированных запросов горячего пути.
+
+    Возвращает список нарушений [{'name', 'sql', 'scans', 'plan'}] (пустой, если все в порядке).
+    """
+    violations = []
+    for sql, (name, params) in HOT_QUERIES.items():
+        plan = explain(conn, sql, params)
+        scans = full_scans(plan)
+        if scans:
+            violations.append({'name': name, 'sql': ' '.join(sql.split()), 'scans': scans, 'plan': plan})
+    return violations
+
+
+def _count_rows(result):
+    # Методы возвращают список, (список, всего), словарь или скаляр
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        return len(result[0])
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, dict):
+        return 1
+    return 0
+
+
+class MethodStats:
+    """Счетчики одного метода"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def record(self, duration, rows, failed):
+        self.calls += 1
+        self.errors += failed
+        self.rows += rows
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, duration * 1000)] += 1
+
+    def percentile(self, fraction):
+        """Оценка перцентиля по гистограмме: верхняя граница корзины, мс"""
+        target = self.calls * fraction
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= target:
+                return LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else round(self.max_time * 1000, 1)
+        return 0
+
+    def as_dict(self):
+        labels = [f"<={bound}ms" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}ms"]
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'rows': self.rows,
+            'total_ms': round(self.total_time * 1000, 1),
+            'avg_ms': round(self.total_time * 1000 / self.calls, 2) if self.calls else 0,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'max_ms': round(self.max_time * 1000, 1),
+            'histogram': {label: count for label, count in zip(labels, self.buckets) if count},
+        }
+
+
+class Profiler:
+    """Собирает статистику методов и журнал медленных запросов"""
+
+    def __init__(self, slow_query_ms=DB_SLOW_QUERY_MS, assert_plans=DB_PLAN_ASSERT):
+        self.slow_query_ms = slow_query_ms
+        self.assert_plans = assert_plans
+        self.slow_statements = 0
+        self.plan_violations = []
+        self._methods = {}
+        self._checked_plans = set()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def record_call(self, name, duration, rows=0, failed=False):
+        with self._lock:
+            stats = self._methods.get(name)
+            if stats is None:
+                stats = self._methods[name] = MethodStats()
+            stats.record(duration, rows, failed)
+
+    def before_statement(self, conn, sql, params):
+        """В режиме DB_PLAN_ASSERT проверяет план запроса горячего пути (один раз на запрос)"""
+        if not self.assert_plans or sql not in HOT_QUERIES or sql in self._checked_plans:
+            return
+
+        name = HOT_QUERIES[sql][0]
+        plan = explain(conn, sql, params)
+        scans = full_scans(plan)
+        if scans:
+            error = PlanRegressionError(f"Запрос {name} читает таблицу целиком: {'; '.join(scans)}")
+            with self._lock:
+                self.plan_violations.append(name)
+            self._local.violation = error
+            raise error
+        self._checked_plans.add(sql)
+
+    def pop_violation(self):
+        """Возвращает и сбрасывает нарушение плана, найденное в текущем потоке"""
+        error = getattr(self._local, 'violation', None)
+        self._local.violation = None
+        return error
+
+    def after_statement(self, conn, sql, params, duration):
+        """Пишет в лог запрос, выполнявшийся дольше порога, вместе с его планом"""
+        elapsed_ms = duration * 1000
+        if elapsed_ms < self.slow_query_ms:
+            return
+
+        with self._lock:
+            self.slow_statements += 1
+
+        statement = ' '.join(sql.split())
+        plan = ''
+        if not statement.upper().startswith(_NO_PLAN_PREFIXES):
+            try:
+                plan = '; '.join(explain(conn, sql, params))
+            except sqlite3.Error as e:
+                plan = f"не удалось построить план: {e}"
+        logger.warning(f"Медленный запрос {elapsed_ms:.0f} мс: {statement[:500]} | План: {plan}")
+
+    def get_stats(self):
+        """Статистика методов, самые затратные (по суммарному времени) первыми"""
+        with self._lock:
+            methods = {name: stats.as_dict() for name, stats in self._methods.items()}
+            slow_statements = self.slow_statements
+        return {
+            'methods': dict(sorted(methods.items(), key=lambda item: item[1]['total_ms'], reverse=True)),
+            'slow_statements': slow_statements,
+            'plan_violations': sorted(set(self.plan_violations)),
+        }
+
+    def reset(self):
+        with self._lock:
+            self._methods = {}
+            self.slow_statements = 0
+            self.plan_violations = []
+
+
+profiler = Profiler()
+
+
+def profile_methods(cls, profiler=profiler, exclude=()):
+    """Оборачивает публичные методы класса сбором статистики profiler"""
+    for name, method in list(vars(cls).items()):
+        if name.startswith('_') or name in exclude or not callable(method):
+            continue
+
+        def make_wrapper(name, method):
+            @wraps(method)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                failed = False
+                result = None
+                try:
+                    result = method(*args, **kwargs)
+                except Exception:
+                    failed = True
+                    raise
+                finally:
+                    profiler.record_call(name, time.perf_counter() - started, _count_rows(result), failed)
+
+                # Метод мог перехватить PlanRegressionError и вернуть значение по умолчанию
+                violation = profiler.pop_violation() if profiler.assert_plans else None
+                if violation is not None:
+                    raise violation
+                return result
+            return wrapper
+
+        setattr(cls, name, make_wrapper(name, method))
+    return cls
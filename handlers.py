@@ -1,22 +1,33 @@
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram import InlineQueryResultArticle, InputTextMessageContent
 from telegram.ext import ContextTypes, CallbackQueryHandler
-from database import Database
+from database import get_db, CART_RESERVATION_TTL
+from money import to_kopecks, format_money
+from inline_search import InlineSearch
+from search_sessions import SearchSessionStore
 import asyncio
 import logging
 from telegram import InputMediaPhoto
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
-db = Database()
+db = get_db()
 
 # Константы для пагинации
 ITEMS_PER_PAGE = 5
 
+# Inline-режим: сколько результатов отдавать за раз и сколько секунд Telegram их кеширует
+INLINE_RESULTS_LIMIT = 50
+INLINE_CACHE_TIME = 30
+
+inline_search = InlineSearch()
+search_sessions = SearchSessionStore()
+
 async def show_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE, page=0):
 
     """Показывает каталог скинов с кнопками и пагинацией"""
 
-    skins = db.get_all_skins()
+    skins = await db.get_all_skins()
 
     if not skins:
         await update.message.reply_text("😔 В каталоге пока нет скинов")
@@ -72,7 +83,7 @@ async def show_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE, page=
         keyboard.append(pagination_buttons)
 
     # Получаем количество товаров в корзине для счетчика
-    cart_count = db.get_cart_count(update.effective_user.id)
+    cart_count = await db.get_cart_count(update.effective_user.id)
 
     # Основные кнопки
     keyboard.append([InlineKeyboardButton(f"🛒 Корзина ({cart_count})", callback_data="view_cart")])
@@ -125,7 +136,7 @@ async def show_catalog_from_button(query, context):
 async def show_catalog_direct(query, context):
     """Альтернативный способ показа каталога"""
     user_id = query.from_user.id
-    skins = db.get_all_skins()
+    skins = await db.get_all_skins()
 
     if not skins:
         await query.edit_message_text("😔 В каталоге пока нет скинов")
@@ -164,7 +175,7 @@ async def show_catalog_direct(query, context):
     if pagination_buttons:
         keyboard.append(pagination_buttons)
 
-    cart_count = db.get_cart_count(user_id)
+    cart_count = await db.get_cart_count(user_id)
 
     keyboard.append([InlineKeyboardButton(f"🛒 Корзина ({cart_count})", callback_data="view_cart")])
     keyboard.append([InlineKeyboardButton("🔍 Поиск скинов", callback_data="search_skins")])
@@ -208,9 +219,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif callback_data.startswith('search_page_'):
         parts = callback_data.split('_')
         page = int(parts[2])
-        search_term = '_'.join(parts[3:])
-        found_skins = db.search_skins(search_term)
-        await show_search_results(update, context, found_skins, search_term, page)
+        token = '_'.join(parts[3:])
+        await show_search_results(update, context, token, page)
 
     elif callback_data.startswith('cart_add_'):
         skin_id = int(callback_data.split('_')[2])
@@ -258,63 +268,54 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 #Обрабатывает процесс покупки скина
 async def process_purchase(query, skin_id, user_id):
     """Обрабатывает процесс покупки скина"""
-    skin = db.get_skin_by_id(skin_id)
-    user = db.get_user(user_id)
+    result = await db.checkout(user_id, [skin_id])
 
-    if not skin:
-        await query.answer("❌ Скин не найден", show_alert=True)
+    if result['success']:
+        skin = result['items'][0]
+
+        await query.edit_message_text(
+            f"🎉 Поздравляем с покупкой!\n\n"
+            f"✅ Ты приобрел: *{skin['name']}*\n"
+            f"💵 Стоимость: {skin['price']} ₽\n\n"
+            f"💰 Остаток на балансе: {format_money(result['balance_kop'])} ₽\n\n"
+            f"Скин добавлен в твой инвентарь!",
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("📦 Мой инвентарь", callback_data="inventory")],
+                [InlineKeyboardButton("🛍️ В каталог", callback_data="catalog")]
+            ]),
+            parse_mode='Markdown'
+        )
         return
 
-    if not user:
+    reason = result['reason']
+
+    if reason == 'skin_not_found':
+        await query.answer("❌ Скин не найден", show_alert=True)
+
+    elif reason == 'user_not_found':
         await query.answer("❌ Пользователь не найден. Напиши /start", show_alert=True)
-        return
 
-    if user['balance'] < skin['price']:
+    elif reason == 'insufficient_funds':
         await query.edit_message_text(
             f"❌ Недостаточно средств!\n\n"
-            f"💰 Твой баланс: {user['balance']} ₽\n"
-            f"💵 Цена скина: {skin['price']} ₽\n"
-            f"📉 Не хватает: {skin['price'] - user['balance']} ₽\n\n"
+            f"💰 Твой баланс: {format_money(result['balance_kop'])} ₽\n"
+            f"💵 Цена скина: {format_money(result['total_kop'])} ₽\n"
+            f"📉 Не хватает: {format_money(result['total_kop'] - result['balance_kop'])} ₽\n\n"
             f"Для пополнения баланса обратись к администратору @m1kellaa",
             reply_markup=InlineKeyboardMarkup([
                 [InlineKeyboardButton("💰 Пополнить баланс", url="https://t.me/m1kellaa")],
                 [InlineKeyboardButton("🔙 Назад", callback_data="catalog")]
             ])
         )
-        return
 
-    if skin['quantity'] <= 0:
+    elif reason == 'out_of_stock':
         await query.edit_message_text(
             "❌ Этот скин закончился",
             reply_markup=InlineKeyboardMarkup([
                 [InlineKeyboardButton("🔙 Назад", callback_data="catalog")]
             ])
         )
-        return
-
-    success = db.add_to_inventory(user_id, skin_id)
-
-    if success:
-        db.update_user_balance(user_id, -skin['price'])
-        db.add_transaction(
-            user_id=user_id,
-            amount=-skin['price'],
-            transaction_type='purchase',
-            description=f"Покупка скина: {skin['name']}"
-        )
 
-        await query.edit_message_text(
-            f"🎉 Поздравляем с покупкой!\n\n"
-            f"✅ Ты приобрел: *{skin['name']}*\n"
-            f"💵 Стоимость: {skin['price']} ₽\n\n"
-            f"💰 Остаток на балансе: {user['balance'] - skin['price']} ₽\n\n"
-            f"Скин добавлен в твой инвентарь!",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("📦 Мой инвентарь", callback_data="inventory")],
-                [InlineKeyboardButton("🛍️ В каталог", callback_data="catalog")]
-            ]),
-            parse_mode='Markdown'
-        )
     else:
         await query.edit_message_text(
             "❌ Ошибка при покупке. Возможно, у тебя уже есть этот скин",
@@ -326,9 +327,9 @@ async def process_purchase(query, skin_id, user_id):
 #Показывает инвентарь пользователя
 async def show_inventory(query, user_id, page=0):
     """Показывает инвентарь пользователя"""
-    inventory = db.get_inventory_with_details(user_id)
+    current_items, total = await db.get_inventory_page(user_id, page, ITEMS_PER_PAGE)
 
-    if not inventory:
+    if total == 0:
         await query.edit_message_text(
             "📦 Твой инвентарь пуст\n\n"
             "Перейди в каталог, чтобы приобрести скины",
@@ -338,12 +339,12 @@ async def show_inventory(query, user_id, page=0):
         )
         return
 
-    ITEMS_PER_PAGE = 5
-    total_pages = (len(inventory) + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
+    total_pages = (total + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
 
-    start_idx = page * ITEMS_PER_PAGE
-    end_idx = start_idx + ITEMS_PER_PAGE
-    current_items = inventory[start_idx:end_idx]
+    # Страница могла опустеть после вывода скинов - показываем последнюю
+    if not current_items:
+        page = total_pages - 1
+        current_items, total = await db.get_inventory_page(user_id, page, ITEMS_PER_PAGE)
 
     inventory_text = f"📦 *Твой инвентарь скинов* (Страница {page + 1}/{total_pages})\n\n"
 
@@ -390,11 +391,11 @@ async def show_inventory(query, user_id, page=0):
 #Показывает баланс пользователя
 async def show_balance(query, user_id):
     """Показывает баланс пользователя"""
-    user = db.get_user(user_id)
+    balance_kop = await db.get_balance(user_id)
 
-    if user:
+    if balance_kop is not None:
         balance_text = (
-            f"💰 *Твой баланс:* {user['balance']} ₽\n\n"
+            f"💰 *Твой баланс:* {format_money(balance_kop)} ₽\n\n"
             f"Для пополнения баланса обратись к администратору @m1kellaa"
         )
 
@@ -428,17 +429,32 @@ async def start_search(query, context):
 
     context.user_data['waiting_for_search'] = True
 
-async def show_search_results(update, context, skins, search_term, page=0):
-    """Показывает результаты поиска"""
-    ITEMS_PER_PAGE = 5
-    total_pages = (len(skins) + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
+async def show_search_results(update, context, token, page=0):
+    """Показывает страницу результатов поиска, сохраненных под токеном token"""
+    session = search_sessions.get(token)
+
+    if session is None:
+        text = "⌛ Результаты поиска устарели\n\nПовторите поиск"
+        reply_markup = InlineKeyboardMarkup([
+            [InlineKeyboardButton("🔍 Новый поиск", callback_data="search_skins")],
+            [InlineKeyboardButton("🛍️ Весь каталог", callback_data="catalog")]
+        ])
+        if update.callback_query:
+            await update.callback_query.edit_message_text(text, reply_markup=reply_markup)
+        else:
+            await update.message.reply_text(text, reply_markup=reply_markup)
+        return
+
+    search_term = session['search_term']
+    skin_ids = session['skin_ids']
+    total = len(skin_ids)
+    total_pages = (total + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
 
     start_idx = page * ITEMS_PER_PAGE
-    end_idx = start_idx + ITEMS_PER_PAGE
-    current_skins = skins[start_idx:end_idx]
+    current_skins = await db.get_skins_by_ids(skin_ids[start_idx:start_idx + ITEMS_PER_PAGE])
 
     search_text = f"🔍 *Результаты поиска: \"{search_term}\"*\n"
-    search_text += f"📊 Найдено скинов: {len(skins)} (Страница {page + 1}/{total_pages})\n\n"
+    search_text += f"📊 Найдено скинов: {total} (Страница {page + 1}/{total_pages})\n\n"
 
     for skin in current_skins:
         rarity_emoji = {
@@ -464,13 +480,13 @@ async def show_search_results(update, context, skins, search_term, page=0):
     pagination_buttons = []
     if page > 0:
         pagination_buttons.append(
-            InlineKeyboardButton("⬅️ Назад", callback_data=f"search_page_{page - 1}_{search_term}"))
+            InlineKeyboardButton("⬅️ Назад", callback_data=f"search_page_{page - 1}_{token}"))
 
     pagination_buttons.append(InlineKeyboardButton(f"{page + 1}/{total_pages}", callback_data="current_page"))
 
     if page < total_pages - 1:
         pagination_buttons.append(
-            InlineKeyboardButton("Вперед ➡️", callback_data=f"search_page_{page + 1}_{search_term}"))
+            InlineKeyboardButton("Вперед ➡️", callback_data=f"search_page_{page + 1}_{token}"))
 
     if pagination_buttons:
         keyboard.append(pagination_buttons)
@@ -493,6 +509,52 @@ async def show_search_results(update, context, skins, search_term, page=0):
             parse_mode='Markdown'
         )
 
+async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отвечает на inline-запросы (@bot запрос) поиском по каталогу в памяти"""
+    inline_query = update.inline_query
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+
+    version, skins = await db.get_search_catalog()
+    if inline_search.needs_rebuild(version):
+        # Построение индекса по всему каталогу - не в event loop
+        await asyncio.get_running_loop().run_in_executor(None, inline_search.rebuild, skins, version)
+    found_skins = inline_search.search(inline_query.query, skins, version)
+    current_skins = found_skins[offset:offset + INLINE_RESULTS_LIMIT]
+
+    results = []
+    for skin in current_skins:
+        rarity_emoji = {
+            'Legendary': '❤️',
+            'Godly': '🩷',
+            'Ancient': '💜',
+        }.get(skin['rarity'], '🤍')
+
+        image_url = skin.get('image_url') or ''
+
+        results.append(InlineQueryResultArticle(
+            id=str(skin['skin_id']),
+            title=f"{rarity_emoji} {skin['name']}",
+            description=f"{skin['rarity']} | {skin['price']} ₽ | В наличии: {skin['available']} шт.",
+            thumbnail_url=image_url if image_url.startswith(('http://', 'https://')) else None,
+            input_message_content=InputTextMessageContent(
+                f"{rarity_emoji} *{skin['name']}*\n\n"
+                f"💎 *Редкость:* {skin['rarity']}\n"
+                f"💰 *Цена:* {skin['price']} ₽\n"
+                f"🆔 ID: {skin['skin_id']}",
+                parse_mode='Markdown'
+            ),
+            reply_markup=InlineKeyboardMarkup([
+                [
+                    InlineKeyboardButton("🛒 В корзину", callback_data=f"cart_add_{skin['skin_id']}"),
+                    InlineKeyboardButton("💰 Купить сейчас", callback_data=f"buy_{skin['skin_id']}")
+                ]
+            ])
+        ))
+
+    next_offset = str(offset + INLINE_RESULTS_LIMIT) if offset + INLINE_RESULTS_LIMIT < len(found_skins) else ''
+
+    await inline_query.answer(results, cache_time=INLINE_CACHE_TIME, next_offset=next_offset)
+
 async def return_to_catalog_final(query, user_id):
     """Универсальный возврат в каталог"""
     try:
@@ -514,7 +576,7 @@ async def return_to_catalog_final(query, user_id):
 
 async def show_photo_only(query, skin_id):
     """Показывает только фото скина"""
-    skin = db.get_skin_by_id(skin_id)
+    skin = await db.get_skin_by_id(skin_id)
 
     if not skin or not skin.get('image_url'):
         await query.answer("❌ Фото недоступно", show_alert=True)
@@ -547,7 +609,7 @@ async def show_photo_only(query, skin_id):
 
 async def show_skin_info(query, skin_id, user_id):
     """Показывает информацию о скине из callback (для возврата из фото)"""
-    skin = db.get_skin_by_id(skin_id)
+    skin = await db.get_skin_by_id(skin_id)
 
     if not skin:
         await query.answer("❌ Скин не найден", show_alert=True)
@@ -563,7 +625,7 @@ async def show_skin_info(query, skin_id, user_id):
         f"{rarity_emoji} *{skin['name']}*\n\n"
         f"💎 *Редкость:* {skin['rarity']}\n"
         f"💰 *Цена:* {skin['price']} ₽\n"
-        f"📦 *В наличии:* {skin['quantity']} шт.\n"
+        f"📦 *В наличии:* {skin['available']} шт.\n"
     )
 
     #if skin['description']:
@@ -595,24 +657,22 @@ async def show_skin_info(query, skin_id, user_id):
 #Добавление товара в корзину
 async def add_to_cart(query, user_id, skin_id):
     """Добавляет скин в корзину"""
-    skin = db.get_skin_by_id(skin_id)
+    skin = await db.get_skin_by_id(skin_id)
 
     if not skin:
         await query.answer("❌ Скин не найден", show_alert=True)
         return
 
-    if skin['quantity'] <= 0:
-        await query.answer("❌ Этот скин закончился", show_alert=True)
-        return
+    # Остаток и резервы проверяет база при резервировании
+    result = await db.add_to_cart(user_id, skin_id)
 
-    success = db.add_to_cart(user_id, skin_id)
-
-    if success:
-        cart_count = db.get_cart_count(user_id)
+    if result['success']:
+        cart_count = await db.get_cart_count(user_id)
 
         await query.answer(
             f"✅ {skin['name']} добавлен в корзину!\n"
-            f"📦 В корзине: {cart_count} товаров",
+            f"📦 В корзине: {cart_count} товаров\n"
+            f"⏳ Скин зарезервирован на {CART_RESERVATION_TTL // 60} мин.",
             show_alert=True
         )
 
@@ -638,14 +698,20 @@ async def add_to_cart(query, user_id, skin_id):
         except:
             pass  # Игнорируем ошибки обновления
 
-    else:
+    elif result['reason'] == 'already_in_cart':
         await query.answer("❌ Этот скин уже в корзине", show_alert=True)
 
+    elif result['reason'] == 'out_of_stock':
+        await query.answer("❌ Этот скин закончился или уже зарезервирован в других корзинах", show_alert=True)
+
+    else:
+        await query.answer("❌ Ошибка при добавлении в корзину", show_alert=True)
+
 #Показывает корзину пользователя
 async def show_cart(query, user_id):
     """Показывает корзину пользователя"""
-    cart_items = db.get_user_cart(user_id)
-    user = db.get_user(user_id)
+    cart_items = await db.get_user_cart(user_id)
+    balance_kop = await db.get_balance(user_id) or 0
 
     if not cart_items:
         await query.edit_message_text(
@@ -657,7 +723,7 @@ async def show_cart(query, user_id):
         )
         return
 
-    total_price = sum(item['price'] for item in cart_items)
+    total_kop = sum(to_kopecks(item['price']) for item in cart_items)
 
     cart_text = f"🛒 Ваша корзина\n\n"
 
@@ -672,10 +738,10 @@ async def show_cart(query, user_id):
         #cart_text += f"💰 {item['price']} ₽\n"
         #cart_text += f"🎲 {item['rarity']}\n\n"
 
-    cart_text += f"💵 Общая сумма: {total_price} ₽\n"
-    cart_text += f"💰 Ваш баланс: {user['balance']} ₽\n\n"
+    cart_text += f"💵 Общая сумма: {format_money(total_kop)} ₽\n"
+    cart_text += f"💰 Ваш баланс: {format_money(balance_kop)} ₽\n\n"
 
-    if user['balance'] < total_price:
+    if balance_kop < total_kop:
         cart_text += "❌ Недостаточно средств для покупки\n"
 
     keyboard = []
@@ -686,7 +752,7 @@ async def show_cart(query, user_id):
         ])
 
     if cart_items:
-        if user['balance'] >= total_price:
+        if balance_kop >= total_kop:
             keyboard.append([InlineKeyboardButton("✅ Подтвердить покупку", callback_data="confirm_purchase")])
         keyboard.append([InlineKeyboardButton("🗑️ Очистить корзину", callback_data="clear_cart")])
 
@@ -701,7 +767,7 @@ async def show_cart(query, user_id):
 
 async def remove_from_cart(query, user_id, skin_id):
     """Удаляет скин из корзины"""
-    success = db.remove_from_cart(user_id, skin_id)
+    success = await db.remove_from_cart(user_id, skin_id)
 
     if success:
         await query.answer("✅ Удалено из корзины")
@@ -711,7 +777,7 @@ async def remove_from_cart(query, user_id, skin_id):
 
 async def clear_cart(query, user_id):
     """Очищает корзину"""
-    success = db.clear_user_cart(user_id)
+    success = await db.clear_user_cart(user_id)
 
     if success:
         await query.message.reply_text(
@@ -725,44 +791,31 @@ async def clear_cart(query, user_id):
 
 async def confirm_purchase(query, context, user_id):
     """Подтверждает покупку всей корзины"""
-    cart_items = db.get_user_cart(user_id)
-    user = db.get_user(user_id)
-
-    if not cart_items:
-        await query.answer("❌ Корзина пуста")
-        return
+    result = await db.checkout(user_id)
 
-    total_price = sum(item['price'] for item in cart_items)
+    if not result['success']:
+        reason = result['reason']
 
-    if user['balance'] < total_price:
-        await query.answer("❌ Недостаточно средств")
-        return
-
-    for item in cart_items:
-        if item['quantity'] <= 0:
+        if reason == 'empty_cart':
+            await query.answer("❌ Корзина пуста")
+        elif reason == 'insufficient_funds':
+            await query.answer("❌ Недостаточно средств")
+        elif reason == 'out_of_stock':
             await query.message.reply_text(
-                f"❌ Скин \"{item['name']}\" закончился\n\n"
+                f"❌ Скин \"{result['skin_name']}\" закончился\n\n"
                 f"Пожалуйста, обновите корзину",
                 reply_markup=InlineKeyboardMarkup([
                     [InlineKeyboardButton("🛒 Обновить корзину", callback_data="view_cart")]
                 ])
             )
-            return
-
-    purchased_skins = []
-    for item in cart_items:
-        success = db.add_to_inventory(user_id, item['skin_id'])
-        if success:
-            purchased_skins.append(item['name'])
-            db.update_user_balance(user_id, -item['price'])
-            db.add_transaction(
-                user_id=user_id,
-                amount=-item['price'],
-                transaction_type='purchase',
-                description=f"Покупка скина: {item['name']}"
-            )
+        elif reason == 'already_owned':
+            await query.answer("❌ Все скины из корзины уже есть в вашем инвентаре", show_alert=True)
+        else:
+            await query.answer("❌ Ошибка при покупке", show_alert=True)
+        return
 
-    db.clear_user_cart(user_id)
+    purchased_skins = [item['name'] for item in result['items']]
+    total_price = format_money(result['total_kop'])
 
     purchase_text = "🎉 Покупка успешно завершена!\n\n"
     purchase_text += f"✅ Купленные скины:\n\n"
@@ -770,7 +823,7 @@ async def confirm_purchase(query, context, user_id):
         purchase_text += f"• {skin_name}\n"
 
     purchase_text += f"\n💵 Общая стоимость: {total_price} ₽\n"
-    purchase_text += f"💰 Остаток на балансе: {user['balance'] - total_price} ₽\n\n"
+    purchase_text += f"💰 Остаток на балансе: {format_money(result['balance_kop'])} ₽\n\n"
     purchase_text += "Скины добавлены в ваш инвентарь!"
 
     await query.message.reply_text(
@@ -798,8 +851,8 @@ async def confirm_purchase(query, context, user_id):
 
 async def withdraw_skin(query, user_id, skin_id):
     """Процесс вывода скина в Mystery Murder 2"""
-    skin = db.get_skin_by_id(skin_id)
-    user = db.get_user(user_id)
+    skin = await db.get_skin_by_id(skin_id)
+    user = await db.get_user(user_id)
 
     if not skin:
         await query.answer("❌ Скин не найден", show_alert=True)
@@ -838,9 +891,9 @@ async def withdraw_skin(query, user_id, skin_id):
 
 async def confirm_withdraw_skin(query, context, user_id, skin_id):
     """Подтверждение получения скина в MM2"""
-    skin = db.get_skin_by_id(skin_id)
+    skin = await db.get_skin_by_id(skin_id)
 
-    success = db.remove_from_inventory_mm2(user_id, skin_id)
+    success = await db.remove_from_inventory_mm2(user_id, skin_id)
 
     if success:
         # Получаем текущее время
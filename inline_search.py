@@ -0,0 +1,197 @@
+import re
+import bisect
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+
+from catalog_cache import catalog_sort_key
+
+logger = logging.getLogger(__name__)
+
+# Сколько разных запросов хранить в кеше результатов
+RESULT_CACHE_SIZE = 1024
+# Минимальное сходство по триграммам, чтобы слово считалось опечаткой
+TRIGRAM_THRESHOLD = 0.4
+
+# -----------------------ТРАНСЛИТЕРАЦИЯ------------------------- #
+
+RU_TO_LATIN = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ж': 'zh',
+    'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n',
+    'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f',
+    'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch', 'ъ': '', 'ы': 'y',
+    'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+}
+
+# Русская раскладка -> английская (запрос, набранный не в той раскладке: "шсу" -> "ice")
+RU_LAYOUT = 'йцукенгшщзхъфывапролджэячсмитьбю'
+EN_LAYOUT = 'qwertyuiop[]asdfghjkl;\'zxcvbnm,.'
+RU_TO_EN_LAYOUT = str.maketrans(RU_LAYOUT, EN_LAYOUT)
+
+
+def normalize(text):
+    """Нижний регистр, 'ё' -> 'е'"""
+    return (text or '').lower().replace('ё', 'е')
+
+
+def to_latin(text):
+    """Транслитерирует кириллицу в латиницу; латиница остается без изменений"""
+    return ''.join(RU_TO_LATIN.get(char, char) for char in text)
+
+
+def tokenize(text):
+    return re.findall(r'\w+', normalize(text))
+
+
+def trigrams(token):
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a, b):
+    """Коэффициент Дайса по триграммам"""
+    ta, tb = trigrams(a), trigrams(b)
+    return 2 * len(ta & tb) / (len(ta) + len(tb))
+
+# -----------------------ИНДЕКС------------------------- #
+
+
+class SkinSearchIndex:
+    """Индекс для inline-поиска по названиям скинов.
+
+    Все слова хранятся в латинской транслитерации, поэтому запрос "nozh"
+    найдет "Нож", а "ice" - "Iceflake". Поддерживаются поиск по префиксу
+    и опечатки (похожесть по триграммам).
+    """
+
+    def __init__(self, skins, version=None):
+        self.version = version
+        self.skins = {skin['skin_id']: skin for skin in skins}
+        self.catalog_order = [skin['skin_id'] for skin in skins]
+
+        token_skins = defaultdict(set)
+        for skin in skins:
+            for token in tokenize(skin['name']):
+                token_skins[to_latin(token)].add(skin['skin_id'])
+
+        self.token_skins = dict(token_skins)
+        self.sorted_tokens = sorted(self.token_skins)
+
+        self.trigram_tokens = defaultdict(set)
+        for token in self.sorted_tokens:
+            for trigram in trigrams(token):
+                self.trigram_tokens[trigram].add(token)
+
+    def _prefix_tokens(self, prefix):
+        start = bisect.bisect_left(self.sorted_tokens, prefix)
+        for token in self.sorted_tokens[start:]:
+            if not token.startswith(prefix):
+                break
+            yield token
+
+    def _match_token(self, query_token):
+        """Возвращает {skin_id: оценка} для одного слова запроса"""
+        scores = {}
+
+        def add(token, score):
+            for skin_id in self.token_skins[token]:
+                if score > scores.get(skin_id, 0):
+                    scores[skin_id] = score
+
+        for token in self._prefix_tokens(query_token):
+            add(token, 1.0 if token == query_token else 0.9)
+
+        # Опечатки ищем только для слов от 3 букв, иначе совпадений слишком много
+        if len(query_token) >= 3:
+            candidates = set()
+            for trigram in trigrams(query_token):
+                candidates |= self.trigram_tokens.get(trigram, set())
+            for token in candidates:
+                score = similarity(query_token, token[:len(query_token) + 2])
+                if score >= TRIGRAM_THRESHOLD:
+                    add(token, score * 0.8)
+
+        return scores
+
+    def _search_variant(self, query_tokens):
+        total = None
+        for query_token in query_tokens:
+            scores = self._match_token(query_token)
+            if total is None:
+                total = scores
+            else:
+                # Все слова запроса должны найтись
+                total = {skin_id: total[skin_id] + score for skin_id, score in scores.items() if skin_id in total}
+            if not total:
+                return {}
+        return total or {}
+
+    def search(self, query):
+        """Возвращает список skin_id, отсортированный по релевантности"""
+        words = tokenize(query)
+        if not words:
+            return list(self.catalog_order)
+
+        variants = {
+            tuple(to_latin(word) for word in words),
+            tuple(to_latin(word) for word in tokenize(normalize(query).translate(RU_TO_EN_LAYOUT))),
+        }
+
+        best = {}
+        for variant in variants:
+            if not variant:
+                continue
+            for skin_id, score in self._search_variant(variant).items():
+                if score > best.get(skin_id, 0):
+                    best[skin_id] = score
+
+        order = {skin_id: position for position, skin_id in enumerate(self.catalog_order)}
+        return sorted(best, key=lambda skin_id: (-best[skin_id], order.get(skin_id, 0)))
+
+
+class InlineSearch:
+    """Индекс по всем скинам каталога и LRU-кеш результатов по запросам.
+
+    Индекс и кеш зависят только от текста скинов (CatalogCache.text_version),
+    поэтому изменения остатка и резервов их не сбрасывают: наличие берется
+    из текущих словарей скинов при каждом поиске.
+    """
+
+    def __init__(self, cache_size=RESULT_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.index = None
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def needs_rebuild(self, version):
+        return self.index is None or self.index.version != version
+
+    def rebuild(self, skins_by_id, version):
+        """Перестраивает индекс (долго на большом каталоге - вызывать вне event loop)"""
+        index = SkinSearchIndex(sorted(skins_by_id.values(), key=catalog_sort_key), version)
+        with self._lock:
+            if not self.needs_rebuild(version):
+                return
+            self.index = index
+            self._results.clear()
+        logger.info(f"Inline-индекс перестроен: {len(skins_by_id)} скинов (версия текста каталога {version})")
+
+    def search(self, query, skins_by_id, version):
+        """Ищет скины в наличии; skins_by_id - все скины каталога с версией текста version"""
+        if self.needs_rebuild(version):
+            self.rebuild(skins_by_id, version)
+
+        with self._lock:
+            key = normalize(query).strip()
+            skin_ids = self._results.get(key)
+            if skin_ids is None:
+                skin_ids = self.index.search(key)
+                self._results[key] = skin_ids
+                if len(self._results) > self.cache_size:
+                    self._results.popitem(last=False)
+            else:
+                self._results.move_to_end(key)
+
+        # Текущие словари скинов: остаток мог измениться после построения индекса
+        found = (skins_by_id.get(skin_id) for skin_id in skin_ids)
+        return [skin for skin in found if skin and skin['available'] > 0]
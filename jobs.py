@@ -0,0 +1,84 @@
+import os
+import asyncio
+import logging
+from datetime import time as dt_time
+from telegram.ext import ContextTypes
+from database import get_db, DB_BACKEND, DB_PATH, DB_ARCHIVE_PATH
+from backup import run_backup
+
+logger = logging.getLogger(__name__)
+db = get_db()
+
+# Интервалы фоновых задач в секундах
+BALANCE_SNAPSHOT_INTERVAL = int(os.getenv('BALANCE_SNAPSHOT_INTERVAL', 60 * 60))
+CART_SWEEP_INTERVAL = int(os.getenv('CART_SWEEP_INTERVAL', 60))
+ARCHIVE_INTERVAL = int(os.getenv('ARCHIVE_INTERVAL', 24 * 60 * 60))
+# Время ежедневной резервной копии (UTC, ЧЧ:ММ) - вне часов пик; пустое значение отключает копии
+BACKUP_TIME = os.getenv('BACKUP_TIME', '04:00')
+
+
+async def snapshot_balances_job(context: ContextTypes.DEFAULT_TYPE):
+    """Делает снимки балансов и сверяет балансы пользователей с журналом"""
+    created = await db.snapshot_balances()
+    if created is None:
+        return
+
+    mismatches = await db.audit_balances()
+    if mismatches:
+        logger.error(f"Расхождения балансов с журналом: {mismatches[:10]}")
+
+
+async def release_expired_reservations_job(context: ContextTypes.DEFAULT_TYPE):
+    """Снимает просроченные резервы товара в корзинах"""
+    await db.release_expired_reservations()
+
+
+async def archive_transactions_job(context: ContextTypes.DEFAULT_TYPE):
+    """Переносит старые транзакции в архив"""
+    await db.archive_transactions()
+
+
+async def backup_job(context: ContextTypes.DEFAULT_TYPE):
+    """Снимает резервные копии основной базы и архива транзакций"""
+    # Копирование идет в отдельном потоке, чтобы не задерживать обработку сообщений
+    loop = asyncio.get_running_loop()
+    for path in (DB_PATH, DB_ARCHIVE_PATH):
+        if os.path.exists(path):
+            await loop.run_in_executor(None, run_backup, path)
+
+
+def register_jobs(application):
+    """Регистрирует периодические задачи бота в JobQueue приложения"""
+    job_queue = application.job_queue
+    if job_queue is None:
+        logger.warning("JobQueue недоступен, фоновые задачи не запущены. "
+                       "Установите python-telegram-bot[job-queue]")
+        return
+
+    job_queue.run_repeating(
+        snapshot_balances_job,
+        interval=BALANCE_SNAPSHOT_INTERVAL,
+        first=BALANCE_SNAPSHOT_INTERVAL,
+        name='balance_snapshots'
+    )
+    job_queue.run_repeating(
+        release_expired_reservations_job,
+        interval=CART_SWEEP_INTERVAL,
+        first=CART_SWEEP_INTERVAL,
+        name='cart_reservations'
+    )
+    job_queue.run_repeating(
+        archive_transactions_job,
+        interval=ARCHIVE_INTERVAL,
+        first=ARCHIVE_INTERVAL,
+        name='transaction_archive'
+    )
+    # Для PostgreSQL резервные копии делаются средствами сервера (pg_dump)
+    if BACKUP_TIME and DB_BACKEND == 'sqlite':
+        hours, minutes = map(int, BACKUP_TIME.split(':'))
+        job_queue.run_daily(backup_job, time=dt_time(hours, minutes), name='backup')
+        logger.info(f"Резервные копии: ежедневно в {BACKUP_TIME} UTC")
+
+    logger.info(f"Снимки балансов: каждые {BALANCE_SNAPSHOT_INTERVAL} с, "
+                f"очистка резервов корзин: каждые {CART_SWEEP_INTERVAL} с, "
+                f"архивация транзакций: каждые {ARCHIVE_INTERVAL} с")
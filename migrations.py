@@ -0,0 +1,531 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ---------------------------МИГРАЦИИ--------------------------- #
+# Каждая миграция - функция, получающая соединение внутри открытой
+# транзакции. Новые миграции добавляются только в конец списка MIGRATIONS.
+
+
+def migration_001_initial_schema(conn):
+    """Начальная схема: пользователи, скины, инвентарь, транзакции, корзина"""
+
+    # Таблица пользователей
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            balance REAL DEFAULT 0.0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Таблица скинов
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS skins (
+            skin_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            price REAL NOT NULL,
+            rarity TEXT DEFAULT 'Common',
+            roblox_id TEXT,
+            image_url TEXT,
+            quantity INTEGER DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Таблица инвентаря пользователей
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_inventory (
+            inventory_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            skin_id INTEGER,
+            purchased_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            FOREIGN KEY (skin_id) REFERENCES skins (skin_id)
+        )
+    ''')
+
+    # Таблица транзакций
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS transactions (
+            transaction_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            amount REAL,
+            type TEXT, -- 'deposit', 'purchase', 'sale'
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+    # Таблица корзины пользователей
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_cart (
+            cart_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            skin_id INTEGER,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            FOREIGN KEY (skin_id) REFERENCES skins (skin_id)
+        )
+    ''')
+
+
+def migration_002_indexes(conn):
+    """Индексы для основных запросов по user_id / skin_id"""
+
+    # Инвентарь: список скинов пользователя по дате покупки и проверка владения
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_user_inventory_user_purchased ON user_inventory (user_id, purchased_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_user_inventory_user_skin ON user_inventory (user_id, skin_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_user_inventory_skin ON user_inventory (skin_id)')
+
+    # Корзина
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_user_cart_user_skin ON user_cart (user_id, skin_id)')
+
+    # История транзакций пользователя
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_user_type_created ON transactions (user_id, type, created_at)')
+
+    # Админ-панель: список пользователей и топ по балансу
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_created ON users (created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_balance ON users (balance)')
+
+    conn.execute('ANALYZE')
+
+
+def migration_003_skins_fts(conn):
+    """Полнотекстовый индекс FTS5 по названию и описанию скинов"""
+
+    # unicode61 приводит к нижнему регистру любые буквы, включая кириллицу.
+    # Букву 'ё' он не упрощает, поэтому в индекс текст попадает с заменой 'ё' -> 'е'
+    # (так же нормализуется и поисковый запрос, см. database.build_fts_query)
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS skins_fts USING fts5(
+            name,
+            description,
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+
+    # Триггеры синхронизируют индекс с таблицей skins (rowid = skin_id)
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS skins_fts_after_insert AFTER INSERT ON skins BEGIN
+            INSERT INTO skins_fts (rowid, name, description)
+            VALUES (
+                new.skin_id,
+                replace(replace(new.name, 'ё', 'е'), 'Ё', 'Е'),
+                replace(replace(new.description, 'ё', 'е'), 'Ё', 'Е')
+            );
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS skins_fts_after_delete AFTER DELETE ON skins BEGIN
+            DELETE FROM skins_fts WHERE rowid = old.skin_id;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS skins_fts_after_update AFTER UPDATE OF name, description ON skins BEGIN
+            DELETE FROM skins_fts WHERE rowid = old.skin_id;
+            INSERT INTO skins_fts (rowid, name, description)
+            VALUES (
+                new.skin_id,
+                replace(replace(new.name, 'ё', 'е'), 'Ё', 'Е'),
+                replace(replace(new.description, 'ё', 'е'), 'Ё', 'Е')
+            );
+        END
+    ''')
+
+    # Индексируем уже существующие скины
+    conn.execute('''
+        INSERT INTO skins_fts (rowid, name, description)
+        SELECT
+            skin_id,
+            replace(replace(name, 'ё', 'е'), 'Ё', 'Е'),
+            replace(replace(description, 'ё', 'е'), 'Ё', 'Е')
+        FROM skins
+    ''')
+
+
+def migration_004_orders(conn):
+    """Заказы и позиции заказов вместо поиска покупок по тексту транзакций"""
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS orders (
+            order_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            total REAL NOT NULL,
+            items_count INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+    # skin_name и price сохраняются на момент покупки: скин могут изменить или удалить
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS order_items (
+            order_item_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            skin_id INTEGER,
+            skin_name TEXT,
+            price REAL NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 1,
+            FOREIGN KEY (order_id) REFERENCES orders (order_id),
+            FOREIGN KEY (skin_id) REFERENCES skins (skin_id)
+        )
+    ''')
+
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (user_id, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_order_items_skin ON order_items (skin_id)')
+
+    # Переносим старые покупки: каждая транзакция 'purchase' становится заказом
+    # с тем же номером, скин находим по названию из описания "Покупка скина: ..."
+    prefix = 'Покупка скина: '
+    conn.execute('''
+        INSERT INTO orders (order_id, user_id, total, items_count, created_at)
+        SELECT transaction_id, user_id, -amount, 1, created_at
+        FROM transactions
+        WHERE type = 'purchase'
+    ''')
+    conn.execute('''
+        INSERT INTO order_items (order_id, skin_id, skin_name, price, quantity)
+        SELECT
+            t.transaction_id,
+            (SELECT s.skin_id FROM skins s WHERE s.name = substr(t.description, ?) ORDER BY s.skin_id LIMIT 1),
+            substr(t.description, ?),
+            -t.amount,
+            1
+        FROM transactions t
+        WHERE t.type = 'purchase'
+    ''', (len(prefix) + 1, len(prefix) + 1))
+
+
+def rebuild_stats_counters(conn):
+    """Пересчитывает счетчики статистики с нуля (при расхождении с данными)"""
+
+    conn.execute('DELETE FROM stats_counters')
+    conn.execute('''
+        INSERT INTO stats_counters (name, value)
+        SELECT 'users', COUNT(*) FROM users
+        UNION ALL SELECT 'skins', COUNT(*) FROM skins
+        UNION ALL SELECT 'purchases', IFNULL(SUM(items_count), 0) FROM orders
+        UNION ALL SELECT 'revenue', IFNULL(SUM(total), 0) FROM orders
+    ''')
+
+    conn.execute('DELETE FROM rarity_stats')
+    conn.execute('''
+        INSERT INTO rarity_stats (rarity, count, total_value)
+        SELECT IFNULL(rarity, 'Common'), COUNT(*), IFNULL(SUM(price), 0)
+        FROM skins
+        GROUP BY IFNULL(rarity, 'Common')
+    ''')
+
+    conn.execute('DELETE FROM skin_sales')
+    conn.execute('''
+        INSERT INTO skin_sales (skin_id, sales_count)
+        SELECT skin_id, SUM(quantity)
+        FROM order_items
+        WHERE skin_id IS NOT NULL
+        GROUP BY skin_id
+    ''')
+
+
+def migration_005_stats_counters(conn):
+    """Счетчики статистики для админ-панели, обновляемые триггерами"""
+
+    # Общие счетчики: users, skins, purchases, revenue
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY,
+            value REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS rarity_stats (
+            rarity TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0,
+            total_value REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS skin_sales (
+            skin_id INTEGER PRIMARY KEY,
+            sales_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_skin_sales_count ON skin_sales (sales_count)')
+
+    # Пользователи
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS stats_users_after_insert AFTER INSERT ON users BEGIN
+            UPDATE stats_counters SET value = value + 1 WHERE name = 'users';
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS stats_users_after_delete AFTER DELETE ON users BEGIN
+            UPDATE stats_counters SET value = value - 1 WHERE name = 'users';
+        END
+    ''')
+
+    # Скины и статистика по редкостям
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS stats_skins_after_insert AFTER INSERT ON skins BEGIN
+            UPDATE stats_counters SET value = value + 1 WHERE name = 'skins';
+            INSERT INTO rarity_stats (rarity, count, total_value)
+            VALUES (IFNULL(new.rarity, 'Common'), 1, new.price)
+            ON CONFLICT (rarity) DO UPDATE SET
+                count = count + 1,
+                total_value = total_value + excluded.total_value;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS stats_skins_after_delete AFTER DELETE ON skins BEGIN
+            UPDATE stats_counters SET value = value - 1 WHERE name = 'skins';
+            UPDATE rarity_stats SET count = count - 1, total_value = total_value - old.price
+            WHERE rarity = IFNULL(old.rarity, 'Common');
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS stats_skins_after_update AFTER UPDATE OF rarity, price ON skins BEGIN
+            UPDATE rarity_stats SET count = count - 1, total_value = total_value - old.price
+            WHERE rarity = IFNULL(old.rarity, 'Common');
+            INSERT INTO rarity_stats (rarity, count, total_value)
+            VALUES (IFNULL(new.rarity, 'Common'), 1, new.price)
+            ON CONFLICT (rarity) DO UPDATE SET
+                count = count + 1,
+                total_value = total_value + excluded.total_value;
+        END
+    ''')
+
+    # Заказы: количество покупок, оборот и продажи по скинам
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS stats_orders_after_insert AFTER INSERT ON orders BEGIN
+            UPDATE stats_counters SET value = value + new.items_count WHERE name = 'purchases';
+            UPDATE stats_counters SET value = value + new.total WHERE name = 'revenue';
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS stats_order_items_after_insert AFTER INSERT ON order_items
+        WHEN new.skin_id IS NOT NULL BEGIN
+            INSERT INTO skin_sales (skin_id, sales_count)
+            VALUES (new.skin_id, new.quantity)
+            ON CONFLICT (skin_id) DO UPDATE SET sales_count = sales_count + excluded.sales_count;
+        END
+    ''')
+
+    rebuild_stats_counters(conn)
+
+
+def migration_006_balance_ledger(conn):
+    """Журнал движений баланса в копейках и периодические снимки балансов"""
+
+    # Текущий баланс в копейках; users.balance (REAL) остается зеркалом для совместимости
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(users)')}
+    if 'balance_kop' not in columns:
+        conn.execute('ALTER TABLE users ADD COLUMN balance_kop INTEGER NOT NULL DEFAULT 0')
+    conn.execute('UPDATE users SET balance_kop = CAST(ROUND(balance * 100) AS INTEGER)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_users_balance_kop ON users (balance_kop)')
+
+    # Журнал только дополняется: balance_kop - баланс после применения записи
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS balance_ledger (
+            entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            delta_kop INTEGER NOT NULL,
+            balance_kop INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_balance_ledger_user ON balance_ledger (user_id, entry_id)')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS balance_ledger_no_update BEFORE UPDATE ON balance_ledger BEGIN
+            SELECT RAISE(ABORT, 'balance_ledger is append-only');
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS balance_ledger_no_delete BEFORE DELETE ON balance_ledger BEGIN
+            SELECT RAISE(ABORT, 'balance_ledger is append-only');
+        END
+    ''')
+
+    # Снимок: баланс пользователя после записи журнала entry_id
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS balance_snapshots (
+            user_id INTEGER NOT NULL,
+            entry_id INTEGER NOT NULL,
+            balance_kop INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, entry_id)
+        )
+    ''')
+
+    # Текущие балансы становятся начальными записями журнала и первым снимком
+    conn.execute('''
+        INSERT INTO balance_ledger (user_id, delta_kop, balance_kop, kind, description)
+        SELECT user_id, balance_kop, balance_kop, 'opening', 'Начальный остаток'
+        FROM users
+        WHERE balance_kop != 0
+    ''')
+    conn.execute('''
+        INSERT INTO balance_snapshots (user_id, entry_id, balance_kop)
+        SELECT user_id, entry_id, balance_kop
+        FROM balance_ledger
+        WHERE kind = 'opening'
+    ''')
+
+
+def migration_007_cart_reservations(conn):
+    """Резервирование товара в корзине со сроком действия"""
+
+    # skins.reserved - единицы, зарезервированные в корзинах; доступно = quantity - reserved
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(skins)')}
+    if 'reserved' not in columns:
+        conn.execute('ALTER TABLE skins ADD COLUMN reserved INTEGER NOT NULL DEFAULT 0')
+
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(user_cart)')}
+    if 'expires_at' not in columns:
+        conn.execute('ALTER TABLE user_cart ADD COLUMN expires_at TIMESTAMP')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_user_cart_expires ON user_cart (expires_at)')
+
+    # Старые корзины: оставляем столько позиций, сколько есть товара (первые
+    # добавленные), резервируем их на 30 минут, остальные удаляем
+    conn.execute('''
+        DELETE FROM user_cart WHERE cart_id IN (
+            SELECT cart_id FROM (
+                SELECT
+                    uc.cart_id,
+                    s.quantity,
+                    ROW_NUMBER() OVER (PARTITION BY uc.skin_id ORDER BY uc.cart_id) AS position
+                FROM user_cart uc
+                LEFT JOIN skins s ON s.skin_id = uc.skin_id
+            )
+            WHERE quantity IS NULL OR position > quantity
+        )
+    ''')
+    conn.execute("UPDATE user_cart SET expires_at = datetime('now', '+30 minutes')")
+    conn.execute('UPDATE skins SET reserved = (SELECT COUNT(*) FROM user_cart WHERE user_cart.skin_id = skins.skin_id)')
+
+
+def migration_008_transaction_rollups(conn):
+    """Итоги по транзакциям, перенесенным в архив"""
+
+    # Старые строки transactions уходят в архивную базу, а здесь остается
+    # одна строка на (пользователь, тип, месяц) с количеством и суммой
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS transaction_rollups (
+            user_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            month TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            total_amount REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, type, month)
+        )
+    ''')
+    # Архивация выбирает строки старше срока хранения
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_transactions_created ON transactions (created_at)')
+
+
+MIGRATIONS = [
+    (1, 'Начальная схема', migration_001_initial_schema),
+    (2, 'Индексы для основных запросов', migration_002_indexes),
+    (3, 'Полнотекстовый поиск по скинам', migration_003_skins_fts),
+    (4, 'Заказы и позиции заказов', migration_004_orders),
+    (5, 'Счетчики статистики', migration_005_stats_counters),
+    (6, 'Журнал баланса в копейках', migration_006_balance_ledger),
+    (7, 'Резервирование товара в корзине', migration_007_cart_reservations),
+    (8, 'Итоги архивированных транзакций', migration_008_transaction_rollups),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# ---------------------------АРХИВ--------------------------- #
+
+
+def ensure_archive_schema(conn, alias='archive'):
+    """Создает таблицы архивной базы, подключенной к соединению через ATTACH"""
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {alias}.transactions (
+            transaction_id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            amount REAL,
+            type TEXT,
+            description TEXT,
+            created_at TIMESTAMP,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS {alias}.idx_archive_transactions_user ON transactions (user_id, created_at)')
+    conn.commit()
+
+# ---------------------------ПРИМЕНЕНИЕ--------------------------- #
+
+
+def ensure_version_table(conn):
+    """Создает таблицу версий схемы"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+
+
+def get_schema_version(conn):
+    """Возвращает текущую версию схемы (0 для пустой базы)"""
+    ensure_version_table(conn)
+    version = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0]
+    return version or 0
+
+
+def get_applied_migrations(conn):
+    """Возвращает список примененных миграций"""
+    ensure_version_table(conn)
+    rows = conn.execute('SELECT * FROM schema_version ORDER BY version').fetchall()
+    return [dict(row) for row in rows]
+
+
+def apply_migrations(conn, target_version=None):
+    """Применяет недостающие миграции по порядку, каждую в своей транзакции.
+
+    Возвращает список номеров примененных миграций.
+    """
+    if target_version is None:
+        target_version = LATEST_VERSION
+
+    current_version = get_schema_version(conn)
+    applied = []
+
+    for version, description, migration in MIGRATIONS:
+        if version <= current_version or version > target_version:
+            continue
+
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            # Повторная проверка под блокировкой: миграцию мог применить другой процесс
+            if conn.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,)).fetchone():
+                conn.rollback()
+                continue
+
+            migration(conn)
+            conn.execute(
+                'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                (version, description)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.error(f"Ошибка при применении миграции {version}: {description}")
+            raise
+
+        applied.append(version)
+        logger.info(f"Применена миграция {version}: {description}")
+
+    return applied
@@ -0,0 +1,25 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+# Балансы хранятся в целых копейках, чтобы сложения и списания не накапливали
+# ошибку округления float. Цены скинов в каталоге по-прежнему в рублях.
+KOPECKS_PER_RUBLE = 100
+
+
+def to_kopecks(amount):
+    """Переводит сумму в рублях (float, str, Decimal) в целые копейки"""
+    kopecks = Decimal(str(amount)) * KOPECKS_PER_RUBLE
+    return int(kopecks.quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def to_rubles(kopecks):
+    """Переводит копейки в рубли (float) для старых полей вроде users.balance"""
+    return kopecks / KOPECKS_PER_RUBLE
+
+
+def format_money(kopecks):
+    """Форматирует сумму в копейках для сообщений: 15000 -> '150', 15050 -> '150.50'"""
+    sign = '-' if kopecks < 0 else ''
+    rubles, rest = divmod(abs(kopecks), KOPECKS_PER_RUBLE)
+    if rest:
+        return f"{sign}{rubles}.{rest:02d}"
+    return f"{sign}{rubles}"
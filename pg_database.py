@@ -0,0 +1,1430 @@
+"""Хранилище бота в PostgreSQL (DB_BACKEND=postgres).
+
+PostgresDatabase реализует интерфейс Storage (storage.py), как и
+AsyncDatabase, поверх пула соединений asyncpg, поэтому обработчики
+работают с ним без изменений:
+
+    skins = await db.get_all_skins()
+
+Несколько процессов бота могут работать с одной базой: остатки, резервы
+и балансы защищены условными UPDATE и уникальными индексами. Кеш каталога
+живет в памяти каждого процесса, поэтому изменения, сделанные другим
+процессом, становятся видны не позже чем через DB_CATALOG_TTL секунд.
+
+Функции, завязанные на SQLite (счетчики статистики на триггерах,
+фоновая запись пачками), здесь не нужны или не поддерживаются.
+
+asyncpg - необязательная зависимость: pip install -r requirements-postgres.txt
+"""
+import asyncio
+import logging
+from datetime import datetime
+from contextlib import asynccontextmanager
+
+from catalog_cache import CatalogCache
+from storage import (
+    Storage,
+    CheckoutError,
+    Purchase,
+    CreditBatch,
+    search_words,
+    page_offset,
+    format_bot_stats,
+    split_import,
+    CART_RESERVATION_TTL,
+    DB_CATALOG_TTL,
+    DATABASE_URL,
+    DB_PG_POOL_MIN,
+    DB_PG_POOL_MAX,
+    DB_ARCHIVE_AFTER_DAYS,
+    DB_ARCHIVE_BATCH,
+    DB_ANALYTICS_WORKERS,
+    DB_ANALYTICS_TIMEOUT_MS,
+)
+from money import to_kopecks
+
+try:
+    import asyncpg
+except ImportError:  # asyncpg нужен только для DB_BACKEND=postgres
+    asyncpg = None
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory-блокировки, под которой создается схема (одновременный запуск нескольких процессов)
+SCHEMA_LOCK_KEY = 720_011
+
+# Внешние ключи не объявлены намеренно - как и в SQLite-базе (PRAGMA foreign_keys
+# выключен): инвентарь и заказы ссылаются на скины, которые могут быть удалены.
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id BIGINT PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        balance DOUBLE PRECISION DEFAULT 0.0,
+        balance_kop BIGINT NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS skins (
+        skin_id BIGSERIAL PRIMARY KEY,
+        name TEXT NOT NULL,
+        description TEXT,
+        price DOUBLE PRECISION NOT NULL,
+        rarity TEXT DEFAULT 'Common',
+        roblox_id TEXT,
+        image_url TEXT,
+        quantity INTEGER DEFAULT 1,
+        reserved INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc'),
+        search_vector TSVECTOR GENERATED ALWAYS AS (
+            setweight(to_tsvector('simple', translate(coalesce(name, ''), 'ёЁ', 'еЕ')), 'A') ||
+            setweight(to_tsvector('simple', translate(coalesce(description, ''), 'ёЁ', 'еЕ')), 'B')
+        ) STORED
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS user_inventory (
+        inventory_id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT,
+        skin_id BIGINT,
+        purchased_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS transactions (
+        transaction_id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT,
+        amount DOUBLE PRECISION,
+        type TEXT,
+        description TEXT,
+        created_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS user_cart (
+        cart_id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT,
+        skin_id BIGINT,
+        added_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc'),
+        expires_at TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS orders (
+        order_id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        total DOUBLE PRECISION NOT NULL,
+        items_count INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS order_items (
+        order_item_id BIGSERIAL PRIMARY KEY,
+        order_id BIGINT NOT NULL,
+        skin_id BIGINT,
+        skin_name TEXT,
+        price DOUBLE PRECISION NOT NULL,
+        quantity INTEGER NOT NULL DEFAULT 1
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS balance_ledger (
+        entry_id BIGSERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL,
+        delta_kop BIGINT NOT NULL,
+        balance_kop BIGINT NOT NULL,
+        kind TEXT NOT NULL,
+        description TEXT,
+        created_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS balance_snapshots (
+        user_id BIGINT NOT NULL,
+        entry_id BIGINT NOT NULL,
+        balance_kop BIGINT NOT NULL,
+        created_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc'),
+        PRIMARY KEY (user_id, entry_id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS transactions_archive (
+        transaction_id BIGINT PRIMARY KEY,
+        user_id BIGINT,
+        amount DOUBLE PRECISION,
+        type TEXT,
+        description TEXT,
+        created_at TIMESTAMP,
+        archived_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS transaction_rollups (
+        user_id BIGINT NOT NULL,
+        type TEXT NOT NULL,
+        month TEXT NOT NULL,
+        count BIGINT NOT NULL DEFAULT 0,
+        total_amount DOUBLE PRECISION NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, type, month)
+    )
+    ''',
+    '''
+    CREATE OR REPLACE FUNCTION balance_ledger_append_only() RETURNS trigger AS $$
+    BEGIN
+        RAISE EXCEPTION 'balance_ledger is append-only';
+    END
+    $$ LANGUAGE plpgsql
+    ''',
+    'DROP TRIGGER IF EXISTS balance_ledger_no_change ON balance_ledger',
+    '''
+    CREATE TRIGGER balance_ledger_no_change BEFORE UPDATE OR DELETE ON balance_ledger
+    FOR EACH ROW EXECUTE FUNCTION balance_ledger_append_only()
+    ''',
+    # Уникальность, которую SQLite-версия обеспечивает проверками под BEGIN IMMEDIATE
+    'CREATE UNIQUE INDEX IF NOT EXISTS idx_inventory_user_skin ON user_inventory (user_id, skin_id)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS idx_cart_user_skin ON user_cart (user_id, skin_id)',
+    'CREATE INDEX IF NOT EXISTS idx_inventory_user_purchased ON user_inventory (user_id, purchased_at)',
+    'CREATE INDEX IF NOT EXISTS idx_inventory_skin ON user_inventory (skin_id)',
+    'CREATE INDEX IF NOT EXISTS idx_user_cart_expires ON user_cart (expires_at)',
+    'CREATE INDEX IF NOT EXISTS idx_transactions_user_type_created ON transactions (user_id, type, created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_transactions_created ON transactions (created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_transactions_archive_user ON transactions_archive (user_id, created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_users_created ON users (created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_users_balance_kop ON users (balance_kop)',
+    'CREATE INDEX IF NOT EXISTS idx_skins_search ON skins USING GIN (search_vector)',
+    'CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (user_id, created_at)',
+    'CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id)',
+    'CREATE INDEX IF NOT EXISTS idx_order_items_skin ON order_items (skin_id)',
+    'CREATE INDEX IF NOT EXISTS idx_balance_ledger_user ON balance_ledger (user_id, entry_id)',
+]
+
+# Таблицы в порядке переноса: (таблица PostgreSQL, таблица SQLite, столбец-счетчик для setval)
+TABLES = [
+    ('users', 'users', None),
+    ('skins', 'skins', 'skin_id'),
+    ('user_inventory', 'user_inventory', 'inventory_id'),
+    ('user_cart', 'user_cart', 'cart_id'),
+    ('transactions', 'transactions', 'transaction_id'),
+    ('orders', 'orders', 'order_id'),
+    ('order_items', 'order_items', 'order_item_id'),
+    ('balance_ledger', 'balance_ledger', 'entry_id'),
+    ('balance_snapshots', 'balance_snapshots', None),
+    ('transaction_rollups', 'transaction_rollups', None),
+    ('transactions_archive', 'archive.transactions', None),
+]
+
+# Вычисляемые столбцы, которые нельзя вставлять
+GENERATED_COLUMNS = {'search_vector'}
+
+
+def build_tsquery(search_term):
+    """Превращает пользовательский запрос в tsquery: каждое слово - префикс, все слова обязательны"""
+    return ' & '.join(f'{word}:*' for word in search_words(search_term))
+
+
+def _to_text(value):
+    # SQLite отдает даты строками 'YYYY-MM-DD HH:MM:SS', обработчики рассчитывают на этот формат
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+
+def _to_dict(record):
+    return {key: _to_text(value) for key, value in record.items()}
+
+
+def _status_count(status):
+    """Количество строк из статуса команды asyncpg ('INSERT 0 5', 'DELETE 3')"""
+    return int(status.split()[-1])
+
+
+class PostgresDatabase(Storage):
+    """Хранилище в PostgreSQL (реализация Storage)"""
+
+    def __init__(self, dsn=DATABASE_URL, min_size=DB_PG_POOL_MIN, max_size=DB_PG_POOL_MAX):
+        if asyncpg is None:
+            raise RuntimeError("Для DB_BACKEND=postgres установите asyncpg: pip install -r requirements-postgres.txt")
+        if not dsn:
+            raise RuntimeError("Для DB_BACKEND=postgres укажите DATABASE_URL")
+
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+        self.catalog = CatalogCache(ttl=DB_CATALOG_TTL)
+        self._catalog_rows = []
+        self._pool_lock = asyncio.Lock()
+        self._analytics_slots = asyncio.Semaphore(DB_ANALYTICS_WORKERS)
+
+    # -----------------------СОЕДИНЕНИЯ------------------------- #
+
+    async def get_pool(self):
+        """Возвращает пул соединений, создавая его (и схему) при первом обращении"""
+        if self.pool is not None:
+            return self.pool
+
+        async with self._pool_lock:
+            if self.pool is None:
+                pool = await asyncpg.create_pool(
+                    self.dsn,
+                    min_size=self.min_size,
+                    max_size=self.max_size,
+                    command_timeout=30,
+                )
+                await self.migrate(pool)
+                self.pool = pool
+                logger.info(f"Пул соединений PostgreSQL открыт (до {self.max_size} соединений)")
+        return self.pool
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Соединение из пула с открытой транзакцией (при ошибке COMMIT кеш каталога сбрасывается)"""
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            transaction = conn.transaction()
+            await transaction.start()
+            try:
+                yield conn
+            except BaseException:
+                await transaction.rollback()
+                raise
+            try:
+                await transaction.commit()
+            except Exception:
+                # Кеш каталога уже получил остатки этой транзакции (см. _update_cached_stock)
+                self.catalog.invalidate()
+                raise
+
+    @asynccontextmanager
+    async def analytics_snapshot(self, timeout_ms=DB_ANALYTICS_TIMEOUT_MS):
+        """Транзакция только для чтения с одним снимком (REPEATABLE READ) для отчетов.
+
+        Одновременно выполняется не больше DB_ANALYTICS_WORKERS отчетов,
+        запросы дольше timeout_ms прерываются сервером.
+        """
+        async with self._analytics_slots:
+            pool = await self.get_pool()
+            async with pool.acquire() as conn:
+                async with conn.transaction(isolation='repeatable_read', readonly=True):
+                    await conn.execute(f'SET LOCAL statement_timeout = {int(timeout_ms)}')
+                    yield conn
+
+    async def migrate(self, pool=None):
+        """Создает недостающие таблицы и индексы"""
+        pool = pool or await self.get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute('SELECT pg_advisory_xact_lock($1)', SCHEMA_LOCK_KEY)
+                for statement in SCHEMA:
+                    await conn.execute(statement)
+
+    async def get_pool_stats(self):
+        """Возвращает размер пула соединений"""
+        if self.pool is None:
+            return {}
+        return {
+            'size': self.pool.get_size(),
+            'idle': self.pool.get_idle_size(),
+            'min_size': self.min_size,
+            'max_size': self.max_size,
+        }
+
+    async def get_writer_stats(self):
+        """Фоновой записи пачками у PostgreSQL нет: записи идут сразу"""
+        return {}
+
+    async def get_profile_stats(self):
+        """Статистика запросов PostgreSQL собирается на сервере (pg_stat_statements)"""
+        return {}
+
+    async def flush_writes(self, timeout=5.0):
+        return True
+
+    async def close(self):
+        """Закрывает пул соединений"""
+        pool, self.pool = self.pool, None
+        if pool is not None:
+            await pool.close()
+            logger.info("Пул соединений PostgreSQL закрыт")
+
+    # -----------------------ПОЛЬЗОВАТЕЛИ------------------------- #
+
+    async def add_user(self, user_id, username, first_name, last_name=None):
+        """Добавляет нового пользователя в базу данных"""
+        try:
+            pool = await self.get_pool()
+            await pool.execute('''
+                INSERT INTO users (user_id, username, first_name, last_name)
+                VALUES ($1, $2, $3, $4)
+                ON CONFLICT (user_id) DO NOTHING
+            ''', user_id, username, first_name, last_name)
+            logger.info(f"Пользователь {user_id} добавлен в базу")
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении пользователя: {e}")
+
+    async def get_user(self, user_id):
+        """Получает информацию о пользователе"""
+        try:
+            pool = await self.get_pool()
+            user = await pool.fetchrow('SELECT * FROM users WHERE user_id = $1', user_id)
+            return _to_dict(user) if user else None
+        except Exception as e:
+            logger.error(f"Ошибка при получении пользователя: {e}")
+            return None
+
+    async def get_users_page(self, page=0, per_page=5):
+        """Получает страницу пользователей (новые первыми): возвращает (пользователи, общее количество)"""
+        try:
+            async with self.analytics_snapshot() as conn:
+                total = await conn.fetchval('SELECT COUNT(*) FROM users')
+                users = await conn.fetch('''
+                    SELECT user_id, username, first_name, last_name, balance_kop, created_at
+                    FROM users
+                    ORDER BY created_at DESC, user_id DESC
+                    LIMIT $1 OFFSET $2
+                ''', per_page, page_offset(page, per_page))
+                return [_to_dict(user) for user in users], total
+        except Exception as e:
+            logger.error(f"Ошибка при получении страницы пользователей: {e}")
+            return [], 0
+
+    async def get_all_users(self):
+        """Получает всех пользователей"""
+        try:
+            pool = await self.get_pool()
+            users = await pool.fetch('SELECT * FROM users ORDER BY created_at DESC')
+            return [_to_dict(user) for user in users]
+        except Exception as e:
+            logger.error(f"Ошибка при получении пользователей: {e}")
+            return []
+
+    async def add_transaction(self, user_id, amount, transaction_type, description):
+        """Добавляет запись о транзакции"""
+        try:
+            pool = await self.get_pool()
+            await pool.execute(
+                'INSERT INTO transactions (user_id, amount, type, description) VALUES ($1, $2, $3, $4)',
+                user_id, amount, transaction_type, description
+            )
+            logger.info(f"Транзакция добавлена для пользователя {user_id}")
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении транзакции: {e}")
+
+    # -----------------------ЖУРНАЛ-БАЛАНСА------------------------- #
+
+    async def _apply_balance_delta(self, conn, user_id, delta_kop, kind, description=None):
+        """Меняет баланс на delta_kop копеек и добавляет запись в журнал (внутри транзакции).
+
+        Возвращает новый баланс в копейках или None, если пользователь не найден
+        или баланс стал бы отрицательным.
+        """
+        balance_kop = await conn.fetchval('''
+            UPDATE users
+            SET balance_kop = balance_kop + $1, balance = (balance_kop + $1) / 100.0
+            WHERE user_id = $2 AND balance_kop + $1 >= 0
+            RETURNING balance_kop
+        ''', delta_kop, user_id)
+        if balance_kop is None:
+            return None
+
+        await conn.execute(
+            'INSERT INTO balance_ledger (user_id, delta_kop, balance_kop, kind, description) VALUES ($1, $2, $3, $4, $5)',
+            user_id, delta_kop, balance_kop, kind, description
+        )
+        return balance_kop
+
+    async def update_user_balance(self, user_id, amount, description=None):
+        """Изменяет баланс пользователя на amount рублей (с записью в журнал баланса)"""
+        try:
+            async with self.transaction() as conn:
+                balance_kop = await self._apply_balance_delta(conn, user_id, to_kopecks(amount), 'adjustment', description)
+            if balance_kop is None:
+                logger.warning(f"Баланс пользователя {user_id} не изменен на {amount}: "
+                               f"пользователь не найден или недостаточно средств")
+                return False
+            logger.info(f"Баланс пользователя {user_id} обновлен на {amount}")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении баланса: {e}")
+            return False
+
+    async def apply_balance_credits(self, credits):
+        """Применяет пакет изменений баланса одной транзакцией (см. Database.apply_balance_credits)"""
+        try:
+            async with self.transaction() as conn:
+                batch = CreditBatch()
+                for credit in credits:
+                    balance_kop = await self._apply_balance_delta(
+                        conn, credit['user_id'], credit['delta_kop'], 'bulk_credit', batch.description(credit)
+                    )
+                    if balance_kop is not None:
+                        batch.add_applied(credit)
+                        continue
+
+                    exists = await conn.fetchval('SELECT 1 FROM users WHERE user_id = $1', credit['user_id'])
+                    batch.add_failed(credit, exists is not None)
+
+                await conn.executemany(
+                    'INSERT INTO transactions (user_id, amount, type, description) VALUES ($1, $2, $3, $4)',
+                    batch.transaction_rows()
+                )
+
+            return batch.result()
+        except Exception as e:
+            logger.error(f"Ошибка при пакетном изменении баланса: {e}")
+            return None
+
+    async def update_user_balance_directly(self, user_id, new_balance):
+        """Устанавливает точный баланс пользователя (разница записывается в журнал баланса)"""
+        try:
+            async with self.transaction() as conn:
+                current_kop = await conn.fetchval(
+                    'SELECT balance_kop FROM users WHERE user_id = $1 FOR UPDATE', user_id
+                )
+                if current_kop is None:
+                    logger.warning(f"Пользователь {user_id} не найден при установке баланса")
+                    return False
+
+                delta_kop = to_kopecks(new_balance) - current_kop
+                if delta_kop and await self._apply_balance_delta(
+                    conn, user_id, delta_kop, 'admin_set', f"Баланс установлен администратором: {new_balance}"
+                ) is None:
+                    logger.warning(f"Баланс пользователя {user_id} не может быть отрицательным: {new_balance}")
+                    return False
+
+            logger.info(f"Баланс пользователя {user_id} установлен на {new_balance}")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка при установке баланса: {e}")
+            return False
+
+    async def get_balance(self, user_id):
+        """Получает текущий баланс пользователя в копейках (None, если пользователя нет)"""
+        try:
+            pool = await self.get_pool()
+            return await pool.fetchval('SELECT balance_kop FROM users WHERE user_id = $1', user_id)
+        except Exception as e:
+            logger.error(f"Ошибка при получении баланса: {e}")
+            return None
+
+    async def get_balance_history(self, user_id, limit=20):
+        """Получает последние записи журнала баланса пользователя"""
+        try:
+            pool = await self.get_pool()
+            entries = await pool.fetch('''
+                SELECT * FROM balance_ledger
+                WHERE user_id = $1
+                ORDER BY entry_id DESC
+                LIMIT $2
+            ''', user_id, limit)
+            return [_to_dict(entry) for entry in entries]
+        except Exception as e:
+            logger.error(f"Ошибка при получении журнала баланса: {e}")
+            return []
+
+    async def replay_balance(self, user_id):
+        """Восстанавливает баланс по журналу: последний снимок + записи после него"""
+        try:
+            pool = await self.get_pool()
+            return await pool.fetchval('''
+                SELECT COALESCE(s.balance_kop, 0) + COALESCE((
+                    SELECT SUM(l.delta_kop) FROM balance_ledger l
+                    WHERE l.user_id = $1 AND l.entry_id > COALESCE(s.entry_id, 0)
+                ), 0)::BIGINT
+                FROM (SELECT 1) one
+                LEFT JOIN LATERAL (
+                    SELECT entry_id, balance_kop FROM balance_snapshots
+                    WHERE user_id = $1
+                    ORDER BY entry_id DESC
+                    LIMIT 1
+                ) s ON TRUE
+            ''', user_id)
+        except Exception as e:
+            logger.error(f"Ошибка при восстановлении баланса по журналу: {e}")
+            return None
+
+    async def audit_balances(self):
+        """Сверяет балансы пользователей с журналом; возвращает список расхождений или None при ошибке"""
+        try:
+            pool = await self.get_pool()
+            rows = await pool.fetch('''
+                SELECT * FROM (
+                    SELECT
+                        u.user_id,
+                        u.balance_kop,
+                        (COALESCE(s.balance_kop, 0) + COALESCE((
+                            SELECT SUM(l.delta_kop) FROM balance_ledger l
+                            WHERE l.user_id = u.user_id AND l.entry_id > COALESCE(s.entry_id, 0)
+                        ), 0))::BIGINT AS replayed_kop
+                    FROM users u
+                    LEFT JOIN LATERAL (
+                        SELECT entry_id, balance_kop FROM balance_snapshots
+                        WHERE user_id = u.user_id
+                        ORDER BY entry_id DESC
+                        LIMIT 1
+                    ) s ON TRUE
+                ) balances
+                WHERE balance_kop != replayed_kop
+            ''')
+            mismatches = [_to_dict(row) for row in rows]
+            if mismatches:
+                logger.error(f"Балансы расходятся с журналом у {len(mismatches)} пользователей")
+            return mismatches
+        except Exception as e:
+            logger.error(f"Ошибка при сверке балансов: {e}")
+            return None
+
+    async def snapshot_balances(self):
+        """Делает снимки балансов пользователей с новыми записями в журнале; возвращает их количество"""
+        try:
+            pool = await self.get_pool()
+            status = await pool.execute('''
+                INSERT INTO balance_snapshots (user_id, entry_id, balance_kop)
+                SELECT l.user_id, MAX(l.entry_id), COALESCE(s.balance_kop, 0) + SUM(l.delta_kop)
+                FROM balance_ledger l
+                LEFT JOIN LATERAL (
+                    SELECT entry_id, balance_kop FROM balance_snapshots
+                    WHERE user_id = l.user_id
+                    ORDER BY entry_id DESC
+                    LIMIT 1
+                ) s ON TRUE
+                WHERE l.entry_id > COALESCE(s.entry_id, 0)
+                GROUP BY l.user_id, s.balance_kop
+            ''')
+            created = _status_count(status)
+            logger.info(f"Сделано снимков балансов: {created}")
+            return created
+        except Exception as e:
+            logger.error(f"Ошибка при создании снимков балансов: {e}")
+            return None
+
+    # -----------------------КАТАЛОГ------------------------- #
+
+    async def load_catalog(self):
+        """Читает все скины из базы для кеша каталога"""
+        pool = await self.get_pool()
+        skins = await pool.fetch('SELECT * FROM skins')
+        return [self._skin_dict(skin) for skin in skins]
+
+    async def _ensure_catalog(self):
+        # CatalogCache вызывает загрузчик синхронно, поэтому каталог читается заранее;
+        # между проверкой и чтением кеша нет await, и другие корутины его не изменят
+        if self.catalog.needs_reload():
+            self._catalog_rows = await self.load_catalog()
+        return lambda: [dict(skin) for skin in self._catalog_rows]
+
+    async def get_all_skins(self):
+        """Получает все скины в наличии (из кеша каталога)"""
+        try:
+            loader = await self._ensure_catalog()
+            return self.catalog.get_skins(loader)
+        except Exception as e:
+            logger.error(f"Ошибка при получении скинов: {e}")
+            return []
+
+    async def get_catalog_snapshot(self):
+        """Получает (версия каталога, скины в наличии) из кеша каталога"""
+        try:
+            loader = await self._ensure_catalog()
+            return self.catalog.get_snapshot(loader)
+        except Exception as e:
+            logger.error(f"Ошибка при получении каталога: {e}")
+            return None, []
+
+    async def get_search_catalog(self):
+        """Получает (версия текста каталога, все скины по ID) для inline-поиска"""
+        try:
+            loader = await self._ensure_catalog()
+            return self.catalog.get_search_snapshot(loader)
+        except Exception as e:
+            logger.error(f"Ошибка при получении каталога для поиска: {e}")
+            return None, {}
+
+    async def get_skin_by_id(self, skin_id):
+        """Получает скин по ID (из кеша каталога)"""
+        try:
+            loader = await self._ensure_catalog()
+            return self.catalog.get_skin(skin_id, loader)
+        except Exception as e:
+            logger.error(f"Ошибка при получении скина: {e}")
+            return None
+
+    async def get_skins_by_ids(self, skin_ids):
+        """Получает скины по списку ID (из кеша каталога), пропуская удаленные"""
+        skins = []
+        for skin_id in skin_ids:
+            skin = await self.get_skin_by_id(skin_id)
+            if skin:
+                skins.append(skin)
+        return skins
+
+    def _update_cached_stock(self, stock):
+        """Переносит новые остатки и резервы скинов в кеш каталога.
+
+        Вызывается внутри транзакции, пока строки skins заблокированы: кеш
+        обновляется в том же порядке, в каком фиксируются транзакции, и более
+        старые значения не перезапишут новые.
+        """
+        for row in stock:
+            self.catalog.update_skin(row['skin_id'], quantity=row['quantity'], reserved=row['reserved'])
+
+    async def add_skin(self, name, description, price, rarity, roblox_id, image_url, quantity=1):
+        """Добавляет новый скин в базу данных"""
+        try:
+            pool = await self.get_pool()
+            await pool.execute('''
+                INSERT INTO skins (name, description, price, rarity, roblox_id, image_url, quantity)
+                VALUES ($1, $2, $3, $4, $5, $6, $7)
+            ''', name, description, float(price), rarity, roblox_id, image_url, quantity)
+            self.catalog.invalidate()
+            logger.info(f"Скин '{name}' добавлен в базу (количество: {quantity})")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении скина: {e}")
+            return False
+
+    async def import_skins(self, skins):
+        """Добавляет или обновляет скины одной транзакцией (см. Database.import_skins)"""
+        columns = ('name', 'description', 'price', 'rarity', 'image_url', 'quantity', 'roblox_id')
+        try:
+            async with self.transaction() as conn:
+                # Блокировка таблицы не дает параллельному импорту вставить тот же roblox_id
+                await conn.execute('LOCK TABLE skins IN SHARE ROW EXCLUSIVE MODE')
+                existing = {
+                    row['roblox_id'] for row in await conn.fetch(
+                        'SELECT DISTINCT roblox_id FROM skins WHERE roblox_id IS NOT NULL'
+                    )
+                }
+                updates, inserts = split_import(skins, existing)
+
+                await conn.executemany('''
+                    UPDATE skins
+                    SET name = $1, description = $2, price = $3, rarity = $4,
+                        image_url = $5, quantity = GREATEST($6, reserved)
+                    WHERE roblox_id = $7
+                ''', [tuple(skin[column] for column in columns) for skin in updates])
+                await conn.executemany('''
+                    INSERT INTO skins (name, description, price, rarity, image_url, quantity, roblox_id)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7)
+                ''', [tuple(skin[column] for column in columns) for skin in inserts])
+
+            self.catalog.invalidate()
+            logger.info(f"Импорт скинов: добавлено {len(inserts)}, обновлено {len(updates)}")
+            return {'inserted': len(inserts), 'updated': len(updates)}
+        except Exception as e:
+            logger.error(f"Ошибка при импорте скинов: {e}")
+            return None
+
+    async def delete_skin(self, skin_id):
+        """Удаляет скин из каталога"""
+        try:
+            async with self.transaction() as conn:
+                await conn.execute('DELETE FROM skins WHERE skin_id = $1', skin_id)
+                await conn.execute('DELETE FROM user_cart WHERE skin_id = $1', skin_id)
+            self.catalog.remove_skin(skin_id)
+            logger.info(f"Скин {skin_id} удален из каталога")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка при удалении скина: {e}")
+            return False
+
+    # -----------------------ПОИСК------------------------- #
+
+    async def search_skins(self, search_term):
+        """Ищет скины по названию или описанию (все результаты)"""
+        skins, _ = await self.search_skins_page(search_term, page=0, per_page=None)
+        return skins
+
+    async def search_skins_page(self, search_term, page=0, per_page=5):
+        """Ищет скины через полнотекстовый индекс: возвращает (скины страницы, общее количество найденных)"""
+        query = build_tsquery(search_term)
+        if not query:
+            return [], 0
+
+        try:
+            pool = await self.get_pool()
+            total = await pool.fetchval('''
+                SELECT COUNT(*) FROM skins
+                WHERE search_vector @@ to_tsquery('simple', $1) AND quantity > reserved
+            ''', query)
+            if total == 0:
+                return [], 0
+
+            # Совпадение в названии (вес A) весит больше, чем в описании (вес B)
+            skins = await pool.fetch('''
+                SELECT *, quantity - reserved AS available FROM skins
+                WHERE search_vector @@ to_tsquery('simple', $1) AND quantity > reserved
+                ORDER BY ts_rank(search_vector, to_tsquery('simple', $1)) DESC, price ASC, skin_id ASC
+                LIMIT $2 OFFSET $3
+            ''', query, per_page, page_offset(page, per_page))
+            return [self._skin_dict(skin) for skin in skins], total
+        except Exception as e:
+            logger.error(f"Ошибка при поиске скинов: {e}")
+            return [], 0
+
+    async def search_skin_ids(self, search_term):
+        """Ищет скины в наличии и возвращает только их ID в порядке релевантности"""
+        query = build_tsquery(search_term)
+        if not query:
+            return []
+
+        try:
+            pool = await self.get_pool()
+            rows = await pool.fetch('''
+                SELECT skin_id FROM skins
+                WHERE search_vector @@ to_tsquery('simple', $1) AND quantity > reserved
+                ORDER BY ts_rank(search_vector, to_tsquery('simple', $1)) DESC, price ASC, skin_id ASC
+            ''', query)
+            return [row['skin_id'] for row in rows]
+        except Exception as e:
+            logger.error(f"Ошибка при поиске скинов: {e}")
+            return []
+
+    @staticmethod
+    def _skin_dict(record):
+        skin = _to_dict(record)
+        skin.pop('search_vector', None)
+        return skin
+
+    # -----------------------КОРЗИНА------------------------- #
+
+    async def _lock_skins(self, conn, skin_ids):
+        """Блокирует строки скинов по возрастанию skin_id (внутри транзакции).
+
+        Все транзакции, меняющие несколько скинов, сначала берут блокировки
+        здесь, а потом трогают корзины - в одном и том же порядке, иначе две
+        покупки с одинаковыми скинами в разном порядке корзины взаимно
+        блокируются и PostgreSQL прерывает одну из них.
+        """
+        if skin_ids:
+            await conn.execute(
+                'SELECT 1 FROM skins WHERE skin_id = ANY($1::INTEGER[]) ORDER BY skin_id FOR UPDATE',
+                sorted(set(skin_ids))
+            )
+
+    async def _release_reservations(self, conn, user_id, skin_id=None):
+        """Удаляет позиции корзины пользователя (все или одну) и снимает их резервы (внутри транзакции)"""
+        if skin_id is None:
+            cart = await conn.fetch('SELECT skin_id FROM user_cart WHERE user_id = $1', user_id)
+            await self._lock_skins(conn, [row['skin_id'] for row in cart])
+            released = await conn.fetch('DELETE FROM user_cart WHERE user_id = $1 RETURNING skin_id', user_id)
+        else:
+            await self._lock_skins(conn, [skin_id])
+            released = await conn.fetch(
+                'DELETE FROM user_cart WHERE user_id = $1 AND skin_id = $2 RETURNING skin_id',
+                user_id, skin_id
+            )
+
+        stock = []
+        for row in sorted(released, key=lambda row: row['skin_id']):
+            skin = await conn.fetchrow(
+                'UPDATE skins SET reserved = reserved - 1 WHERE skin_id = $1 AND reserved > 0 '
+                'RETURNING skin_id, quantity, reserved',
+                row['skin_id']
+            )
+            if skin:
+                stock.append(dict(skin))
+        return stock
+
+    async def add_to_cart(self, user_id, skin_id):
+        """Добавляет скин в корзину и резервирует единицу товара на CART_RESERVATION_TTL секунд"""
+        try:
+            async with self.transaction() as conn:
+                # Продлевается только резерв добавляемой позиции, остальные истекают в свой срок
+                expires_at = await conn.fetchval('''
+                    INSERT INTO user_cart (user_id, skin_id, expires_at)
+                    VALUES ($1, $2, (now() AT TIME ZONE 'utc') + make_interval(secs => $3))
+                    ON CONFLICT (user_id, skin_id) DO NOTHING
+                    RETURNING expires_at
+                ''', user_id, skin_id, CART_RESERVATION_TTL)
+                if expires_at is None:
+                    return {'success': False, 'reason': 'already_in_cart'}
+
+                row = await conn.fetchrow(
+                    'UPDATE skins SET reserved = reserved + 1 WHERE skin_id = $1 AND quantity - reserved > 0 '
+                    'RETURNING skin_id, quantity, reserved',
+                    skin_id
+                )
+                if not row:
+                    raise CheckoutError('out_of_stock')
+
+                self._update_cached_stock([row])
+            logger.info(f"Скин {skin_id} добавлен в корзину пользователя {user_id} (резерв до {expires_at})")
+            return {'success': True, 'expires_at': _to_text(expires_at)}
+        except CheckoutError as e:
+            return {'success': False, 'reason': e.reason}
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении в корзину: {e}")
+            return {'success': False, 'reason': 'error'}
+
+    async def get_user_cart(self, user_id):
+        """Получает корзину пользователя"""
+        try:
+            pool = await self.get_pool()
+            cart = await pool.fetch('''
+                SELECT uc.*, s.name, s.description, s.price, s.rarity, s.quantity, s.image_url
+                FROM user_cart uc
+                JOIN skins s ON uc.skin_id = s.skin_id
+                WHERE uc.user_id = $1
+                ORDER BY uc.cart_id
+            ''', user_id)
+            return [_to_dict(item) for item in cart]
+        except Exception as e:
+            logger.error(f"Ошибка при получении корзины: {e}")
+            return []
+
+    async def get_cart_count(self, user_id):
+        """Получает количество товаров в корзине"""
+        try:
+            pool = await self.get_pool()
+            return await pool.fetchval('SELECT COUNT(*) FROM user_cart WHERE user_id = $1', user_id)
+        except Exception as e:
+            logger.error(f"Ошибка при получении количества корзины: {e}")
+            return 0
+
+    async def clear_user_cart(self, user_id):
+        """Очищает корзину пользователя и снимает резервы"""
+        try:
+            async with self.transaction() as conn:
+                stock = await self._release_reservations(conn, user_id)
+                self._update_cached_stock(stock)
+            logger.info(f"Корзина пользователя {user_id} очищена")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка при очистке корзины: {e}")
+            return False
+
+    async def remove_from_cart(self, user_id, skin_id):
+        """Удаляет скин из корзины и снимает его резерв"""
+        try:
+            async with self.transaction() as conn:
+                stock = await self._release_reservations(conn, user_id, skin_id)
+                self._update_cached_stock(stock)
+            logger.info(f"Скин {skin_id} удален из корзины пользователя {user_id}")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка при удалении из корзины: {e}")
+            return False
+
+    async def release_expired_reservations(self):
+        """Снимает просроченные резервы корзин одним запросом; возвращает количество позиций"""
+        try:
+            async with self.transaction() as conn:
+                # now() постоянно внутри транзакции: блокируются ровно те скины, резервы которых снимаются
+                expired = await conn.fetch(
+                    "SELECT DISTINCT skin_id FROM user_cart WHERE expires_at <= (now() AT TIME ZONE 'utc')"
+                )
+                await self._lock_skins(conn, [row['skin_id'] for row in expired])
+                rows = await conn.fetch('''
+                    WITH expired AS (
+                        DELETE FROM user_cart
+                        WHERE expires_at <= (now() AT TIME ZONE 'utc')
+                        RETURNING skin_id
+                    ), counts AS (
+                        SELECT skin_id, COUNT(*) AS released FROM expired GROUP BY skin_id
+                    )
+                    UPDATE skins s
+                    SET reserved = GREATEST(s.reserved - c.released, 0)
+                    FROM counts c
+                    WHERE s.skin_id = c.skin_id
+                    RETURNING s.skin_id, s.quantity, s.reserved, c.released
+                ''')
+                self._update_cached_stock(rows)
+            released = sum(row['released'] for row in rows)
+            if released:
+                logger.info(f"Сняты просроченные резервы корзин: {released} позиций, {len(rows)} скинов")
+            return released
+        except Exception as e:
+            logger.error(f"Ошибка при снятии просроченных резервов: {e}")
+            return None
+
+    # -----------------------ОФОРМЛЕНИЕ-ПОКУПКИ------------------------- #
+
+    async def checkout(self, user_id, skin_ids=None):
+        """Покупает скины одной транзакцией (см. Database.checkout)"""
+        from_cart = skin_ids is None
+        try:
+            async with self.transaction() as conn:
+                if from_cart:
+                    rows = await conn.fetch('''
+                        SELECT s.skin_id, s.name, s.price, s.rarity
+                        FROM user_cart uc
+                        JOIN skins s ON uc.skin_id = s.skin_id
+                        WHERE uc.user_id = $1
+                        ORDER BY uc.cart_id
+                    ''', user_id)
+                    if not rows:
+                        raise CheckoutError('empty_cart')
+                else:
+                    rows = []
+                    for skin_id in skin_ids:
+                        row = await conn.fetchrow(
+                            'SELECT skin_id, name, price, rarity FROM skins WHERE skin_id = $1',
+                            skin_id
+                        )
+                        if not row:
+                            raise CheckoutError('skin_not_found', skin_id=skin_id)
+                        rows.append(row)
+
+                # Блокируем все затронутые скины по возрастанию skin_id до любых изменений:
+                # порядок корзины у встречных покупок разный, а порядок блокировок - один
+                await self._lock_skins(conn, [row['skin_id'] for row in rows])
+
+                owned = [
+                    row['skin_id'] for row in await conn.fetch(
+                        'SELECT skin_id FROM user_inventory WHERE user_id = $1', user_id
+                    )
+                ]
+                purchase = Purchase(user_id, rows, owned)
+                items = purchase.items
+
+                if from_cart:
+                    stock = await self._release_reservations(conn, user_id)
+                else:
+                    stock = []
+                    for item in items:
+                        stock += await self._release_reservations(conn, user_id, item['skin_id'])
+
+                if not items:
+                    # Все скины корзины уже куплены: корзина все равно очищается (см. Database.checkout)
+                    self._update_cached_stock(stock)
+                    return {'success': False, 'reason': 'already_owned'}
+
+                for item in purchase.items_in_lock_order():
+                    row = await conn.fetchrow(
+                        'UPDATE skins SET quantity = quantity - 1 WHERE skin_id = $1 AND quantity - reserved > 0 '
+                        'RETURNING skin_id, quantity, reserved',
+                        item['skin_id']
+                    )
+                    if not row:
+                        raise CheckoutError('out_of_stock', skin_id=item['skin_id'], skin_name=item['name'])
+                    item['quantity'] = row['quantity']
+                    stock.append(dict(row))
+
+                balance_kop = await self._apply_balance_delta(
+                    conn, user_id, -purchase.total_kop, 'purchase', purchase.description
+                )
+                if balance_kop is None:
+                    user_balance = await conn.fetchval('SELECT balance_kop FROM users WHERE user_id = $1', user_id)
+                    if user_balance is None:
+                        raise CheckoutError('user_not_found')
+                    raise CheckoutError('insufficient_funds', balance_kop=user_balance, total_kop=purchase.total_kop)
+
+                for item in items:
+                    inventory_id = await conn.fetchval('''
+                        INSERT INTO user_inventory (user_id, skin_id) VALUES ($1, $2)
+                        ON CONFLICT (user_id, skin_id) DO NOTHING
+                        RETURNING inventory_id
+                    ''', user_id, item['skin_id'])
+                    if inventory_id is None:
+                        raise CheckoutError('already_owned', skin_id=item['skin_id'], skin_name=item['name'])
+
+                await conn.executemany(
+                    'INSERT INTO transactions (user_id, amount, type, description) VALUES ($1, $2, $3, $4)',
+                    purchase.transaction_rows()
+                )
+                order_id = await conn.fetchval(
+                    'INSERT INTO orders (user_id, total, items_count) VALUES ($1, $2, $3) RETURNING order_id',
+                    user_id, purchase.total_price, len(items)
+                )
+                await conn.executemany(
+                    'INSERT INTO order_items (order_id, skin_id, skin_name, price, quantity) VALUES ($1, $2, $3, $4, 1)',
+                    purchase.order_item_rows(order_id)
+                )
+
+                self._update_cached_stock(stock)
+            return purchase.result(order_id, balance_kop)
+
+        except CheckoutError as e:
+            return {'success': False, 'reason': e.reason, **e.details}
+        except Exception as e:
+            logger.error(f"Ошибка при оформлении покупки: {e}")
+            return {'success': False, 'reason': 'error'}
+
+    # -----------------------ИНВЕНТАРЬ------------------------- #
+
+    async def add_to_inventory(self, user_id, skin_id):
+        """Добавляет скин в инвентарь пользователя"""
+        try:
+            async with self.transaction() as conn:
+                row = await conn.fetchrow(
+                    'UPDATE skins SET quantity = quantity - 1 WHERE skin_id = $1 AND quantity - reserved > 0 '
+                    'RETURNING skin_id, quantity, reserved',
+                    skin_id
+                )
+                if not row:
+                    return False
+
+                inventory_id = await conn.fetchval('''
+                    INSERT INTO user_inventory (user_id, skin_id) VALUES ($1, $2)
+                    ON CONFLICT (user_id, skin_id) DO NOTHING
+                    RETURNING inventory_id
+                ''', user_id, skin_id)
+                if inventory_id is None:
+                    raise CheckoutError('already_owned')
+
+                self._update_cached_stock([row])
+            logger.info(f"Скин {skin_id} добавлен в инвентарь пользователя {user_id}")
+            return True
+        except CheckoutError:
+            return False
+        except Exception as e:
+            logger.error(f"Ошибка при добавлении в инвентарь: {e}")
+            return False
+
+    async def get_user_inventory(self, user_id):
+        """Получает инвентарь пользователя"""
+        try:
+            pool = await self.get_pool()
+            inventory = await pool.fetch('''
+                SELECT ui.*, s.name, s.description, s.rarity, s.image_url
+                FROM user_inventory ui
+                JOIN skins s ON ui.skin_id = s.skin_id
+                WHERE ui.user_id = $1
+                ORDER BY ui.purchased_at DESC
+            ''', user_id)
+            return [_to_dict(item) for item in inventory]
+        except Exception as e:
+            logger.error(f"Ошибка при получении инвентаря: {e}")
+            return []
+
+    async def get_inventory_with_details(self, user_id):
+        """Получает инвентарь с полной информацией о скинах"""
+        try:
+            pool = await self.get_pool()
+            inventory = await pool.fetch('''
+                SELECT ui.*, s.name, s.description, s.rarity, s.image_url, s.price
+                FROM user_inventory ui
+                JOIN skins s ON ui.skin_id = s.skin_id
+                WHERE ui.user_id = $1
+                ORDER BY ui.purchased_at DESC
+            ''', user_id)
+            return [_to_dict(item) for item in inventory]
+        except Exception as e:
+            logger.error(f"Ошибка при получении инвентаря: {e}")
+            return []
+
+    async def get_inventory_page(self, user_id, page=0, per_page=5):
+        """Получает страницу инвентаря: возвращает (предметы страницы, общее количество)"""
+        try:
+            pool = await self.get_pool()
+            total = await pool.fetchval('''
+                SELECT COUNT(*)
+                FROM user_inventory ui
+                JOIN skins s ON ui.skin_id = s.skin_id
+                WHERE ui.user_id = $1
+            ''', user_id)
+            if total == 0:
+                return [], 0
+
+            inventory = await pool.fetch('''
+                SELECT ui.*, s.name, s.description, s.rarity, s.image_url, s.price
+                FROM user_inventory ui
+                JOIN skins s ON ui.skin_id = s.skin_id
+                WHERE ui.user_id = $1
+                ORDER BY ui.purchased_at DESC, ui.inventory_id DESC
+                LIMIT $2 OFFSET $3
+            ''', user_id, per_page, page_offset(page, per_page))
+            return [_to_dict(item) for item in inventory], total
+        except Exception as e:
+            logger.error(f"Ошибка при получении страницы инвентаря: {e}")
+            return [], 0
+
+    async def remove_from_inventory_mm2(self, user_id, skin_id):
+        """Удаляет скин из инвентаря после вывода в MM2 (без возврата в каталог)"""
+        try:
+            pool = await self.get_pool()
+            status = await pool.execute(
+                'DELETE FROM user_inventory WHERE user_id = $1 AND skin_id = $2',
+                user_id, skin_id
+            )
+            if _status_count(status):
+                logger.info(f"Скин {skin_id} удален из инвентаря пользователя {user_id} (вывод в MM2)")
+                return True
+            return False
+        except Exception as e:
+            logger.error(f"Ошибка при удалении из инвентаря: {e}")
+            return False
+
+    async def get_user_purchases(self, user_id):
+        """Получает историю покупок пользователя"""
+        try:
+            pool = await self.get_pool()
+            purchases = await pool.fetch('''
+                SELECT o.order_id, o.created_at, oi.skin_id, oi.skin_name, oi.price, oi.quantity
+                FROM orders o
+                JOIN order_items oi ON oi.order_id = o.order_id
+                WHERE o.user_id = $1
+                ORDER BY o.created_at DESC, o.order_id DESC
+            ''', user_id)
+            return [_to_dict(purchase) for purchase in purchases]
+        except Exception as e:
+            logger.error(f"Ошибка при получении покупок пользователя: {e}")
+            return []
+
+    # -----------------------СТАТИСТИКА------------------------- #
+
+    async def get_bot_stats(self):
+        """Получает статистику бота"""
+        try:
+            pool = await self.get_pool()
+            return await self._read_bot_stats(pool)
+        except Exception as e:
+            logger.error(f"Ошибка при получении статистики: {e}")
+            return {}
+
+    async def get_detailed_stats(self):
+        """Получает детальную статистику (в транзакции только для чтения, одним снимком)"""
+        try:
+            async with self.analytics_snapshot() as conn:
+                return await self._read_detailed_stats(conn)
+        except Exception as e:
+            logger.error(f"Ошибка при получении детальной статистики: {e}")
+            return {}
+
+    async def _read_bot_stats(self, conn):
+        # conn - соединение или пул (у обоих есть fetchrow)
+        row = await conn.fetchrow('''
+            SELECT
+                (SELECT COUNT(*) FROM users) AS total_users,
+                (SELECT COUNT(*) FROM skins) AS total_skins,
+                (SELECT COALESCE(SUM(items_count), 0) FROM orders) AS total_purchases,
+                (SELECT COALESCE(SUM(total), 0) FROM orders) AS total_revenue
+        ''')
+        return format_bot_stats(**row)
+
+    async def _read_detailed_stats(self, conn):
+        stats = await self._read_bot_stats(conn)
+
+        rarity_stats = await conn.fetch('''
+            SELECT COALESCE(rarity, 'Common') AS rarity, COUNT(*) AS count, ROUND(SUM(price)::NUMERIC, 2)::FLOAT AS total_value
+            FROM skins
+            GROUP BY COALESCE(rarity, 'Common')
+            ORDER BY rarity
+        ''')
+        stats['rarity_stats'] = [dict(row) for row in rarity_stats]
+
+        top_users = await conn.fetch('''
+            SELECT user_id, username, first_name, balance_kop
+            FROM users
+            ORDER BY balance_kop DESC
+            LIMIT 10
+        ''')
+        stats['top_users'] = [dict(row) for row in top_users]
+
+        popular_skins = await conn.fetch('''
+            SELECT s.skin_id, s.name, s.rarity, s.price, SUM(oi.quantity) AS sales_count
+            FROM order_items oi
+            JOIN skins s ON s.skin_id = oi.skin_id
+            GROUP BY s.skin_id
+            ORDER BY sales_count DESC
+            LIMIT 10
+        ''')
+        stats['popular_skins'] = [dict(row) for row in popular_skins]
+
+        return stats
+
+    # -----------------------АРХИВ-ТРАНЗАКЦИЙ------------------------- #
+
+    async def archive_transactions(self, older_than_days=DB_ARCHIVE_AFTER_DAYS, batch_size=DB_ARCHIVE_BATCH):
+        """Переносит транзакции старше older_than_days дней в transactions_archive (см. Database.archive_transactions)"""
+        moved = 0
+        try:
+            while True:
+                # Перенос, итоги и удаление - один запрос в одной транзакции
+                async with self.transaction() as conn:
+                    deleted = await conn.fetchval('''
+                        WITH batch AS (
+                            DELETE FROM transactions
+                            WHERE transaction_id IN (
+                                SELECT transaction_id FROM transactions
+                                WHERE created_at < (now() AT TIME ZONE 'utc') - make_interval(days => $1)
+                                ORDER BY transaction_id
+                                LIMIT $2
+                                FOR UPDATE SKIP LOCKED
+                            )
+                            RETURNING *
+                        ), archived AS (
+                            INSERT INTO transactions_archive (transaction_id, user_id, amount, type, description, created_at)
+                            SELECT transaction_id, user_id, amount, type, description, created_at FROM batch
+                            ON CONFLICT (transaction_id) DO NOTHING
+                        ), rolled_up AS (
+                            INSERT INTO transaction_rollups (user_id, type, month, count, total_amount)
+                            SELECT COALESCE(user_id, 0), COALESCE(type, ''), to_char(created_at, 'YYYY-MM'),
+                                   COUNT(*), COALESCE(SUM(amount), 0)
+                            FROM batch
+                            GROUP BY 1, 2, 3
+                            ON CONFLICT (user_id, type, month) DO UPDATE SET
+                                count = transaction_rollups.count + EXCLUDED.count,
+                                total_amount = transaction_rollups.total_amount + EXCLUDED.total_amount
+                        )
+                        SELECT COUNT(*) FROM batch
+                    ''', older_than_days, batch_size)
+
+                moved += deleted
+                if deleted < batch_size:
+                    break
+
+            logger.info(f"В архив перенесено транзакций: {moved} (старше {older_than_days} дней)")
+            return moved
+        except Exception as e:
+            logger.error(f"Ошибка при архивации транзакций (перенесено {moved}): {e}")
+            return None
+
+    async def get_user_transactions(self, user_id, limit=20, include_archive=False):
+        """Получает последние транзакции пользователя (с include_archive=True - и из архива)"""
+        try:
+            pool = await self.get_pool()
+            archive_part = '''
+                UNION ALL
+                SELECT transaction_id, user_id, amount, type, description, created_at, 1 AS archived
+                FROM transactions_archive WHERE user_id = $1
+            ''' if include_archive else ''
+            rows = await pool.fetch(f'''
+                SELECT transaction_id, user_id, amount, type, description, created_at, 0 AS archived
+                FROM transactions WHERE user_id = $1
+                {archive_part}
+                ORDER BY created_at DESC, transaction_id DESC
+                LIMIT $2
+            ''', user_id, limit)
+            return [_to_dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Ошибка при получении транзакций пользователя: {e}")
+            return []
+
+    async def get_transaction_totals(self, user_id=None):
+        """Итоги транзакций по типам за все время (основная таблица + итоги архива)"""
+        try:
+            async with self.analytics_snapshot() as conn:
+                rows = await conn.fetch('''
+                    SELECT type, SUM(count)::BIGINT AS count, ROUND(SUM(total)::NUMERIC, 2)::FLOAT AS total
+                    FROM (
+                        SELECT COALESCE(type, '') AS type, COUNT(*) AS count, COALESCE(SUM(amount), 0) AS total
+                        FROM transactions
+                        WHERE $1::BIGINT IS NULL OR user_id = $1
+                        GROUP BY 1
+                        UNION ALL
+                        SELECT type, SUM(count), SUM(total_amount)
+                        FROM transaction_rollups
+                        WHERE $1::BIGINT IS NULL OR user_id = $1
+                        GROUP BY type
+                    ) totals
+                    GROUP BY type
+                    ORDER BY type
+                ''', user_id)
+                return [dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Ошибка при получении итогов транзакций: {e}")
+            return []
+
+    async def get_archive_stats(self):
+        """Размеры основной таблицы транзакций и архива"""
+        try:
+            async with self.analytics_snapshot() as conn:
+                row = await conn.fetchrow('''
+                    SELECT
+                        (SELECT COUNT(*) FROM transactions) AS hot_rows,
+                        (SELECT MIN(created_at) FROM transactions) AS oldest_hot,
+                        (SELECT COUNT(*) FROM transactions_archive) AS archived_rows,
+                        (SELECT COUNT(*) FROM transaction_rollups) AS rollup_rows
+                ''')
+                return _to_dict(row)
+        except Exception as e:
+            logger.error(f"Ошибка при получении статистики архива: {e}")
+            return {}
+
+    async def rebuild_stats(self):
+        """Пересчитывать нечего: статистика PostgreSQL считается по таблицам при каждом запросе.
+
+        Проверяет, что запросы статистики выполняются, и возвращает {} (расхождений
+        нет, как у Database.rebuild_stats) или False при ошибке.
+        """
+        try:
+            async with self.analytics_snapshot() as conn:
+                await self._read_bot_stats(conn)
+            logger.info("Статистика PostgreSQL считается по данным, пересчет не нужен")
+            return {}
+        except Exception as e:
+            logger.error(f"Ошибка при проверке статистики: {e}")
+            return False
+
+
+# -----------------------ПЕРЕНОС-ДАННЫХ------------------------- #
+
+async def copy_from_sqlite(sqlite_conn, dsn, truncate=False):
+    """Переносит данные из SQLite-базы бота в PostgreSQL.
+
+    Схема в PostgreSQL создается при необходимости. Все таблицы переносятся
+    одной транзакцией; при ошибке PostgreSQL остается без изменений.
+    Дубликаты, запрещенные уникальными индексами PostgreSQL (один скин дважды
+    в инвентаре или корзине), пропускаются. Возвращает
+    {таблица: (строк в SQLite, строк в PostgreSQL)}.
+    """
+    if asyncpg is None:
+        raise RuntimeError("Для переноса в PostgreSQL установите asyncpg: pip install -r requirements-postgres.txt")
+
+    database = PostgresDatabase(dsn, min_size=1, max_size=2)
+    report = {}
+    try:
+        async with database.transaction() as conn:
+            if truncate:
+                await conn.execute(
+                    f"TRUNCATE {', '.join(table for table, _, _ in TABLES)} RESTART IDENTITY"
+                )
+
+            for table, source, serial_column in TABLES:
+                pg_columns = {
+                    row['column_name']: row['data_type'] for row in await conn.fetch(
+                        'SELECT column_name, data_type FROM information_schema.columns '
+                        'WHERE table_schema = current_schema() AND table_name = $1',
+                        table
+                    )
+                }
+                # Архив транзакций - таблица подключенной (ATTACH) базы archive
+                schema, _, source_table = source.rpartition('.')
+                pragma = f'PRAGMA {schema}.table_info({source_table})' if schema else f'PRAGMA table_info({source_table})'
+                sqlite_columns = [row[1] for row in sqlite_conn.execute(pragma)]
+                columns = [
+                    column for column in sqlite_columns
+                    if column in pg_columns and column not in GENERATED_COLUMNS
+                ]
+                if not columns:
+                    report[table] = (0, 0)
+                    continue
+
+                timestamp_columns = {
+                    index for index, column in enumerate(columns)
+                    if pg_columns[column].startswith('timestamp')
+                }
+                rows = []
+                for row in sqlite_conn.execute(f"SELECT {', '.join(columns)} FROM {source}"):
+                    rows.append(tuple(
+                        datetime.fromisoformat(value) if index in timestamp_columns and isinstance(value, str) else value
+                        for index, value in enumerate(row)
+                    ))
+
+                placeholders = ', '.join(f'${index}' for index in range(1, len(columns) + 1))
+                await conn.executemany(
+                    f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders}) ON CONFLICT DO NOTHING",
+                    rows
+                )
+
+                if serial_column:
+                    await conn.execute(f'''
+                        SELECT setval(
+                            pg_get_serial_sequence('{table}', '{serial_column}'),
+                            COALESCE(MAX({serial_column}), 1),
+                            MAX({serial_column}) IS NOT NULL
+                        ) FROM {table}
+                    ''')
+
+                report[table] = (len(rows), await conn.fetchval(f'SELECT COUNT(*) FROM {table}'))
+                logger.info(f"Перенесена таблица {table}: {report[table][1]} из {len(rows)} строк")
+    finally:
+        await database.close()
+
+    return report
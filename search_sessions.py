@@ -0,0 +1,59 @@
+import time
+import secrets
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Время жизни результатов поиска и максимальное количество хранимых сессий
+SEARCH_SESSION_TTL = 30 * 60
+SEARCH_SESSION_MAX = 10000
+
+
+class SearchSessionStore:
+    """Хранилище результатов поиска по коротким токенам.
+
+    В callback_data кнопок пагинации передается только токен и номер
+    страницы (search_page_2_Ab3dE9xY), а не сам поисковый запрос, поэтому
+    лимит Telegram в 64 байта не зависит от длины запроса.
+    """
+
+    def __init__(self, ttl=SEARCH_SESSION_TTL, max_size=SEARCH_SESSION_MAX):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, search_term, skin_ids):
+        """Сохраняет результаты поиска и возвращает токен сессии"""
+        token = secrets.token_urlsafe(6)  # 8 символов [A-Za-z0-9_-]
+
+        with self._lock:
+            self._sessions[token] = {
+                'search_term': search_term,
+                'skin_ids': list(skin_ids),
+                'expires_at': time.monotonic() + self.ttl,
+            }
+            # Вытесняем самые старые сессии
+            while len(self._sessions) > self.max_size:
+                self._sessions.popitem(last=False)
+
+        return token
+
+    def get(self, token):
+        """Возвращает сессию поиска или None, если токен неизвестен или истек"""
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None:
+                return None
+
+            if session['expires_at'] < time.monotonic():
+                del self._sessions[token]
+                return None
+
+            self._sessions.move_to_end(token)
+            return session
+
+    def __len__(self):
+        return len(self._sessions)
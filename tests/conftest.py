@@ -0,0 +1,21 @@
+import pytest
+
+from database import Database
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Чистая база SQLite с примененными миграциями"""
+    database = Database(str(tmp_path / 'test.db'))
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def make_skin(db):
+    """Добавляет скин и возвращает его skin_id"""
+    def make(name='Нож', price=100, rarity='Godly', quantity=1):
+        assert db.add_skin(name, 'описание', price, rarity, f"rbx-{name}", None, quantity)
+        with db.get_connection() as conn:
+            return conn.execute('SELECT MAX(skin_id) FROM skins').fetchone()[0]
+    return make
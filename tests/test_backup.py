@@ -0,0 +1,47 @@
+import sqlite3
+
+import pytest
+
+import backup
+
+
+@pytest.fixture(autouse=True)
+def last_results(monkeypatch):
+    results = {}
+    monkeypatch.setattr(backup, 'last_results', results)
+    return results
+
+
+def make_database(path):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE t (x INTEGER)')
+    conn.commit()
+    conn.close()
+    return str(path)
+
+
+def test_failed_backup_status_is_kept_per_database(tmp_path):
+    main_db = str(tmp_path / 'skins_bot.db')  # файла нет - копия не снимется
+    archive_db = make_database(tmp_path / 'skins_bot_archive.db')
+    backup_dir = str(tmp_path / 'backups')
+
+    assert backup.run_backup(main_db, backup_dir) is None
+    assert backup.run_backup(archive_db, backup_dir, compress=False)
+
+    main_status = backup.get_backup_status(main_db, backup_dir)
+    archive_status = backup.get_backup_status(archive_db, backup_dir)
+    assert 'не найдена' in main_status['last_error']
+    assert main_status['count'] == 0
+    assert archive_status['last_error'] is None
+    assert archive_status['count'] == 1
+
+
+def test_successful_backup_clears_error(tmp_path):
+    db_path = str(tmp_path / 'skins_bot.db')
+    backup_dir = str(tmp_path / 'backups')
+
+    assert backup.run_backup(db_path, backup_dir) is None
+    make_database(db_path)
+    assert backup.run_backup(db_path, backup_dir, compress=False)
+
+    assert backup.get_backup_status(db_path, backup_dir)['last_error'] is None
@@ -0,0 +1,84 @@
+def expire(db, user_id, skin_id, expires_at='2000-01-01 00:00:00'):
+    with db.get_connection() as conn:
+        conn.execute('UPDATE user_cart SET expires_at = ? WHERE user_id = ? AND skin_id = ?',
+                     (expires_at, user_id, skin_id))
+        conn.commit()
+
+
+def cart_expiry(db, user_id):
+    with db.get_connection() as conn:
+        rows = conn.execute('SELECT skin_id, expires_at FROM user_cart WHERE user_id = ?', (user_id,))
+        return {row['skin_id']: row['expires_at'] for row in rows}
+
+
+def reserved(db, skin_id):
+    with db.get_connection() as conn:
+        return conn.execute('SELECT reserved FROM skins WHERE skin_id = ?', (skin_id,)).fetchone()[0]
+
+
+def test_add_to_cart_reserves_stock(db, make_skin):
+    skin_id = make_skin(quantity=1)
+
+    assert db.add_to_cart(1, skin_id)['success']
+    assert reserved(db, skin_id) == 1
+    assert db.get_skin_by_id(skin_id)['available'] == 0
+
+    assert db.add_to_cart(1, skin_id) == {'success': False, 'reason': 'already_in_cart'}
+    assert db.add_to_cart(2, skin_id) == {'success': False, 'reason': 'out_of_stock'}
+
+
+def test_add_to_cart_does_not_extend_other_items(db, make_skin):
+    first, second = make_skin('Нож'), make_skin('Меч')
+    assert db.add_to_cart(1, first)['success']
+    expire(db, 1, first, '2000-01-01 00:00:00')
+
+    result = db.add_to_cart(1, second)
+
+    assert result['success']
+    expiry = cart_expiry(db, 1)
+    assert expiry[first] == '2000-01-01 00:00:00'
+    assert expiry[second] == result['expires_at'] > '2000-01-01 00:00:00'
+
+
+def test_release_expired_reservations(db, make_skin):
+    expired, active = make_skin('Нож'), make_skin('Меч')
+    assert db.add_to_cart(1, expired)['success']
+    assert db.add_to_cart(1, active)['success']
+    expire(db, 1, expired)
+
+    assert db.release_expired_reservations() == 1
+
+    assert set(cart_expiry(db, 1)) == {active}
+    assert reserved(db, expired) == 0
+    assert reserved(db, active) == 1
+    assert db.get_skin_by_id(expired)['available'] == 1
+    assert db.get_skin_by_id(active)['available'] == 0
+    assert db.release_expired_reservations() == 0
+
+
+def test_released_stock_can_be_reserved_again(db, make_skin):
+    skin_id = make_skin(quantity=1)
+    assert db.add_to_cart(1, skin_id)['success']
+    assert db.add_to_cart(2, skin_id)['reason'] == 'out_of_stock'
+
+    expire(db, 1, skin_id)
+    db.release_expired_reservations()
+
+    assert db.add_to_cart(2, skin_id)['success']
+    assert db.get_cart_count(1) == 0
+    assert db.get_cart_count(2) == 1
+
+
+def test_checkout_of_owned_cart_releases_reservations(db, make_skin):
+    skin_id = make_skin(quantity=2)
+    db.add_user(1, 'user1', 'Имя')
+    db.flush_writes()
+    assert db.add_to_inventory(1, skin_id)
+    assert db.add_to_cart(1, skin_id)['success']
+    assert reserved(db, skin_id) == 1
+
+    assert db.checkout(1) == {'success': False, 'reason': 'already_owned'}
+
+    assert db.get_cart_count(1) == 0
+    assert reserved(db, skin_id) == 0
+    assert db.get_skin_by_id(skin_id)['available'] == 1
@@ -0,0 +1,51 @@
+import sqlite3
+
+import pytest
+
+from db_pool import ConnectionPool
+
+
+@pytest.fixture
+def pools(tmp_path):
+    """Два пула на одну базу: без ожидания блокировки и с одним быстрым повтором"""
+    path = str(tmp_path / 'pool.db')
+    pools = [ConnectionPool(path, busy_timeout_ms=0, lock_retries=1) for _ in range(2)]
+    for pool in pools:
+        pool.get_connection().retry_base_delay = 0.001
+    conn = pools[0].get_connection()
+    conn.execute('CREATE TABLE t (x INTEGER)')
+    conn.execute('INSERT INTO t VALUES (1)')
+    conn.commit()
+    yield pools
+    for pool in pools:
+        pool.close_all()
+
+
+def test_lock_outside_transaction_is_retried(pools):
+    reader, writer = pools
+    writer.get_connection().execute('BEGIN IMMEDIATE')
+
+    with pytest.raises(sqlite3.OperationalError, match='locked'):
+        reader.get_connection().execute('BEGIN IMMEDIATE')
+
+    assert reader.stats.lock_waits == 1
+    assert reader.stats.lock_failures == 1
+
+
+def test_stale_snapshot_is_not_retried(pools):
+    reader, writer = pools
+    conn = reader.get_connection()
+    conn.execute('BEGIN')
+    conn.execute('SELECT * FROM t').fetchall()
+
+    other = writer.get_connection()
+    other.execute('UPDATE t SET x = 2')
+    other.commit()
+
+    # Снимок чтения устарел: запись в этой транзакции невозможна, повтор бесполезен
+    with pytest.raises(sqlite3.OperationalError, match='locked'):
+        conn.execute('UPDATE t SET x = 3')
+
+    assert reader.stats.lock_waits == 0
+    assert reader.stats.lock_failures == 1
+    conn.rollback()
@@ -0,0 +1,182 @@
+"""Тесты PostgresDatabase на настоящем PostgreSQL.
+
+Запускаются, только если установлен asyncpg (requirements-dev.txt) и задан
+TEST_DATABASE_URL, иначе пропускаются. Перед каждым тестом ВСЕ таблицы бота
+в этой базе очищаются - не указывайте рабочую базу:
+
+    TEST_DATABASE_URL=postgresql://postgres@127.0.0.1:5432/bot_test python -m pytest -q
+"""
+import os
+import asyncio
+
+import pytest
+
+pytest.importorskip('asyncpg')
+
+from database import Database
+from pg_database import PostgresDatabase, TABLES, copy_from_sqlite
+
+TEST_DATABASE_URL = os.getenv('TEST_DATABASE_URL')
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL не задан")
+
+
+def run(test):
+    """Выполняет корутину test(db) на очищенной базе TEST_DATABASE_URL"""
+    async def main():
+        db = PostgresDatabase(TEST_DATABASE_URL, min_size=1, max_size=4)
+        try:
+            async with db.transaction() as conn:
+                await conn.execute(f"TRUNCATE {', '.join(table for table, _, _ in TABLES)} RESTART IDENTITY")
+            db.catalog.invalidate()
+            await test(db)
+        finally:
+            await db.close()
+    asyncio.run(main())
+
+
+async def make_skin(db, name='Нож', price=100, quantity=1):
+    assert await db.add_skin(name, 'описание', price, 'Godly', f"rbx-{name}", None, quantity)
+    async with db.transaction() as conn:
+        return await conn.fetchval('SELECT MAX(skin_id) FROM skins')
+
+
+async def make_user(db, user_id, balance=0):
+    await db.add_user(user_id, f"user{user_id}", 'Имя')
+    if balance:
+        assert await db.update_user_balance(user_id, balance)
+
+
+async def expire(db, user_id, skin_id):
+    async with db.transaction() as conn:
+        await conn.execute(
+            "UPDATE user_cart SET expires_at = '2000-01-01 00:00:00' WHERE user_id = $1 AND skin_id = $2",
+            user_id, skin_id
+        )
+
+
+def test_add_to_cart_reserves_and_expires():
+    async def test(db):
+        expired, active = await make_skin(db, 'Нож'), await make_skin(db, 'Меч')
+        assert (await db.add_to_cart(1, expired))['success']
+        assert (await db.add_to_cart(1, active))['success']
+        assert await db.add_to_cart(1, expired) == {'success': False, 'reason': 'already_in_cart'}
+        assert await db.add_to_cart(2, expired) == {'success': False, 'reason': 'out_of_stock'}
+
+        await expire(db, 1, expired)
+        assert await db.release_expired_reservations() == 1
+        assert await db.release_expired_reservations() == 0
+
+        assert [item['skin_id'] for item in await db.get_user_cart(1)] == [active]
+        assert (await db.get_skin_by_id(expired))['available'] == 1
+        assert (await db.add_to_cart(2, expired))['success']
+    run(test)
+
+
+def test_checkout_buys_cart():
+    async def test(db):
+        await make_user(db, 1, balance=250)
+        knife, sword = await make_skin(db, 'Нож', price=100), await make_skin(db, 'Меч', price=100.5)
+        await db.add_to_cart(1, knife)
+        await db.add_to_cart(1, sword)
+
+        result = await db.checkout(1)
+
+        assert result['success']
+        assert result['total_kop'] == 20050
+        assert result['balance_kop'] == await db.get_balance(1) == 4950
+        assert {item['skin_id'] for item in await db.get_user_inventory(1)} == {knife, sword}
+        assert await db.get_cart_count(1) == 0
+        assert await db.checkout(1) == {'success': False, 'reason': 'empty_cart'}
+        assert (await db.checkout(1, [knife]))['reason'] == 'already_owned'
+    run(test)
+
+
+def test_checkout_rejects_insufficient_funds():
+    async def test(db):
+        await make_user(db, 1, balance=50)
+        skin_id = await make_skin(db, price=100)
+        await db.add_to_cart(1, skin_id)
+
+        result = await db.checkout(1)
+
+        assert result == {'success': False, 'reason': 'insufficient_funds', 'balance_kop': 5000, 'total_kop': 10000}
+        assert await db.get_cart_count(1) == 1
+        assert await db.get_user_inventory(1) == []
+    run(test)
+
+
+def test_concurrent_checkouts_in_opposite_order():
+    async def test(db):
+        await make_user(db, 1, balance=1000)
+        await make_user(db, 2, balance=1000)
+        skin_ids = [await make_skin(db, f"Нож {i}", price=10, quantity=100) for i in range(5)]
+
+        # Взаимная блокировка проявляется не в каждом раунде
+        for _ in range(10):
+            for skin_id in skin_ids:
+                await db.add_to_cart(1, skin_id)
+            for skin_id in reversed(skin_ids):
+                await db.add_to_cart(2, skin_id)
+
+            results = await asyncio.gather(db.checkout(1), db.checkout(2))
+
+            assert [result['success'] for result in results] == [True, True]
+            async with db.transaction() as conn:
+                await conn.execute('DELETE FROM user_inventory')
+
+        assert [(await db.get_skin_by_id(skin_id))['quantity'] for skin_id in skin_ids] == [80] * 5
+    run(test)
+
+
+def test_rebuild_stats():
+    async def test(db):
+        await make_user(db, 1, balance=100)
+        skin_id = await make_skin(db)
+        await db.add_to_cart(1, skin_id)
+        await db.checkout(1)
+
+        assert await db.rebuild_stats() == {}
+        assert await db.get_bot_stats() == {
+            'total_users': 1, 'total_skins': 1, 'total_purchases': 1, 'total_revenue': 100.0,
+        }
+    run(test)
+
+
+def test_checkout_of_owned_cart_releases_reservations():
+    async def test(db):
+        await make_user(db, 1)
+        skin_id = await make_skin(db, quantity=2)
+        assert await db.add_to_inventory(1, skin_id)
+        assert (await db.add_to_cart(1, skin_id))['success']
+
+        assert await db.checkout(1) == {'success': False, 'reason': 'already_owned'}
+
+        assert await db.get_cart_count(1) == 0
+        assert (await db.get_skin_by_id(skin_id))['available'] == 1
+    run(test)
+
+
+def test_copy_from_sqlite_ignores_tables_in_other_schemas(tmp_path):
+    sqlite_db = Database(str(tmp_path / 'source.db'))
+    sqlite_db.add_user(1, 'user1', 'Имя')
+    sqlite_db.flush_writes()
+
+    async def test(db):
+        async with db.transaction() as conn:
+            # Таблица с тем же именем в другой схеме, и created_at там - текст, а не timestamp
+            await conn.execute('DROP SCHEMA IF EXISTS copy_test_other CASCADE')
+            await conn.execute('CREATE SCHEMA copy_test_other')
+            await conn.execute('CREATE TABLE copy_test_other.users (user_id BIGINT, created_at TEXT)')
+        try:
+            report = await copy_from_sqlite(sqlite_db.get_connection(), TEST_DATABASE_URL, truncate=True)
+        finally:
+            async with db.transaction() as conn:
+                await conn.execute('DROP SCHEMA copy_test_other CASCADE')
+
+        assert report['users'] == (1, 1)
+        assert (await db.get_user(1))['username'] == 'user1'
+    try:
+        run(test)
+    finally:
+        sqlite_db.close()
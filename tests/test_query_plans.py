@@ -0,0 +1,56 @@
+import pytest
+
+from db_profiler import check_plans, PlanRegressionError
+
+
+@pytest.fixture
+def profiler(db, monkeypatch):
+    """Профилировщик базы db в режиме DB_PLAN_ASSERT=1"""
+    if db.profiler is None:
+        pytest.skip("профилирование выключено (DB_PROFILE=0)")
+    monkeypatch.setattr(db.profiler, 'assert_plans', True)
+    monkeypatch.setattr(db.profiler, '_checked_plans', set())
+    return db.profiler
+
+
+def drop_index(db, name):
+    with db.get_connection() as conn:
+        conn.execute(f'DROP INDEX {name}')
+
+
+def test_hot_queries_use_indexes(db, make_skin):
+    assert check_plans(db.get_connection()) == []
+    db.assert_query_plans()
+
+
+def test_dropped_index_is_reported(db):
+    drop_index(db, 'idx_user_cart_user_skin')
+
+    violations = check_plans(db.get_connection())
+
+    assert {violation['name'] for violation in violations} >= {'cart', 'cart_count'}
+    with pytest.raises(PlanRegressionError, match='cart'):
+        db.assert_query_plans()
+
+
+def test_plan_assert_fails_hot_query(db, make_skin, profiler):
+    skin_id = make_skin()
+    assert db.add_to_cart(1, skin_id)['success']
+    # План каждого запроса проверяется один раз, поэтому индекс удаляется до первого чтения корзины
+    drop_index(db, 'idx_user_cart_user_skin')
+
+    with pytest.raises(PlanRegressionError, match='cart'):
+        db.get_user_cart(1)
+    assert 'cart' in profiler.get_stats()['plan_violations']
+
+
+def test_executemany_is_profiled(db, monkeypatch):
+    if db.profiler is None:
+        pytest.skip("профилирование выключено (DB_PROFILE=0)")
+    monkeypatch.setattr(db.profiler, 'slow_query_ms', 0)
+    slow_statements = db.profiler.slow_statements
+
+    with db.get_connection() as conn:
+        conn.executemany('INSERT INTO users (user_id, username) VALUES (?, ?)', [(1, 'a'), (2, 'b')])
+
+    assert db.profiler.slow_statements == slow_statements + 1
@@ -0,0 +1,53 @@
+from database import Database, AsyncDatabase
+from pg_database import PostgresDatabase
+from storage import Storage, Purchase, CreditBatch, page_offset
+
+
+def test_backends_implement_storage():
+    assert not AsyncDatabase.__abstractmethods__
+    assert not PostgresDatabase.__abstractmethods__
+    for name in Storage.__abstractmethods__:
+        assert callable(getattr(Database, name, None)), name
+
+
+def test_purchase_skips_owned_and_duplicates():
+    rows = [
+        {'skin_id': 3, 'name': 'Нож', 'price': 100.1},
+        {'skin_id': 1, 'name': 'Меч', 'price': 0.2},
+        {'skin_id': 3, 'name': 'Нож', 'price': 100.1},
+        {'skin_id': 2, 'name': 'Лук', 'price': 5},
+    ]
+
+    purchase = Purchase(7, rows, owned=[2])
+
+    assert [item['skin_id'] for item in purchase.items] == [3, 1]
+    assert [item['skin_id'] for item in purchase.items_in_lock_order()] == [1, 3]
+    assert purchase.total_kop == 10030
+    assert purchase.description == "Покупка: Нож, Меч"
+    assert purchase.order_item_rows(5) == [(5, 3, 'Нож', 100.1), (5, 1, 'Меч', 0.2)]
+
+
+def test_purchase_of_owned_skins_is_empty():
+    purchase = Purchase(7, [{'skin_id': 1, 'name': 'Меч', 'price': 1}], owned=[1])
+
+    assert purchase.items == []
+    assert purchase.total_kop == 0
+
+
+def test_credit_batch():
+    batch = CreditBatch()
+    batch.add_applied({'user_id': 1, 'delta_kop': 1050, 'note': None, 'line': 1})
+    batch.add_failed({'user_id': 2, 'delta_kop': -100, 'note': 'штраф', 'line': 2}, user_exists=False)
+
+    assert batch.transaction_rows() == [(1, 10.5, 'bulk_credit', "Пакетное изменение баланса")]
+    result = batch.result()
+    assert result['applied'] == 1
+    assert result['total_kop'] == 1050
+    assert result['failed'][0]['error'] == "пользователь не найден"
+
+
+def test_page_offset():
+    assert page_offset(2, 5) == 10
+    assert page_offset(-1, 5) == 0
+    assert page_offset(3, None) == 0
+    assert page_offset(3, -1) == 0